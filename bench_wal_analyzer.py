@@ -0,0 +1,388 @@
+"""
+Офлайн-бенчмарки анализатора (PostgreSQL не нужен): поток wal2json или
+test_decoding берётся из детерминированного генератора walgen, каждый бенчмарк работает во временном
+каталоге со своим wal_analyzer.db.
+
+    python bench_wal_analyzer.py                          # все бенчмарки
+    python bench_wal_analyzer.py masking parse            # выбранные по имени
+    python bench_wal_analyzer.py --transactions 20000 --output bench_new.json
+    python bench_wal_analyzer.py --compare bench_old.json # сравнение с прошлым прогоном
+
+Пиковая память (peak_mb, tracemalloc) снимается отдельным прогоном, чтобы
+трассировка не искажала скорость; --no-memory его отключает.
+"""
+import argparse
+import contextlib
+import inspect
+import json
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from walgen import WalGenerator
+
+BENCHMARKS = {}
+DEFAULT_TRANSACTIONS = 2000
+# метрики, по которым сравниваются прогоны: больше — лучше / меньше — лучше
+HIGHER_IS_BETTER = ("_per_s", "mb_s", "speedup")
+LOWER_IS_BETTER = ("seconds", "peak_mb")
+
+
+_memory_base = 0
+
+
+def _setup_done():
+    """Конец подготовки данных бенчмарка: пиковая память считается от этой точки."""
+    global _memory_base
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        _memory_base = tracemalloc.get_traced_memory()[0]
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__.removeprefix("bench_")] = fn
+    return fn
+
+
+def _legacy_mask(val: str) -> str:
+    # прежняя посимвольная маска ReportBuilder.mask_fields — для сравнения
+    masked = []
+    for ch in val:
+        if ch.isupper() or ch.isdigit():
+            masked.append('#')
+        elif ch.islower():
+            masked.append('*')
+        else:
+            masked.append(ch)
+    return "".join(masked)
+
+
+@benchmark
+def bench_masking(total_mb: float = 8.0, value_size: int = 15000) -> dict:
+    """Скорость маскирования (МБ/с) на значениях размера как у random_ops (15 КБ)."""
+    from masking import Masker
+
+    rnd = random.Random(42)
+    alphabet = string.ascii_letters + string.digits + " .,-абвгдеёжзАБВГДЕЁЖЗ"
+    values = ["".join(rnd.choices(alphabet, k=value_size))
+              for _ in range(max(1, int(total_mb * 1024 * 1024 / value_size)))]
+    size_mb = sum(len(v.encode("utf-8")) for v in values) / (1024 * 1024)
+
+    masker = Masker.from_config("text")
+    _setup_done()
+    start = time.perf_counter()
+    for value in values:
+        masker.mask_row({"id": 1, "text": value})
+    translate_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for value in values:
+        _legacy_mask(value)
+    legacy_s = time.perf_counter() - start
+
+    return {
+        "size_mb": round(size_mb, 2),
+        "translate_mb_s": round(size_mb / translate_s, 1),
+        "legacy_mb_s": round(size_mb / legacy_s, 1),
+        "speedup": round(legacy_s / translate_s, 1),
+    }
+
+
+class _RowsCursor:
+    """Курсор-заглушка: peek/get_changes отдаёт заранее сгенерированные строки, прочее — пусто."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.result = []
+
+    def __enter__(self): return self
+    def __exit__(self, *args): pass
+
+    def execute(self, query, params=None):
+        self.result = self.rows if "_changes" in query else []
+
+    def fetchall(self): return list(self.result)
+    def fetchone(self): return None
+    def __iter__(self): return iter(self.result)
+
+
+class _RowsConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self): return self
+    def __exit__(self, *args): pass
+    def cursor(self): return _RowsCursor(self.rows)
+
+
+@contextlib.contextmanager
+def _workdir():
+    """Временный рабочий каталог: wal_analyzer.db, спул и отчёты бенчмарка."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="walbench_") as path:
+        os.chdir(path)
+        try:
+            yield path
+        finally:
+            os.chdir(cwd)
+
+
+def _slot(analysis_type: str, rows: list, **overrides):
+    from logical_slot import LogicalSlot
+    from relcache import Relation
+
+    slot_config = {"slot_name": "bench_slot", "plugin": "wal2json", "analysis_type": analysis_type,
+                   "period_hours": 3600, "tables": [], "operations": [], "summary_pdf": 1,
+                   "summary_html": 1, "history_table": "", "history_value": "", "masks_fields": "",
+                   "save_target": "disk", "disk_path": os.getcwd(), "report_cache": False,
+                   "render_workers": 1}
+    slot_config.update(overrides)
+    with contextlib.redirect_stdout(None):
+        slot = LogicalSlot({"dbname": "bench", "user": "bench", "password": "bench"}, slot_config)
+    slot._connect = lambda: _RowsConnection(rows)
+    # метаданные таблиц генератора — вместо запроса к pg_catalog
+    for table in WalGenerator().tables:
+        slot.relations.relations[(table.schema, table.name)] = Relation(
+            [name for name, _, _ in table.columns], [col_type for _, col_type, _ in table.columns], ["id"])
+    return slot
+
+
+def _generate(transactions: int, **kwargs):
+    rows = list(WalGenerator(**kwargs).rows(transactions))
+    size_mb = sum(len(data.encode("utf-8")) for data, _ in rows) / (1024 * 1024)
+    return rows, size_mb
+
+
+def _spool(rows: list, path: str) -> int:
+    """Пишет события потока в формате спула (как fetch_events); возвращает их число."""
+    _slot("full", rows).fetch_events(output_file=path)
+    with open(path, "r", encoding="utf-8") as f:
+        return sum(1 for _ in f)
+
+
+@benchmark
+def bench_parse(transactions: int = DEFAULT_TRANSACTIONS) -> dict:
+    """Цикл выборки fetch_events: разбор wal2json, ключи, запись спула, водяной знак."""
+    rows, size_mb = _generate(transactions)
+    with _workdir():
+        slot = _slot("full", rows)
+        _setup_done()
+        start = time.perf_counter()
+        slot.fetch_events(output_file="events_full.jsonl")
+        seconds = time.perf_counter() - start
+        with open("events_full.jsonl", "r", encoding="utf-8") as f:
+            events = sum(1 for _ in f)
+    return {"rows": len(rows), "events": events, "size_mb": round(size_mb, 2), "seconds": round(seconds, 3),
+            "rows_per_s": round(len(rows) / seconds), "events_per_s": round(events / seconds),
+            "mb_s": round(size_mb / seconds, 1)}
+
+
+@benchmark
+def bench_filtering(transactions: int = DEFAULT_TRANSACTIONS) -> dict:
+    """Фильтр по таблицам, операциям и Id на уже разобранных изменениях."""
+    from logical_slot import LogicalSlot
+
+    rows, _ = _generate(transactions)
+    changes = [tx for data, _ in rows for tx in json.loads(data)["change"]]
+    cases = {
+        "tables_ops": {"tables": ["orders", "customers"], "ops": ["INSERT", "UPDATE"]},
+        "ids": {"tables": ["orders"], "ops": [], "ids": ["17", "256", "1024"]},
+    }
+    result = {"changes": len(changes)}
+    for case, filters in cases.items():
+        _setup_done()
+        start = time.perf_counter()
+        passed = sum(1 for tx in changes if LogicalSlot._passes_filters(tx, filters))
+        seconds = time.perf_counter() - start
+        result[f"{case}_passed"] = passed
+        result[f"{case}_changes_per_s"] = round(len(changes) / seconds)
+    return result
+
+
+@benchmark
+def bench_aggregate(transactions: int = DEFAULT_TRANSACTIONS) -> dict:
+    """aggregate_jsonl_to_sqlite: агрегаты сводки из спула в SQLite."""
+    from metabd import DB_FILE, aggregate_jsonl_to_sqlite
+
+    rows, _ = _generate(transactions)
+    with _workdir():
+        events = _spool(rows, "spool.jsonl")
+        _setup_done()
+        start = time.perf_counter()
+        aggregate_jsonl_to_sqlite("spool.jsonl", DB_FILE, "bench_slot", 3600)
+        seconds = time.perf_counter() - start
+    return {"events": events, "seconds": round(seconds, 3), "events_per_s": round(events / seconds)}
+
+
+@benchmark
+def bench_history(transactions: int = DEFAULT_TRANSACTIONS, ids: int = 20) -> dict:
+    """HistoryEngine: раскладка спула по Id и PDF истории каждого Id."""
+    from history import HistoryEngine
+
+    rows, _ = _generate(transactions)
+    with _workdir() as path:
+        events = _spool(rows, "spool.jsonl")
+        targets = {"orders": [str(i) for i in range(1, ids + 1)]}
+        engine = HistoryEngine("bench_slot", targets, path, {}, keys={"orders": ["id"]})
+        _setup_done()
+        start = time.perf_counter()
+        engine.process("spool.jsonl")
+        process_s = time.perf_counter() - start
+        pdfs = engine.finish()
+        seconds = time.perf_counter() - start
+    return {"events": events, "pdfs": len(pdfs), "seconds": round(seconds, 3),
+            "events_per_s": round(events / process_s), "pdf_seconds": round(seconds - process_s, 3)}
+
+
+@benchmark
+def bench_summary(transactions: int = DEFAULT_TRANSACTIONS) -> dict:
+    """Отчёт сводки get_summary (PDF и HTML) по агрегатам потока, без кэша графиков."""
+    from metabd import DB_FILE, aggregate_jsonl_to_sqlite
+
+    rows, _ = _generate(transactions)
+    with _workdir():
+        events = _spool(rows, "spool.jsonl")
+        aggregate_jsonl_to_sqlite("spool.jsonl", DB_FILE, "bench_slot", 3600)
+        slot = _slot("summary", rows)
+        _setup_done()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(None):
+            result = slot.get_summary()
+        seconds = time.perf_counter() - start
+    return {"events": events, "reports": len([p for p in (result or "").split(";") if p]),
+            "seconds": round(seconds, 3)}
+
+
+@benchmark
+def bench_replay(transactions: int = DEFAULT_TRANSACTIONS) -> dict:
+    """Сквозной цикл summary по записи потока (ReplaySource без пауз): чтение, разбор, агрегаты, SQLite."""
+    from changesource import ReplaySource
+    from walgen import write_rows
+
+    rows, size_mb = _generate(transactions)
+    with _workdir():
+        write_rows("recording.jsonl", rows)
+        slot = _slot("summary", rows)
+        slot.source = ReplaySource("recording.jsonl")
+        _setup_done()
+        start = time.perf_counter()
+        slot.fetch_events()
+        seconds = time.perf_counter() - start
+        assert slot.source.finished()
+    return {"rows": len(rows), "size_mb": round(size_mb, 2), "seconds": round(seconds, 3),
+            "rows_per_s": round(len(rows) / seconds), "mb_s": round(size_mb / seconds, 1)}
+
+
+@benchmark
+def bench_decode(transactions: int = DEFAULT_TRANSACTIONS) -> dict:
+    """
+    Разбор одного и того же потока в выводе wal2json и test_decoding: только
+    decode_rows и полный цикл fetch_events (разбор, ключи, спул, водяной знак).
+    """
+    from decoding import decode_rows
+
+    result = {}
+    for plugin in ("wal2json", "test_decoding"):
+        rows = list(WalGenerator().rows(transactions, plugin))
+        size_mb = sum(len(data.encode("utf-8")) for data, _ in rows) / (1024 * 1024)
+        with _workdir():
+            slot = _slot("full", rows, plugin=plugin)
+            _setup_done()
+            start = time.perf_counter()
+            changes = sum(len(tx["change"]) for tx, _, _ in decode_rows(rows, plugin))
+            decode_s = time.perf_counter() - start
+            start = time.perf_counter()
+            slot.fetch_events(output_file="events_full.jsonl")
+            fetch_s = time.perf_counter() - start
+        result[f"{plugin}_rows"] = len(rows)
+        result[f"{plugin}_changes_per_s"] = round(changes / decode_s)
+        result[f"{plugin}_mb_s"] = round(size_mb / decode_s, 1)
+        result[f"{plugin}_fetch_changes_per_s"] = round(changes / fetch_s)
+    return result
+
+
+def run_benchmark(name: str, memory: bool = True, **params) -> dict:
+    fn = BENCHMARKS[name]
+    accepted = inspect.signature(fn).parameters
+    kwargs = {key: value for key, value in params.items() if key in accepted}
+    result = fn(**kwargs)
+    if memory:
+        global _memory_base
+        _memory_base = 0
+        tracemalloc.start()
+        try:
+            fn(**kwargs)
+            peak = tracemalloc.get_traced_memory()[1] - _memory_base
+            result["peak_mb"] = round(peak / (1024 * 1024), 1)
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old: dict, new: dict, threshold: float = 0.1) -> list:
+    """
+    Строки сравнения прогонов (результаты из --output). Изменение хуже threshold
+    помечается REGRESSION.
+    """
+    lines = []
+    for name, result in new["results"].items():
+        before = old.get("results", {}).get(name, {})
+        for key, value in result.items():
+            prev = before.get(key)
+            if not isinstance(value, (int, float)) or not isinstance(prev, (int, float)) or not prev:
+                continue
+            higher = key.endswith(HIGHER_IS_BETTER)
+            if not higher and not key.endswith(LOWER_IS_BETTER):
+                continue
+            change = (value - prev) / prev
+            worse = -change if higher else change
+            mark = "  REGRESSION" if worse > threshold else ""
+            lines.append(f"{name}.{key}: {prev} -> {value} ({change:+.0%}){mark}")
+    return lines
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Офлайн-бенчмарки анализатора WAL")
+    arg_parser.add_argument("names", nargs="*", help=f"бенчмарки: {', '.join(BENCHMARKS)}")
+    arg_parser.add_argument("--transactions", type=int, default=DEFAULT_TRANSACTIONS,
+                            help="транзакций в синтетическом потоке")
+    arg_parser.add_argument("--no-memory", action="store_true", help="не снимать пиковую память")
+    arg_parser.add_argument("--output", help="записать результаты в JSON")
+    arg_parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = arg_parser.parse_args(argv if argv is not None else sys.argv[1:])
+
+    results = {}
+    for name in args.names or list(BENCHMARKS):
+        results[name] = run_benchmark(name, memory=not args.no_memory, transactions=args.transactions)
+        print(name, json.dumps(results[name], ensure_ascii=False))
+
+    report = {"commit": _git_commit(), "python": platform.python_version(),
+              "created_at": datetime.now().isoformat(timespec="seconds"),
+              "transactions": args.transactions, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            for line in compare(json.load(f), report):
+                print(line)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Список таблиц базы для выбора в окне: один запрос к pg_catalog на все схемы
+с оценкой числа строк (reltuples), кэш на подключение и поиск по подстроке.
+"""
+import threading
+import time
+from collections import namedtuple
+
+import psycopg2
+
+# rows — оценка планировщика (reltuples), None — таблица ещё не анализировалась
+CatalogTable = namedtuple("CatalogTable", "schema name rows")
+
+# обычные таблицы и секции; секционированные родители не попадают — wal2json и
+# test_decoding сообщают изменения секций, и выбор родителя не поймал бы ни одного
+# события; системные схемы и служебные таблицы — мимо
+CATALOG_QUERY = """
+    SELECT n.nspname, c.relname, c.reltuples::bigint
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind = 'r'
+      AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+      AND n.nspname NOT LIKE 'pg_toast%'
+      AND n.nspname NOT LIKE 'pg_temp%'
+      AND NOT (n.nspname = 'public' AND c.relname IN ('data_change_log', 'data_change_log_watermarks'))
+    ORDER BY n.nspname, c.relname;
+"""
+
+
+def display_name(table: CatalogTable) -> str:
+    """
+    Имя для конфигурации анализа — всегда со схемой: имя без схемы выбирает
+    таблицу в любой схеме, и public.orders захватил бы ещё и sales.orders.
+    """
+    return f"{table.schema}.{table.name}"
+
+
+def format_rows(rows) -> str:
+    if rows is None:
+        return "?"
+    for limit, suffix in ((10 ** 9, " млрд"), (10 ** 6, " млн"), (10 ** 3, " тыс")):
+        if rows >= limit:
+            return f"~{rows / limit:.1f}{suffix}"
+    return f"~{rows}"
+
+
+def list_tables(db_config: dict) -> list:
+    conn = psycopg2.connect(**db_config)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(CATALOG_QUERY)
+            # reltuples = -1 (PostgreSQL 14+) или 0 до первого ANALYZE — оценки нет
+            return [CatalogTable(schema, name, rows if rows and rows > 0 else None)
+                    for schema, name, rows in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def search_tables(tables: list, text: str = "", schema: str = None) -> list:
+    """Таблицы схемы schema (None — всех), имя которых содержит text (без учёта регистра)."""
+    text = text.strip().lower()
+    return [t for t in tables
+            if (schema is None or t.schema == schema)
+            and (not text or text in display_name(t).lower())]
+
+
+class CatalogCache:
+    """
+    Списки таблиц по подключениям (хост, порт, база, пользователь). Каталог
+    читается при первом обращении и по refresh; повторный выбор той же базы
+    берёт список из памяти.
+    """
+
+    def __init__(self, loader=list_tables):
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.entries = {}   # ключ подключения → (время загрузки, [CatalogTable])
+
+    @staticmethod
+    def key(db_config: dict):
+        return tuple(str(db_config.get(k)) for k in ("host", "port", "dbname", "user"))
+
+    def get(self, db_config: dict, refresh: bool = False) -> list:
+        key = self.key(db_config)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or refresh:
+            entry = (time.time(), self.loader(db_config))
+            with self.lock:
+                self.entries[key] = entry
+        return entry[1]
+
+    def loaded_at(self, db_config: dict):
+        entry = self.entries.get(self.key(db_config))
+        return entry[0] if entry else None
+
+
+CATALOG = CatalogCache()
@@ -0,0 +1,185 @@
+import argparse
+import json
+import sqlite3
+import sys
+from datetime import datetime, timezone
+
+from dateutil import parser
+
+from metabd import DB_FILE
+
+
+# записей в индексе: сверх этого самые старые (по порядку вставки) удаляются
+CHANGE_INDEX_MAX_ROWS = 5_000_000
+
+INSERT_CHANGES = """INSERT INTO change_index
+    (table_name, pk, ts, xid, slot_name, schema_name, operation, data)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?);"""
+
+
+def init_change_index(sqlite_path: str = DB_FILE):
+    conn = sqlite3.connect(sqlite_path)
+    cur = conn.cursor()
+    cur.execute("""CREATE TABLE IF NOT EXISTS change_index (
+        table_name TEXT, pk TEXT, ts INTEGER, xid INTEGER,
+        slot_name TEXT, schema_name TEXT, operation TEXT, data TEXT
+    );""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_change_index_key
+                   ON change_index (table_name, pk, ts);""")
+    conn.commit()
+    conn.close()
+
+
+def make_pk(values) -> str:
+    """Строковое представление ключа: значения через запятую (составной ключ — несколько)."""
+    return ",".join(str(v) for v in values)
+
+
+class ChangeIndexWriter:
+    """
+    Постоянный индекс (таблица, первичный ключ) → компактные записи изменений.
+    Пополняется во время приёма событий и сбрасывается в SQLite одной транзакцией
+    за цикл, поэтому история любого ключа — выборка по индексу, а не полный проход.
+    """
+
+    def __init__(self, slot_name: str, sqlite_path: str = DB_FILE, max_rows: int = CHANGE_INDEX_MAX_ROWS):
+        self.slot_name = slot_name
+        self.sqlite_path = sqlite_path
+        self.max_rows = max_rows
+        self.rows = []
+        self._last_ts = (None, None)
+        init_change_index(sqlite_path)
+
+    def _epoch(self, timestamp):
+        # все изменения транзакции несут одну метку времени — разбираем её один раз
+        if self._last_ts[0] != timestamp:
+            try:
+                epoch = int(parser.parse(timestamp).timestamp())
+            except Exception:
+                epoch = None
+            self._last_ts = (timestamp, epoch)
+        return self._last_ts[1]
+
+    def key_of(self, event: dict):
+        """
+        Возвращает (pk, data) события или None, если ключ неизвестен. Ключ
+        вычисляется при приёме по метаданным каталога (relcache, event["pk"]);
+        без него — только из oldkeys UPDATE/DELETE. Имя ключа не угадывается:
+        INSERT в таблицу с ключом не "id" иначе попал бы в индекс с чужим ключом.
+        """
+        columns = event.get("columns") or []
+        new_values = event.get("new_data") or []
+        key_columns = event.get("key_columns") or []
+        old_values = event.get("old_data") or []
+
+        if "pk" in event:
+            pk = event["pk"]
+        elif key_columns and old_values:
+            pk = make_pk(old_values)
+        else:
+            pk = None
+        if pk is None:
+            return None
+
+        if new_values:
+            data = dict(zip(columns, new_values))
+        else:
+            data = dict(zip(key_columns, old_values))
+        return pk, data
+
+    def add(self, event: dict):
+        key = self.key_of(event)
+        if key is None:
+            return
+        pk, data = key
+        self.rows.append((
+            event.get("table"), pk, self._epoch(event.get("timestamp")), event.get("xid"),
+            self.slot_name, event.get("schema"), (event.get("operation") or "").upper(),
+            json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+        ))
+
+    def flush(self, cur=None):
+        """
+        Записывает накопленные изменения. С cur — в транзакцию вызывающего
+        (вместе с агрегатами и водяным знаком слота), без cur — своей транзакцией.
+        """
+        if not self.rows:
+            return
+        if cur is not None:
+            self._write(cur)
+            return
+        conn = sqlite3.connect(self.sqlite_path)
+        try:
+            with conn:
+                self._write(conn.cursor())
+        finally:
+            conn.close()
+
+    def _write(self, cur):
+        cur.executemany(INSERT_CHANGES, self.rows)
+        self.rows = []
+        # ограничение по числу записей: время коммита не годится — у воспроизведённой
+        # записи потока оно может быть сколь угодно старым; удаление — диапазоном rowid
+        cur.execute("DELETE FROM change_index WHERE rowid <= (SELECT MAX(rowid) FROM change_index) - ?;",
+                    (self.max_rows,))
+
+
+def get_key_history(table_name: str, pk: str, since: int = None, until: int = None,
+                    sqlite_path: str = DB_FILE) -> list:
+    """Изменения одного ключа в хронологическом порядке (since/until — epoch-секунды)."""
+    init_change_index(sqlite_path)
+    query = """SELECT ts, xid, slot_name, schema_name, operation, data
+               FROM change_index WHERE table_name = ? AND pk = ?"""
+    params = [table_name, str(pk)]
+    if since is not None:
+        query += " AND ts >= ?"
+        params.append(since)
+    if until is not None:
+        query += " AND ts < ?"
+        params.append(until)
+    query += " ORDER BY ts, xid"
+
+    conn = sqlite3.connect(sqlite_path)
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    return [
+        {"ts": ts, "xid": xid, "slot_name": slot_name, "schema": schema,
+         "operation": operation, "data": json.loads(data)}
+        for ts, xid, slot_name, schema, operation, data in rows
+    ]
+
+
+def _parse_epoch(value):
+    if value is None:
+        return None
+    dt = parser.parse(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="История ключа по индексу изменений")
+    arg_parser.add_argument("table", help="таблица")
+    arg_parser.add_argument("pk", help="значение первичного ключа (составной — через запятую)")
+    arg_parser.add_argument("--since", help="начало периода, ISO 8601")
+    arg_parser.add_argument("--until", help="конец периода, ISO 8601")
+    arg_parser.add_argument("--pdf", help="сохранить историю в PDF по этому пути")
+    arg_parser.add_argument("--db", default=DB_FILE, help="путь к SQLite")
+    args = arg_parser.parse_args(argv)
+
+    changes = get_key_history(args.table, args.pk, _parse_epoch(args.since), _parse_epoch(args.until), args.db)
+    if args.pdf:
+        from history import history_pdf_from_index
+        history_pdf_from_index(args.pdf, args.table, args.pk, changes)
+        print(f"История {args.table} Id={args.pk}: {len(changes)} изменений → {args.pdf}")
+        return 0
+
+    for change in changes:
+        when = datetime.fromtimestamp(change["ts"], tz=timezone.utc).isoformat() if change["ts"] else "?"
+        print(when, change["xid"], change["operation"], json.dumps(change["data"], ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+Источники изменений для LogicalSlot: логический слот PostgreSQL или
+воспроизведение записанного потока (данные get_changes, снятые с живого слота
+или сгенерированные walgen) — без базы данных.
+
+Запись — JSONL {"lsn": ..., "data": ..., "ts": ...}, ts — время коммита
+(epoch-секунды); без ts время берётся из поля timestamp wal2json.
+"""
+import json
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from metabd import drop_current_slot, lsn_to_int
+
+# строк записи в памяти на один peek: запись с продуктива не читается целиком
+REPLAY_MAX_ROWS = 10_000
+
+WAL2JSON_OPTIONS = ("include-timestamp", "1", "include-xids", "1", "include-schemas", "1",
+                    "include-types", "1", "include-transaction", "1")
+# время коммита нужно сводке и истории, пустые транзакции — никому
+TEST_DECODING_OPTIONS = ("include-xids", "1", "include-timestamp", "1", "skip-empty-xacts", "1")
+
+
+def _stage(timer, name):
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+def row_time(data: str):
+    """Время коммита транзакции wal2json (epoch-секунды) или None."""
+    try:
+        timestamp = json.loads(data).get("timestamp")
+        return datetime.fromisoformat(timestamp).timestamp() if timestamp else None
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+class PgChangeSource:
+    """Логический слот PostgreSQL: peek без потребления, advance после фиксации цикла."""
+
+    live = True
+
+    def __init__(self, connect, db_config: dict, slot_name: str, plugin: str = "wal2json"):
+        # connect — фабрика соединений LogicalSlot (autocommit)
+        self.connect = connect
+        self.db_config = db_config
+        self.slot_name = slot_name
+        self.plugin = plugin
+
+    def exists(self) -> bool:
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1 FROM pg_replication_slots WHERE slot_name = %s;", (self.slot_name,))
+                return cur.fetchone() is not None
+
+    def create(self):
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT version();")
+                print("Postgres version:", cur.fetchone())
+                cur.execute("SELECT * FROM pg_create_logical_replication_slot(%s, %s);",
+                            (self.slot_name, self.plugin))
+
+    def drop(self):
+        drop_current_slot(self.db_config, self.slot_name)
+
+    @contextmanager
+    def peek(self, timer=None):
+        """Строки (data, lsn), накопленные слотом; этап query — декодирование на сервере и передача."""
+        options = WAL2JSON_OPTIONS if self.plugin == "wal2json" else TEST_DECODING_OPTIONS
+        placeholders = "".join(", %s" for _ in options)
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                with _stage(timer, "query"):
+                    cur.execute(f"SELECT data, lsn FROM pg_logical_slot_peek_changes(%s, NULL, NULL{placeholders});",
+                                (self.slot_name, *options))
+                yield cur
+
+    def advance(self, lsn: str):
+        """Подтверждает слоту обработку изменений до lsn — PostgreSQL может освободить WAL."""
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_replication_slot_advance(%s, %s::pg_lsn);", (self.slot_name, lsn))
+
+    def lag(self):
+        """
+        Отставание слота в байтах WAL: retained — удерживаемый слотом (от restart_lsn),
+        pending — ещё не подтверждённый потребителем (от confirmed_flush_lsn).
+        None, если слота нет.
+        """
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), restart_lsn),
+                           pg_wal_lsn_diff(pg_current_wal_lsn(), confirmed_flush_lsn)
+                    FROM pg_replication_slots WHERE slot_name = %s;
+                """, (self.slot_name,))
+                row = cur.fetchone()
+        if row is None:
+            return None
+        return {"retained_bytes": int(row[0] or 0), "pending_bytes": int(row[1] or 0)}
+
+    def finished(self) -> bool:
+        return False
+
+    def backlogged(self) -> bool:
+        return False
+
+
+class ReplaySource:
+    """
+    Воспроизведение записанного потока вместо слота. speed — во сколько раз
+    быстрее оригинала (1 — исходный темп по времени коммитов, None или 0 —
+    без пауз). Как и слот, peek отдаёт все наступившие и не подтверждённые
+    advance строки, так что цикл выборки, водяной знак и повтор после сбоя
+    работают так же. Файл читается по мере наступления строк; в памяти только
+    неподтверждённые (не больше max_rows на один peek).
+    """
+
+    live = False
+
+    def __init__(self, path: str, speed: float = None, max_rows: int = REPLAY_MAX_ROWS, clock=time.monotonic):
+        self.path = path
+        self.speed = speed or None
+        self.max_rows = max_rows
+        self.full = False
+        self.clock = clock
+        self.pending = deque()   # (ts, data, lsn) — наступившие и не подтверждённые
+        self.ahead = None        # прочитанная строка, время которой ещё не наступило
+        self.confirmed = -1
+        self.started = None
+        self.origin = None
+        self.eof = False
+        self._file = None
+
+    def connect(self):
+        raise LookupError("у записи потока нет каталога PostgreSQL")
+
+    def exists(self) -> bool:
+        return True
+
+    def create(self):
+        pass
+
+    def drop(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_row(self):
+        for line in self._file:
+            if line.strip():
+                row = json.loads(line)
+                ts = row.get("ts")
+                return (ts if ts is not None else row_time(row["data"])), row["data"], row["lsn"]
+        self.eof = True
+        return None
+
+    def _due(self, ts) -> bool:
+        if self.speed is None or ts is None:
+            return True
+        if self.origin is None:
+            self.origin = ts
+        return ts - self.origin <= (self.clock() - self.started) * self.speed
+
+    def _fill(self):
+        if self._file is None:
+            self._file = open(self.path, "r", encoding="utf-8")
+            self.started = self.clock()
+        self.full = False
+        while not self.eof:
+            if self.max_rows is not None and len(self.pending) >= self.max_rows:
+                self.full = True
+                break
+            row = self.ahead or self._read_row()
+            if row is None:
+                break
+            if not self._due(row[0]):
+                self.ahead = row
+                break
+            self.ahead = None
+            if lsn_to_int(row[2]) > self.confirmed:
+                self.pending.append(row)
+
+    @contextmanager
+    def peek(self, timer=None):
+        with _stage(timer, "query"):
+            self._fill()
+        yield [(data, lsn) for _, data, lsn in self.pending]
+
+    def advance(self, lsn: str):
+        value = lsn_to_int(lsn)
+        self.confirmed = max(self.confirmed, value)
+        while self.pending and lsn_to_int(self.pending[0][2]) <= value:
+            self.pending.popleft()
+
+    def lag(self) -> dict:
+        pending = sum(len(data) for _, data, _ in self.pending)
+        return {"retained_bytes": pending, "pending_bytes": pending}
+
+    def finished(self) -> bool:
+        """Запись прочитана до конца и всё подтверждено."""
+        return self.eof and self.ahead is None and not self.pending
+
+    def backlogged(self) -> bool:
+        """Последний peek упёрся в max_rows — следующий цикл можно начинать без паузы."""
+        return self.full
+
+
+def make_source(slot_config: dict, connect, db_config: dict):
+    """ReplaySource, если в конфигурации слота задан replay_path, иначе слот PostgreSQL."""
+    if slot_config.get("replay_path"):
+        return ReplaySource(slot_config["replay_path"], slot_config.get("replay_speed"),
+                            slot_config.get("replay_max_rows") or REPLAY_MAX_ROWS)
+    return PgChangeSource(connect, db_config, slot_config["slot_name"], slot_config.get("plugin") or "wal2json")
+
+
+def record_changes(source: PgChangeSource, path: str, duration_seconds: float,
+                   interval_seconds: float = 1.0, stop_event=None) -> int:
+    """
+    Записывает поток слота в path (дописывая) для последующего воспроизведения.
+    Слот потребляется (advance), поэтому для записи нужен отдельный слот.
+    Возвращает число записанных строк.
+    """
+    count = 0
+    deadline = time.monotonic() + duration_seconds
+    with open(path, "a", encoding="utf-8") as f:
+        while time.monotonic() < deadline and not (stop_event is not None and stop_event.is_set()):
+            last_lsn = None
+            captured = time.time()
+            with source.peek() as rows:
+                for data, lsn in rows:
+                    ts = row_time(data)
+                    f.write(json.dumps({"lsn": lsn, "data": data, "ts": ts if ts is not None else captured},
+                                       ensure_ascii=False) + "\n")
+                    last_lsn = lsn
+                    count += 1
+            f.flush()
+            if last_lsn is not None:
+                source.advance(last_lsn)
+            if stop_event is not None:
+                stop_event.wait(interval_seconds)
+            else:
+                time.sleep(interval_seconds)
+    return count
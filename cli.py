@@ -0,0 +1,313 @@
+"""
+Запуск анализов без графического интерфейса (серверы без дисплея, systemd, cron).
+
+    python cli.py list
+    python cli.py run slot_orders                     # анализ из таблицы connections
+    python cli.py run --config analyses.json          # анализы из файла конфигурации
+    python cli.py daemon --config analyses.json       # работает до SIGTERM
+    python cli.py daemon --all-active                 # все активные анализы из connections
+    python cli.py daemon --all-active --metrics-port 9187   # + метрики на /metrics
+    python cli.py report slot_orders                  # отчёт сводки по накопленным агрегатам
+    python cli.py run slot_orders --profile           # первый цикл под cProfile
+    python cli.py record slot_rec --output prod.jsonl --duration 600   # запись потока слота
+    python cli.py replay prod.jsonl --type summary --speed 10          # анализ записи без PostgreSQL
+
+В режиме daemon сигнал SIGUSR1 включает профилирование следующего цикла всех
+анализов; профили (.prof и .txt) сохраняются рядом с отчётами.
+
+Файл конфигурации — JSON: {"analyses": [{"db": {...}, "slot": {...}}, ...]},
+ключи db и slot те же, что в таблице connections. tkinter не импортируется,
+стек графиков — только когда строится отчёт сводки.
+"""
+import argparse
+import json
+import os
+import signal
+import sqlite3
+import sys
+import threading
+
+from changesource import REPLAY_MAX_ROWS, record_changes
+from controller import create_slot, get_configs, worker_fetch_loop
+from history import remove_history_spool
+from logical_slot import LogicalSlot
+from metabd import DB_FILE, clear_sql, init_sqlite, save_connection, slot_leased
+from metrics import start_http_server
+from scheduler import AdaptiveInterval
+from slotmonitor import start_monitors
+
+RESCAN_SECONDS = 30
+
+# значения по умолчанию для анализов из файла конфигурации
+DEFAULT_SLOT_CONFIG = {
+    "tables": [],
+    "period_hours": 3600,
+    "operations": ["INSERT", "UPDATE", "DELETE"],
+    "analysis_type": "summary",
+    "summary_pdf": True,
+    "summary_html": False,
+    "history_table": "",
+    "history_value": "",
+    "masks_fields": "",
+    "save_target": "postgres",
+    "plugin": "wal2json",
+    "disk_path": "",
+}
+
+
+def load_config_file(path: str) -> list:
+    """Читает анализы из JSON и регистрирует в connections те, которых там ещё нет."""
+    with open(path, "r", encoding="utf-8") as f:
+        analyses = json.load(f).get("analyses", [])
+
+    conn = sqlite3.connect(DB_FILE)
+    known = {row[0] for row in conn.execute("SELECT slot_name FROM connections")}
+    conn.close()
+
+    slot_names = []
+    for item in analyses:
+        db_config = dict({"host": "localhost", "port": 5432}, **item["db"])
+        slot_config = dict(DEFAULT_SLOT_CONFIG, **item["slot"])
+        if not slot_config.get("slot_name"):
+            raise ValueError(f"В {path} у анализа не задан slot_name")
+        if slot_config["slot_name"] not in known:
+            save_connection(db_config, slot_config)
+        slot_names.append(slot_config["slot_name"])
+    return slot_names
+
+
+def active_slot_names() -> list:
+    conn = sqlite3.connect(DB_FILE)
+    rows = conn.execute("SELECT slot_name FROM connections WHERE result = 'active'").fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+class AnalysisDaemon:
+    """
+    Выполняет анализы в потоках (по одному на слот) до их завершения или до SIGTERM/SIGINT.
+    В режиме daemon список анализов перечитывается раз в rescan_seconds, новые
+    запускаются. При остановке циклы прерываются, слоты сохраняются для продолжения.
+    """
+
+    def __init__(self, slot_names=None, config_path: str = None, all_active: bool = False,
+                 rescan_seconds: float = RESCAN_SECONDS, profile: bool = False):
+        self.slot_names = list(slot_names or [])
+        self.config_path = config_path
+        self.all_active = all_active
+        self.rescan_seconds = rescan_seconds
+        self.profile = profile
+        self.stop_event = threading.Event()
+        self.workers = {}
+        self.pollers = {}
+        self.results = {}
+        self.analyses = {}
+        self.skipped = set()
+
+    def definitions(self) -> list:
+        names = list(self.slot_names)
+        if self.config_path:
+            names += load_config_file(self.config_path)
+        if self.all_active:
+            names += active_slot_names()
+        return list(dict.fromkeys(names))
+
+    def _worker(self, slot_name: str):
+        try:
+            analysys = create_slot(slot_name)
+            if self.profile:
+                analysys.request_profile()
+            self.analyses[slot_name] = analysys
+            slot_config = analysys.slot_config
+            self.results[slot_name] = worker_fetch_loop(
+                None, analysys, slot_config, slot_config["period_hours"],
+                self.stop_event, self.pollers[slot_name])
+        except Exception as e:
+            print(f"Ошибка анализа {slot_name}: {e}")
+            self.results[slot_name] = f"Ошибка: {e}"
+
+    def start(self, slot_name: str):
+        _, slot_config = get_configs(slot_name)
+        self.pollers[slot_name] = AdaptiveInterval.from_config(slot_config)
+        thread = threading.Thread(target=self._worker, args=(slot_name,), name=f"analysis-{slot_name}")
+        self.workers[slot_name] = thread
+        thread.start()
+        print(f"Анализ {slot_name} запущен")
+
+    def stop(self, *args):
+        print("Получен сигнал остановки, завершаем текущие циклы...")
+        self.stop_event.set()
+        for poller in self.pollers.values():
+            poller.wake.set()
+
+    def profile_next(self, *args):
+        print("Следующий цикл анализов будет выполнен под профилировщиком")
+        for analysys in list(self.analyses.values()):
+            analysys.request_profile()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        # SIGUSR1 есть не на всех платформах
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, self.profile_next)
+
+    def _start_new(self):
+        for slot_name in self.definitions():
+            if slot_name in self.workers:
+                continue
+            # слот уже читает окно или другой daemon — подхватим, если его аренда истечёт
+            if slot_leased(slot_name):
+                if slot_name not in self.skipped:
+                    print(f"Анализ {slot_name} уже выполняется другим процессом, пропускаем")
+                    self.skipped.add(slot_name)
+                continue
+            self.start(slot_name)
+
+    def run_once(self) -> dict:
+        """Запускает все анализы и ждёт их завершения (или сигнала остановки)."""
+        self._start_new()
+        for thread in list(self.workers.values()):
+            while thread.is_alive():
+                thread.join(timeout=1)
+        return self.results
+
+    def run_forever(self) -> dict:
+        while not self.stop_event.is_set():
+            try:
+                self._start_new()
+            except Exception as e:
+                print("Ошибка чтения списка анализов:", e)
+            self.stop_event.wait(self.rescan_seconds)
+        for thread in list(self.workers.values()):
+            thread.join()
+        return self.results
+
+
+def cmd_list(args):
+    conn = sqlite3.connect(DB_FILE)
+    rows = conn.execute("""SELECT slot_name, analysis_type, created_at, dbname, result
+                           FROM connections ORDER BY created_at""").fetchall()
+    conn.close()
+    for slot_name, analysis_type, created_at, dbname, result in rows:
+        print(f"{slot_name}\t{analysis_type}\t{created_at}\t{dbname}\t{result}")
+    return 0
+
+
+def cmd_run(args, forever: bool = False):
+    if not (args.slots or args.config or args.all_active):
+        print("Не заданы анализы: укажите имена слотов, --config или --all-active")
+        return 2
+    if args.metrics_port:
+        start_http_server(args.metrics_port, args.metrics_host)
+        print(f"Метрики: http://{args.metrics_host}:{args.metrics_port}/metrics")
+    daemon = AnalysisDaemon(args.slots, args.config, args.all_active, args.rescan, args.profile)
+    daemon.install_signal_handlers()
+    # удерживаемый WAL контролируется и у слотов, оставшихся без потока после сбоя
+    start_monitors()
+    results = daemon.run_forever() if forever else daemon.run_once()
+    for slot_name, result in results.items():
+        print(f"{slot_name}: {result}")
+    return 0
+
+
+def cmd_report(args):
+    db_config, slot_config = get_configs(args.slot)
+    # отчёт сводки — единственное место, где нужен стек графиков
+    analysys = LogicalSlot(db_config, slot_config)
+    if args.profile:
+        analysys.request_profile()
+    print(analysys.get_summary())
+    return 0
+
+
+def cmd_record(args):
+    db_config, slot_config = get_configs(args.slot)
+    analysys = LogicalSlot(db_config, slot_config)
+    analysys.create_slot()
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *a: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *a: stop_event.set())
+    count = record_changes(analysys.source, args.output, args.duration, args.interval, stop_event)
+    print(f"Записано {count} строк слота {args.slot} в {args.output}")
+    return 0
+
+
+def cmd_replay(args):
+    slot_config = dict(DEFAULT_SLOT_CONFIG, slot_name=args.slot, analysis_type=args.type,
+                       tables=args.tables, replay_path=args.recording, replay_speed=args.speed,
+                       replay_max_rows=args.max_rows,
+                       disk_path=args.disk_path, save_target="disk",
+                       history_table=args.history_table, history_value=args.history_value)
+    analysys = LogicalSlot({}, slot_config)
+    # прежний прогон того же имени не должен сдвигать водяной знак нового и дополнять его историю
+    clear_sql(None, args.slot, args.type)
+    remove_history_spool(os.getcwd(), args.slot)
+    stop_event = threading.Event()
+    poller = AdaptiveInterval.from_config(slot_config)
+
+    def stop(*_):
+        stop_event.set()
+        poller.wake.set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(worker_fetch_loop(None, analysys, slot_config, float("inf"), stop_event, poller))
+    return 0
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Анализатор WAL без графического интерфейса")
+    sub = arg_parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("list", help="анализы из таблицы connections")
+    for name, help_text in (("run", "выполнить анализы и выйти"),
+                            ("daemon", "выполнять анализы до SIGTERM, подхватывая новые")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("slots", nargs="*", help="имена слотов из connections")
+        p.add_argument("--config", help="JSON-файл с определениями анализов")
+        p.add_argument("--all-active", action="store_true", help="все активные анализы из connections")
+        p.add_argument("--rescan", type=float, default=RESCAN_SECONDS,
+                       help="период перечитывания списка анализов в режиме daemon, сек")
+        p.add_argument("--metrics-port", type=int, help="порт HTTP-эндпоинта /metrics (формат Prometheus)")
+        p.add_argument("--metrics-host", default="127.0.0.1", help="адрес эндпоинта метрик")
+        p.add_argument("--profile", action="store_true", help="выполнить первый цикл под cProfile")
+    p = sub.add_parser("report", help="построить отчёт сводки")
+    p.add_argument("slot", help="имя слота")
+    p.add_argument("--profile", action="store_true", help="построить отчёт под cProfile")
+
+    p = sub.add_parser("record", help="записать поток слота в файл для воспроизведения (слот потребляется)")
+    p.add_argument("slot", help="имя слота из connections (отдельный слот для записи)")
+    p.add_argument("--output", required=True, help="файл записи (JSONL, дописывается)")
+    p.add_argument("--duration", type=float, default=600, help="длительность записи, сек")
+    p.add_argument("--interval", type=float, default=1.0, help="период опроса слота, сек")
+
+    p = sub.add_parser("replay", help="выполнить анализ по записи потока без PostgreSQL")
+    p.add_argument("recording", help="файл записи (cli.py record или walgen.py)")
+    p.add_argument("--type", choices=("summary", "history", "full"), default="summary")
+    p.add_argument("--speed", type=float, default=0,
+                   help="темп: 1 — как в оригинале, 10 — в 10 раз быстрее, 0 — без пауз")
+    p.add_argument("--max-rows", type=int, default=REPLAY_MAX_ROWS,
+                   help="строк записи в памяти на один цикл (ограничивает память при --speed 0)")
+    p.add_argument("--slot", default="replay", help="имя анализа в wal_analyzer.db")
+    p.add_argument("--tables", nargs="*", default=[], help="фильтр по таблицам")
+    p.add_argument("--history-table", default="", help="таблицы истории (history)")
+    p.add_argument("--history-value", default="", help="значения ключей истории (history)")
+    p.add_argument("--disk-path", default=".", help="каталог отчётов и файлов full")
+
+    args = arg_parser.parse_args(argv)
+    init_sqlite()
+    if args.command == "list":
+        return cmd_list(args)
+    if args.command == "run":
+        return cmd_run(args)
+    if args.command == "daemon":
+        return cmd_run(args, forever=True)
+    if args.command == "record":
+        return cmd_record(args)
+    if args.command == "replay":
+        return cmd_replay(args)
+    return cmd_report(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,17 @@
 from logical_slot import LogicalSlot
+from scheduler import AdaptiveInterval
+from slotmonitor import DEFAULT_LIMIT_MB, get_monitor
+from livestats import LIVE
+from metabd import SLOT_LEASE_SECONDS, acquire_slot_lease, release_slot_lease
+from datetime import datetime, timezone
 import json
+import os
+import socket
 import sqlite3
 import time
 import threading
 import traceback
-import matplotlib
+import metrics
 
 db_config = {
     'dbname': 'mydb',
@@ -40,9 +47,14 @@ def get_configs(slot_name: str):
                slot_name, analysis_type,
                summary_pdf, summary_html,
                history_table, history_value, masks_fields,
-               save_target, plugin, disk_path, result
+               save_target, plugin, disk_path, result,
+               html_offline, change_index,
+               poll_min_seconds, poll_max_seconds,
+               monitor_limit_mb, monitor_action, created_at
         FROM connections
         WHERE slot_name = ?
+        ORDER BY id DESC
+        LIMIT 1
     """, (slot_name,))
     row = cur.fetchone()
     conn.close()
@@ -73,6 +85,13 @@ def get_configs(slot_name: str):
         "plugin": row[16],
         "disk_path": row[17],
         "result": row[18],
+        "html_offline": bool(row[19]),
+        "change_index": bool(row[20]),
+        "poll_min_seconds": row[21],
+        "poll_max_seconds": row[22],
+        "monitor_limit_mb": row[23],
+        "monitor_action": row[24],
+        "created_at": row[25],
     }
 
     return db_config, slot_config
@@ -100,35 +119,104 @@ def create_slot(slot_name):
     analysys.create_slot()
     return analysys
 
-def worker_fetch_loop(result_queue, analysys, slot_config, duration_seconds, interval_seconds):
-    matplotlib.use("Agg")  
-    result = None
-    start_time = time.time()
-    while time.time() - start_time < duration_seconds:
-        try:
-            if slot_config['analysis_type'] == 'summary':
-                analysys.fetch_events()
-                result = "summary_ready"
-            elif slot_config['analysis_type'] == 'full':
-                result = analysys.fetch_events_full_save()
-                
-            elif slot_config['analysis_type'] == 'history':
-                result = analysys.fetch_events()
-        except Exception as e:
-            print("Ошибка при fetch:", e)
-            traceback.print_exc()
-        
-        print("в потоке ", result)
+def analysis_started_at(slot_config: dict) -> float:
+    """
+    Начало анализа — connections.created_at (UTC): анализ, возобновлённый после
+    остановки или подхваченный daemon, дорабатывает оставшееся время, а не весь срок.
+    """
+    try:
+        started = datetime.strptime(slot_config["created_at"], "%Y-%m-%d %H:%M:%S")
+    except (KeyError, TypeError, ValueError):
+        return time.time()
+    return started.replace(tzinfo=timezone.utc).timestamp()
+
 
-        time.sleep(interval_seconds)
-    worker_stop_correct(slot_config, analysys, result)
+def lease_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def worker_fetch_loop(result_queue, analysys, slot_config, duration_seconds, stop_event=None, poller=None):
+    """
+    Цикл выборки событий слота до истечения duration_seconds.
+    stop_event — внешняя остановка (SIGTERM в cli.py): цикл прерывается, слот
+    сохраняется, чтобы анализ можно было продолжить; чтобы прервать паузу
+    между опросами, вместе с ним выставляется poller.wake.
+    """
+    result = None
+    start_time = analysis_started_at(slot_config)
+    # интервал опроса подстраивается под нагрузку слота
+    poller = poller or AdaptiveInterval.from_config(slot_config)
+    # слот читает один поток во всех процессах: аренда продлевается каждый цикл
+    # и переживает самую длинную паузу опроса
+    owner = lease_owner()
+    lease_seconds = max(SLOT_LEASE_SECONDS, 3 * (slot_config.get("poll_max_seconds") or 0))
+    if not acquire_slot_lease(analysys.slot_name, owner, lease_seconds):
+        print(f"Слот {analysys.slot_name} уже читает другой поток анализа, второй не запускается")
+        return None
+    # монитор слотов следит за удерживаемым WAL, пока поток работает
+    monitor = get_monitor(analysys.db_config) if analysys.source.live else None
+    if monitor is not None:
+        monitor.register(analysys.slot_name, slot_config.get("monitor_limit_mb") or DEFAULT_LIMIT_MB,
+                         slot_config.get("monitor_action") or "warn", poller)
+    # агрегаты и отставание в памяти — для панели мониторинга
+    LIVE.start(analysys.slot_name, slot_config['analysis_type'])
+    try:
+        while time.time() - start_time < duration_seconds and not poller.stopped:
+            try:
+                if slot_config['analysis_type'] == 'summary':
+                    analysys.fetch_events()
+                    result = "summary_ready"
+                elif slot_config['analysis_type'] == 'full':
+                    result = analysys.fetch_events_full_save()
+
+                elif slot_config['analysis_type'] == 'history':
+                    result = analysys.fetch_events()
+            except Exception as e:
+                print("Ошибка при fetch:", e)
+                metrics.ERRORS.inc(slot=analysys.slot_name, stage="fetch")
+                traceback.print_exc()
+
+            print("в потоке ", result)
+            if stop_event is not None and stop_event.is_set():
+                break
+            if not acquire_slot_lease(analysys.slot_name, owner, lease_seconds):
+                print(f"Аренда слота {analysys.slot_name} перешла другому потоку, цикл остановлен")
+                return None
+            # запись потока воспроизведена до конца — анализ завершается, не дожидаясь срока
+            if analysys.source.finished():
+                break
+
+            try:
+                lag = analysys.get_slot_lag()
+                metrics.record_slot_lag(analysys.slot_name, lag)
+                LIVE.add_lag(analysys.slot_name, lag)
+            except Exception as e:
+                print("Ошибка при чтении отставания слота:", e)
+                lag = None
+            interval = poller.update(analysys.last_fetch_rows, lag["pending_bytes"] if lag else None)
+            # у записи потока остались наступившие строки сверх предела одного цикла
+            if analysys.source.backlogged():
+                interval = 0
+            poller.wait(min(interval, duration_seconds - (time.time() - start_time)))
+    finally:
+        # поток завершается и при ошибке — слот остаётся под контролем монитора через connections
+        if monitor is not None:
+            monitor.unregister(analysys.slot_name)
+        LIVE.finish(analysys.slot_name)
+        release_slot_lease(analysys.slot_name, owner)
+    if stop_event is not None and stop_event.is_set() and not poller.stopped:
+        print(f"Анализ {analysys.slot_name} остановлен, слот сохранён для продолжения")
+        return None
+    if poller.stopped:
+        result = "Слот удалён монитором: превышен порог удерживаемого WAL"
+    return worker_stop_correct(slot_config, analysys, result)
 
 def run_analysis_core(db_config, slot_config, result_queue):
     analysys = create_slot(slot_config['slot_name'])
 
     worker_thread = threading.Thread(
         target=worker_fetch_loop,
-        args=(result_queue, analysys, slot_config, slot_config["period_hours"], 30),
+        args=(result_queue, analysys, slot_config, slot_config["period_hours"]),
     )
     worker_thread.start()
 
@@ -140,5 +228,6 @@ def worker_stop_correct(slot_config, analysys, result):
         print("Слот закрыт, анализ завершён")
     except Exception as e:
         print("Ошибка при завершении:", e)
+    return result
 
 
@@ -0,0 +1,141 @@
+"""
+Вкладка «Мониторинг»: операции, таблицы, активность и отставание работающего
+анализа по агрегатам в памяти (livestats). Фигура и её линии/столбцы создаются
+один раз; при обновлении меняются данные только изменившихся рядов, SQLite
+не читается.
+"""
+from datetime import datetime
+from tkinter import *
+from tkinter import ttk
+
+from downsample import downsample_series
+from livestats import LIVE
+
+DASHBOARD_REFRESH_MS = 3000
+OPERATIONS = ("INSERT", "UPDATE", "DELETE")
+TOP_TABLES = 10
+ACTIVITY_POINTS = 500
+MB = 1024 * 1024
+
+
+class DashboardTab:
+    def __init__(self, parent, registry=LIVE, refresh_ms: int = DASHBOARD_REFRESH_MS):
+        # matplotlib без pyplot: фигура живёт в окне и не зависит от бэкенда Agg отчётов
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from matplotlib.figure import Figure
+        import matplotlib.dates as mdates
+
+        self.parent = parent
+        self.registry = registry
+        self.refresh_ms = refresh_ms
+        self.slot_name = None
+        self.seen = {}
+        self.table_names = None
+        self.table_bars = None
+
+        top = ttk.Frame(parent)
+        top.pack(side=TOP, fill=X, padx=10, pady=5)
+        ttk.Label(top, text="Анализ:").pack(side=LEFT)
+        self.slot_choice = ttk.Combobox(top, state="readonly", width=40)
+        self.slot_choice.pack(side=LEFT, padx=5)
+        self.slot_choice.bind("<<ComboboxSelected>>", lambda e: self.select(self.slot_choice.get()))
+        self.info_var = StringVar(value="Нет работающих анализов")
+        ttk.Label(top, textvariable=self.info_var).pack(side=LEFT, padx=10)
+
+        self.figure = Figure(figsize=(10, 6), dpi=100)
+        self.ax_ops, self.ax_tables, self.ax_activity, self.ax_lag = self.figure.subplots(2, 2).flat
+        self.ax_ops.set_title("Операции")
+        self.ops_bars = self.ax_ops.bar(OPERATIONS, [0] * len(OPERATIONS), color=["#4c9f38", "#2f6db5", "#c0392b"])
+        self.ax_tables.set_title(f"Таблицы (топ {TOP_TABLES})")
+        self.ax_activity.set_title("Активность")
+        (self.activity_line,) = self.ax_activity.plot([], [])
+        self.ax_lag.set_title("Отставание слота, МБ")
+        (self.retained_line,) = self.ax_lag.plot([], [], label="удерживается")
+        (self.pending_line,) = self.ax_lag.plot([], [], label="не подтверждено")
+        self.ax_lag.legend(loc="upper left", fontsize="small")
+        for ax in (self.ax_activity, self.ax_lag):
+            ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M:%S"))
+            ax.tick_params(axis="x", labelsize="small")
+        self.figure.tight_layout()
+
+        self.canvas = FigureCanvasTkAgg(self.figure, master=parent)
+        self.canvas.get_tk_widget().pack(expand=True, fill=BOTH)
+        self.parent.after(self.refresh_ms, self.refresh)
+
+    def select(self, slot_name: str):
+        """Переключает панель на другой анализ — все ряды перерисуются с нуля."""
+        if slot_name != self.slot_name:
+            self.slot_name = slot_name
+            self.seen = {}
+
+    def refresh(self):
+        try:
+            self._refresh()
+        finally:
+            self.parent.after(self.refresh_ms, self.refresh)
+
+    def _refresh(self):
+        slots = self.registry.slots()
+        if list(self.slot_choice["values"]) != slots:
+            self.slot_choice["values"] = slots
+        if self.slot_name is None and slots:
+            self.slot_choice.set(slots[0])
+            self.select(slots[0])
+        # вкладка скрыта — ничего не рисуем; накопленное изменится одной отрисовкой при показе
+        if self.slot_name is None or not self.parent.winfo_viewable():
+            return
+
+        stats = self.registry.get(self.slot_name)
+        if stats is None:
+            # анализ завершён: последняя картина остаётся на экране
+            self.info_var.set(f"{self.slot_name}: анализ завершён")
+            return
+        changed = stats.changes(self.seen)
+        self.info_var.set(f"{self.slot_name} ({stats.analysis_type}), обновлено {datetime.now():%H:%M:%S}")
+        if not changed:
+            return
+        for section, data in changed.items():
+            draw = getattr(self, f"_draw_{section}", None)
+            if draw is not None:
+                draw(data)
+        self.canvas.draw_idle()
+
+    def _draw_operations(self, counts: dict):
+        values = [counts.get(op, 0) for op in OPERATIONS]
+        for bar, value in zip(self.ops_bars, values):
+            bar.set_height(value)
+        self.ax_ops.set_ylim(0, max(values) * 1.1 or 1)
+
+    def _draw_tables(self, counts: dict):
+        top = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:TOP_TABLES]
+        names = [f"{schema}.{table}" for (schema, table), _ in top]
+        values = [n for _, n in top]
+        if names != self.table_names:
+            # состав топа изменился — столбцы пересоздаются только на этой оси
+            if self.table_bars is not None:
+                self.table_bars.remove()
+            positions = list(range(len(names)))[::-1]
+            self.table_bars = self.ax_tables.barh(positions, values, color="#2f6db5")
+            self.ax_tables.set_yticks(positions, names, fontsize="small")
+            self.table_names = names
+        else:
+            for bar, value in zip(self.table_bars, values):
+                bar.set_width(value)
+        self.ax_tables.set_xlim(0, max(values, default=0) * 1.1 or 1)
+
+    def _draw_activity(self, counts: dict):
+        buckets = sorted(counts.items())
+        xs = [start for (start, _), _ in buckets]
+        ys = [n for _, n in buckets]
+        if len(xs) > ACTIVITY_POINTS:
+            xs, ys = downsample_series(xs, ys, ACTIVITY_POINTS)
+        self.activity_line.set_data([datetime.fromtimestamp(x) for x in xs], ys)
+        self.ax_activity.relim()
+        self.ax_activity.autoscale_view()
+
+    def _draw_lag(self, points: list):
+        times = [datetime.fromtimestamp(at) for at, _, _ in points]
+        self.retained_line.set_data(times, [retained / MB for _, retained, _ in points])
+        self.pending_line.set_data(times, [pending / MB for _, _, pending in points])
+        self.ax_lag.relim()
+        self.ax_lag.autoscale_view()
@@ -0,0 +1,225 @@
+"""
+Разбор вывода плагинов логического декодирования в транзакции формата
+wal2json (format-version 1): {"xid", "timestamp", "change": [...]}, так что
+сводка, история и полные изменения одинаково работают с wal2json и test_decoding.
+
+Вывод test_decoding (опции include-xids, include-timestamp):
+
+    BEGIN 529
+    table public.orders: INSERT: id[integer]:1 name[text]:'O''Brien' amount[numeric]:12.5
+    table public.orders: UPDATE: old-key: id[integer]:1 new-tuple: id[integer]:2 name[text]:null
+    table public.orders: DELETE: id[integer]:2
+    COMMIT 529 (at 2025-12-15 10:00:00.123456+00)
+"""
+import json
+import re
+
+from metabd import lsn_to_int
+
+# заголовок изменения; имена в кавычках — если quote_identifier их экранировал
+_IDENT = r'"[^"]*(?:""[^"]*)*"|[^".:\s]+'
+_CHANGE_RE = re.compile(rf'table ({_IDENT})\.({_IDENT}): (INSERT|UPDATE|DELETE|TRUNCATE): ')
+# колонка целиком: имя[тип]:значение; тип может быть массивом (text[]) или
+# содержать пробелы, значение — строка в кавычках, битовая строка или токен до пробела;
+# кавычки внутри строк ('') разобраны развёрнутым циклом — без перебора по символу
+_COLUMN_RE = re.compile(r"""(?:"([^"]*(?:""[^"]*)*)"|([^\[\s"]+))\[([^\[\]]+(?:\[\])*)\]:"""
+                        r"""(?:'([^']*(?:''[^']*)*)'|B'([01]*)'|([^ ']*))(?: |$)""")
+_BEGIN_RE = re.compile(r"BEGIN(?: (\d+))?")
+_COMMIT_RE = re.compile(r"COMMIT(?: (\d+))?(?: \(at (.+)\))?")
+
+OLD_KEY = "old-key: "
+NEW_TUPLE = "new-tuple: "
+NO_TUPLE_DATA = "(no-tuple-data)"
+UNCHANGED_TOAST = "unchanged-toast-datum"
+
+INT_TYPES = frozenset({"smallint", "integer", "bigint", "oid"})
+FLOAT_TYPES = frozenset({"real", "double precision", "numeric"})
+
+_UNCHANGED = object()
+
+
+def _unquote_ident(name: str) -> str:
+    return name[1:-1].replace('""', '"') if name.startswith('"') else name
+
+
+def _typed(token: str, col_type: str):
+    """Значение без кавычек: числа и boolean — как у wal2json, остальное — строкой."""
+    if token == "null":
+        return None
+    if token == UNCHANGED_TOAST:
+        return _UNCHANGED
+    if col_type in INT_TYPES:
+        return int(token)
+    if col_type in FLOAT_TYPES:
+        return float(token)
+    if col_type == "boolean":
+        return token == "true"
+    return token
+
+
+def _parse_columns(text: str, pos: int, stop: str = None):
+    """
+    Колонки text начиная с pos до конца или до маркера stop.
+    Возвращает (имена, типы, значения, позиция после разобранного).
+    Неизменённые TOAST-значения пропускаются, как и в wal2json.
+    """
+    names, types, values = [], [], []
+    # одно регулярное выражение на колонку; колонки должны идти подряд —
+    # разрыв означает маркер stop или непонятный вывод
+    for match in _COLUMN_RE.finditer(text, pos):
+        if match.start() != pos:
+            break
+        quoted_name, name, col_type, quoted, bits, token = match.groups()
+        pos = match.end()
+        if quoted is not None:
+            value = quoted.replace("''", "'") if "''" in quoted else quoted
+        elif bits is not None:
+            value = bits
+        else:
+            value = _typed(token, col_type)
+            if value is _UNCHANGED:
+                continue
+        names.append(name if quoted_name is None else quoted_name.replace('""', '"'))
+        types.append(col_type)
+        values.append(value)
+    if pos < len(text) and not (stop is not None and text.startswith(stop, pos)):
+        raise ValueError(f"не разобрана колонка с позиции {pos}: {text[pos:pos + 40]!r}")
+    return names, types, values, pos
+
+
+def parse_change(line: str):
+    """
+    Строка изменения test_decoding → изменение в формате wal2json или None
+    (TRUNCATE и прочие строки, которых у wal2json format-version 1 нет).
+    """
+    match = _CHANGE_RE.match(line)
+    if match is None:
+        return None
+    schema, table, op = match.groups()
+    if op == "TRUNCATE":
+        return None
+    change = {"kind": op.lower(), "schema": _unquote_ident(schema), "table": _unquote_ident(table)}
+    pos = match.end()
+    if line.startswith(NO_TUPLE_DATA, pos):
+        if op == "DELETE":
+            change["oldkeys"] = {"keynames": [], "keytypes": [], "keyvalues": []}
+        return change
+
+    if op == "DELETE":
+        names, types, values, _ = _parse_columns(line, pos)
+        change["oldkeys"] = {"keynames": names, "keytypes": types, "keyvalues": values}
+        return change
+    if op == "UPDATE" and line.startswith(OLD_KEY, pos):
+        names, types, values, pos = _parse_columns(line, pos + len(OLD_KEY), NEW_TUPLE)
+        change["oldkeys"] = {"keynames": names, "keytypes": types, "keyvalues": values}
+        pos += len(NEW_TUPLE)
+    names, types, values, _ = _parse_columns(line, pos)
+    change["columnnames"] = names
+    change["columntypes"] = types
+    change["columnvalues"] = values
+    return change
+
+
+def _quote_ident(name: str) -> str:
+    return name if re.fullmatch(r"[a-z_][a-z0-9_$]*", name) else '"' + name.replace('"', '""') + '"'
+
+
+def _format_value(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _format_columns(names, types, values) -> str:
+    return " ".join(f"{_quote_ident(name)}[{col_type}]:{_format_value(value)}"
+                    for name, col_type, value in zip(names, types, values))
+
+
+def format_change(change: dict) -> str:
+    """
+    Изменение в формате wal2json → строка test_decoding (обратно parse_change).
+    Нужна, когда значения изменены после разбора, например замаскированы;
+    неизменённые TOAST-значения при разборе отброшены и в строку не попадают.
+    """
+    line = f"table {_quote_ident(change['schema'])}.{_quote_ident(change['table'])}: {change['kind'].upper()}: "
+    old = change.get("oldkeys")
+    if change["kind"] == "delete":
+        return line + (_format_columns(old["keynames"], old["keytypes"], old["keyvalues"])
+                       if old and old["keynames"] else NO_TUPLE_DATA)
+    if old is not None:
+        line += OLD_KEY + _format_columns(old["keynames"], old["keytypes"], old["keyvalues"]) + " " + NEW_TUPLE
+    return line + _format_columns(change["columnnames"], change["columntypes"], change["columnvalues"])
+
+
+def _test_decoding_transactions(rows, watermark: int, on_error):
+    # строки изменений копятся до COMMIT: по LSN коммита решается, учтена ли уже
+    # транзакция (LSN отдельных изменений у параллельных транзакций перемешаны),
+    # и только новые транзакции разбираются
+    xid, lines, count = None, [], 0
+    last_lsn = None
+    for row in rows:
+        data = row[0]
+        lsn = row[1] if len(row) > 1 else None
+        last_lsn = lsn if lsn is not None else last_lsn
+        count += 1
+        if data.startswith("BEGIN"):
+            match = _BEGIN_RE.match(data)
+            xid = int(match.group(1)) if match and match.group(1) else None
+            lines, count = [], 1
+        elif data.startswith("COMMIT"):
+            match = _COMMIT_RE.match(data)
+            if lsn is None or lsn_to_int(lsn) > watermark:
+                timestamp = match.group(2) if match else None
+                yield _assemble(xid, timestamp, lines, on_error), lsn, count
+            xid, lines, count = None, [], 0
+        else:
+            lines.append(data)
+    if lines and (last_lsn is None or lsn_to_int(last_lsn) > watermark):
+        # поток оборван без COMMIT (запись или заглушка) — что есть, одной транзакцией
+        yield _assemble(xid, None, lines, on_error), last_lsn, count
+
+
+def _assemble(xid, timestamp, lines, on_error) -> dict:
+    changes, raw = [], []
+    for line in lines:
+        try:
+            change = parse_change(line)
+        except ValueError as e:
+            if on_error is not None:
+                on_error(e)
+            continue
+        if change is not None:
+            changes.append(change)
+            raw.append(line)
+    # lines — исходные строки изменений (для сохранения на диск в формате плагина)
+    return {"xid": xid, "timestamp": timestamp, "change": changes, "lines": raw}
+
+
+def _wal2json_transactions(rows, watermark: int, on_error):
+    for row in rows:
+        lsn = row[1] if len(row) > 1 else None
+        if lsn is not None and lsn_to_int(lsn) <= watermark:
+            continue
+        try:
+            transaction = json.loads(row[0])
+        except ValueError as e:
+            if on_error is not None:
+                on_error(e)
+            # битая строка всё равно учитывается — иначе слот застрянет на ней
+            transaction = {}
+        yield transaction, lsn, 1
+
+
+def decode_rows(rows, plugin: str = "wal2json", watermark: int = -1, on_error=None):
+    """
+    Строки слота (data, lsn) → (транзакция wal2json, lsn, строк слота) для
+    транзакций новее watermark (LSN числом). Ошибка разбора строки передаётся
+    on_error, строка пропускается.
+    """
+    if plugin == "test_decoding":
+        return _test_decoding_transactions(rows, watermark, on_error)
+    return _wal2json_transactions(rows, watermark, on_error)
@@ -0,0 +1,77 @@
+def minmax_envelope(xs: list, ys: list, n_out: int):
+    """
+    Прореживает ряд до ~n_out точек: в каждой корзине остаются минимум и максимум
+    (в исходном порядке), поэтому всплески активности не пропадают.
+    Первая и последняя точки сохраняются всегда.
+    """
+    n = len(xs)
+    if n_out <= 0 or n <= n_out or n_out < 4:
+        return list(xs), list(ys)
+
+    keep = [0]
+    buckets = (n_out - 2) // 2
+    bucket_size = (n - 2) / buckets
+    for b in range(buckets):
+        start = 1 + int(b * bucket_size)
+        end = 1 + int((b + 1) * bucket_size)
+        if start >= end:
+            continue
+        lo = hi = start
+        for i in range(start + 1, end):
+            if ys[i] < ys[lo]:
+                lo = i
+            elif ys[i] > ys[hi]:
+                hi = i
+        keep.extend(sorted({lo, hi}))
+    keep.append(n - 1)
+    return [xs[i] for i in keep], [ys[i] for i in keep]
+
+
+def lttb(xs: list, ys: list, n_out: int):
+    """
+    Largest-Triangle-Three-Buckets: оставляет n_out точек, в каждой корзине выбирая
+    ту, что образует наибольший треугольник с уже выбранной точкой и средним
+    следующей корзины. Форма ряда и всплески сохраняются лучше, чем при шаге.
+    """
+    n = len(xs)
+    if n_out <= 0 or n <= n_out or n_out < 3:
+        return list(xs), list(ys)
+
+    every = (n - 2) / (n_out - 2)
+    keep = [0]
+    a = 0
+    for i in range(n_out - 2):
+        # среднее следующей корзины — третья вершина треугольника
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        if avg_end <= avg_start:
+            avg_start, avg_end = n - 1, n
+        count = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / count
+        avg_y = sum(ys[avg_start:avg_end]) / count
+
+        ax, ay = xs[a], ys[a]
+        best, best_area = -1, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        a = best
+    keep.append(n - 1)
+    return [xs[i] for i in keep], [ys[i] for i in keep]
+
+
+DOWNSAMPLE_METHODS = {
+    "lttb": lttb,
+    "minmax": minmax_envelope,
+}
+
+
+def downsample_series(xs: list, ys: list, n_out: int, method: str = "lttb"):
+    """Прореживает ряд выбранным методом ("lttb" или "minmax"); n_out <= 0 — без прореживания."""
+    try:
+        fn = DOWNSAMPLE_METHODS[method]
+    except KeyError:
+        raise ValueError(f"Неизвестный метод прореживания: {method}")
+    return fn(xs, ys, n_out)
@@ -6,6 +6,11 @@ from tkinter import ttk
 from logical_slot import LogicalSlot
 from controller import *
 from metabd import *
+from slotmonitor import DEFAULT_LIMIT_MB, SLOT_ACTIONS, get_latest_slot_metrics, start_monitors
+from uitasks import POLL_MS, UiTasks
+from dashboard import DashboardTab
+from treesync import sync_tree
+from catalog import CATALOG, display_name, format_rows, search_tables
 import signal, sys
 import traceback
 import random
@@ -23,15 +28,27 @@ def handle_exit(sig, frame):
 # ловим Ctrl+C
 signal.signal(signal.SIGINT, handle_exit)
 
+# значение фильтра схем «без фильтра»
+ALL_SCHEMAS = "все схемы"
+
 class WalAnalyzerApp:
     
     def __init__(self, root):
         self.root = root
         self.result_queue = queue.Queue()
+        # вся работа с PostgreSQL, SQLite и диском — в фоне, результаты забирает check_queue
+        self.tasks = UiTasks(self.result_queue)
         self.db_config = {} 
+        # статусы слотов PostgreSQL обновляются в фоне, список строится по кэшу
+        self.slot_cache = PgSlotCache()
+        self.active_rows, self.slot_metrics = [], {}
+        self.results_page = 0
+        self.connections_outdated = False
+        self.conn_shown, self.res_shown = {}, {}
         self.root.title("Анализатор WAL")
         def on_close():
             print("Закрытие приложения...")
+            self.tasks.shutdown()
             for obj in gc.get_objects():
                 if isinstance(obj, sqlite3.Connection):
                     print("Открытое соединение SQLite:", obj)
@@ -52,31 +69,44 @@ class WalAnalyzerApp:
             self.root.state("zoomed")               # Windows, Mac 
 
         # --- вкладки ---
+        # строка состояния: что сейчас выполняется в фоне
+        self.status_var = StringVar()
+        ttk.Label(root, textvariable=self.status_var, anchor=W).pack(side=BOTTOM, fill=X, padx=8, pady=2)
+
         self.notebook = ttk.Notebook(root)
         self.notebook.pack(expand=True, fill=BOTH)
 
         self.frame_ans = ttk.Frame(self.notebook)
         self.frame_bd = ttk.Frame(self.notebook)
         self.frame_slot = ttk.Frame(self.notebook)
+        self.frame_dash = ttk.Frame(self.notebook)
 
         self.notebook.add(self.frame_bd, text="Параметры подключения")
         self.notebook.add(self.frame_ans, text="Подключения")
         self.notebook.tab(self.frame_ans, state="disabled")
         self.notebook.add(self.frame_slot, text="Создать анализ")
         self.notebook.tab(self.frame_slot, state="disabled")
+        self.notebook.add(self.frame_dash, text="Мониторинг")
 
         # инициализация вкладок
         self.init_bd_tab()
         self.init_slot_tab()
         self.init_ans_tab()
+        # панель мониторинга (matplotlib и TkAgg) строится при первом открытии вкладки —
+        # стек графиков не грузится при запуске окна
+        self.dashboard = None
 
         self.notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+        self.root.after(POLL_MS, self.check_queue)
 
     def on_tab_changed(self, event):
         tab = event.widget.tab(event.widget.select(), "text")
         if tab == "Подключения":
             # print('Нет, ну я пробывал')
             self.load_connections()
+        elif tab == "Мониторинг" and self.dashboard is None:
+            # агрегаты работающих анализов в памяти, обновление раз в несколько секунд
+            self.dashboard = DashboardTab(self.frame_dash)
 
     # --- генерация имени подключения ---
     def generate_conn_name(self) -> str:
@@ -105,13 +135,16 @@ class WalAnalyzerApp:
 
         center_frame.columnconfigure(1, weight=1)
 
-        connect_btn = ttk.Button(center_frame, text="Подключиться", command=self.connect_with_pg)
-        connect_btn.grid(row=len(labels), column=0, columnspan=2, pady=12)
+        self.connect_btn = ttk.Button(center_frame, text="Подключиться", command=self.connect_with_pg)
+        self.connect_btn.grid(row=len(labels), column=0, columnspan=2, pady=12)
 
         self.msg_var = StringVar()
         msg_label = ttk.Label(center_frame, textvariable=self.msg_var, foreground="green")
         msg_label.grid(row=len(labels)+1, column=0, columnspan=2)
 
+    def set_status(self, text: str = ""):
+        self.status_var.set(text)
+
     def connect_with_pg(self):
         self.db_config = {
             "dbname": self.entries["Имя БД:"].get(),
@@ -120,10 +153,32 @@ class WalAnalyzerApp:
             "host": self.entries["Хост:"].get(),
             "port": self.entries["Порт:"].get(),
         }
-        result = check_connection(self.db_config)
+        db_config = dict(self.db_config)
+
+        def connect():
+            # проверка и каталог таблиц — одним заходом в фоне; каталог той же базы
+            # берётся из кэша, обновляется кнопкой рядом со списком
+            result = check_connection(db_config)
+            tables = CATALOG.get(db_config) if "успешно" in result else []
+            return result, tables
+
+        if self.tasks.submit("connect", connect, on_done=self.on_connected, on_error=self.on_connect_error):
+            self.connect_btn.configure(state="disabled")
+            self.msg_var.set("Подключение…")
+            self.set_status("Подключение к PostgreSQL…")
+
+    def on_connected(self, outcome):
+        result, tables = outcome
+        self.connect_btn.configure(state="normal")
+        # другая база — другие слоты
+        self.slot_cache = PgSlotCache()
+        self.set_status()
         self.msg_var.set(result)
         if "успешно" in result:
-            self.load_tables()
+            self.load_tables(tables)
+            # монитор удерживаемого WAL — и для активных анализов без потока в этом окне
+            self.tasks.submit("monitors", start_monitors,
+                              on_error=lambda e: print("Ошибка запуска монитора слотов:", e))
             self.notebook.tab(self.frame_ans, state="normal")
             if "превышено" not in result:
             # разблокируем вкладку "Создать анализ"
@@ -131,23 +186,63 @@ class WalAnalyzerApp:
             
                     # --- загрузка из SQLite ---
             self.load_connections()
+
+    def on_connect_error(self, error):
+        self.connect_btn.configure(state="normal")
+        self.set_status()
+        self.msg_var.set(f"Ошибка: {error}")
             
     
-    def load_tables(self):
-        tables = get_tables(self.db_config)
-
-        # убираем служебную таблицу из списка
-        tables = [t for t in tables if t != "data_change_log"]
+    def load_tables(self, tables):
+        """tables — [CatalogTable] всех схем; выбор таблиц сохраняется, если они остались."""
+        self.catalog_tables = tables
+        names = {display_name(t) for t in tables}
+        self.selected_tables &= names
+        self.schema_choice['values'] = [ALL_SCHEMAS] + sorted({t.schema for t in tables})
+        if self.schema_choice.get() not in self.schema_choice['values']:
+            self.schema_choice.set(ALL_SCHEMAS)
+        self.filter_tables()
+
+        # заполняем Combobox для истории; введённые через ; таблицы сохраняются, если все остались
+        self.history_table_choice['values'] = [display_name(t) for t in tables]
+        chosen = [t.strip() for t in self.history_table_choice.get().split(";") if t.strip()]
+        if tables and not (chosen and all(t in names for t in chosen)):
+            self.history_table_choice.current(0)
 
-        # заполняем Listbox
+    def refresh_catalog(self):
+        if self.tasks.submit("catalog", CATALOG.get, dict(self.db_config), True, on_done=self.on_catalog_loaded,
+                             on_error=lambda e: self.set_status(f"Ошибка чтения каталога: {e}")):
+            self.set_status("Чтение каталога таблиц…")
+
+    def on_catalog_loaded(self, tables):
+        self.set_status()
+        self.load_tables(tables)
+
+    def filter_tables(self, *args):
+        """Показывает таблицы выбранной схемы, имя которых содержит введённый текст."""
+        schema = self.schema_choice.get()
+        visible = search_tables(self.catalog_tables, self.table_search_var.get(),
+                                None if schema in ("", ALL_SCHEMAS) else schema)
+        self.visible_tables = [display_name(t) for t in visible]
         self.tables_list.delete(0, END)
-        for t in tables:
-            self.tables_list.insert(END, t)
-
-        # заполняем Combobox для истории
-        self.history_table_choice['values'] = tables
-        if tables:
-            self.history_table_choice.current(0)
+        if visible:
+            self.tables_list.insert(END, *(f"{name}  ({format_rows(t.rows)})"
+                                           for name, t in zip(self.visible_tables, visible)))
+        for i, name in enumerate(self.visible_tables):
+            if name in self.selected_tables:
+                self.tables_list.selection_set(i)
+        self.tables_count_var.set(f"{len(visible)} из {len(self.catalog_tables)}, выбрано {len(self.selected_tables)}")
+
+    def on_tables_select(self, event=None):
+        # выбор копится между поисками: скрытые фильтром таблицы остаются выбранными
+        selected = set(self.tables_list.curselection())
+        for i, name in enumerate(self.visible_tables):
+            if i in selected:
+                self.selected_tables.add(name)
+            else:
+                self.selected_tables.discard(name)
+        self.tables_count_var.set(f"{len(self.visible_tables)} из {len(self.catalog_tables)}, "
+                                  f"выбрано {len(self.selected_tables)}")
 
     # --- вкладка "Подключения" ---
     def init_ans_tab(self):
@@ -156,11 +251,12 @@ class WalAnalyzerApp:
 
         lf_conn = ttk.LabelFrame(pw, text="Работающие подключения")
         pw.add(lf_conn)
-        self.tree_conn = ttk.Treeview(lf_conn, columns=("name","type","date","plugin","db","active"), show="headings")
+        self.tree_conn = ttk.Treeview(lf_conn, columns=("name","type","date","plugin","db","active","wal"), show="headings")
         self.tree_conn.pack(expand=True, fill=BOTH)
         self.tree_conn.tag_configure("error_deleted", background="#ffe6e6", foreground="#990000")
+        self.tree_conn.tag_configure("wal_warn", background="#fff4d6")
        
-        for col in ("name","type","date","plugin","db"):
+        for col in ("name","type","date","plugin","db","active","wal"):
             self.tree_conn.heading(col, text=col)
             self.tree_conn.column(col, width=100, anchor="center")
 
@@ -173,6 +269,16 @@ class WalAnalyzerApp:
             self.tree_res.heading(col, text=col)
             self.tree_res.column(col, width=100, anchor="center")
 
+        # история анализов показывается страницами по RESULTS_PAGE_SIZE
+        pager = ttk.Frame(lf_res)
+        pager.pack(fill=X)
+        self.prev_page_btn = ttk.Button(pager, text="◀", width=3, command=lambda: self.show_results_page(-1))
+        self.prev_page_btn.pack(side=LEFT, padx=5, pady=3)
+        self.page_var = StringVar()
+        ttk.Label(pager, textvariable=self.page_var).pack(side=LEFT)
+        self.next_page_btn = ttk.Button(pager, text="▶", width=3, command=lambda: self.show_results_page(1))
+        self.next_page_btn.pack(side=LEFT, padx=5, pady=3)
+
     # --- вкладка "Создать анализ" ---
     def init_slot_tab(self):
         main_frame = ttk.Frame(self.frame_slot)
@@ -196,8 +302,24 @@ class WalAnalyzerApp:
         tables_frame = ttk.Frame(left_frame)
         tables_frame.grid(row=1, column=0, sticky="we", pady=5)
 
+        # каталог всех схем: фильтр по схеме, поиск по мере ввода, обновление вручную
+        self.catalog_tables, self.visible_tables, self.selected_tables = [], [], set()
+        search_frame = ttk.Frame(tables_frame)
+        search_frame.pack(side=TOP, fill=X)
+        self.schema_choice = ttk.Combobox(search_frame, state="readonly", width=14, values=[ALL_SCHEMAS])
+        self.schema_choice.set(ALL_SCHEMAS)
+        self.schema_choice.bind("<<ComboboxSelected>>", self.filter_tables)
+        self.schema_choice.pack(side=LEFT)
+        self.table_search_var = StringVar()
+        self.table_search_var.trace_add("write", self.filter_tables)
+        ttk.Entry(search_frame, textvariable=self.table_search_var).pack(side=LEFT, fill=X, expand=True, padx=5)
+        ttk.Button(search_frame, text="⟳", width=3, command=self.refresh_catalog).pack(side=LEFT)
+        self.tables_count_var = StringVar()
+        ttk.Label(tables_frame, textvariable=self.tables_count_var).pack(side=BOTTOM, anchor=W)
+
         # exportselection=False — чтобы выбранное не сбрасывалось при переключении фокуса между списками
-        self.tables_list = Listbox(tables_frame, selectmode=MULTIPLE, height=6, exportselection=False)
+        self.tables_list = Listbox(tables_frame, selectmode=MULTIPLE, height=10, exportselection=False)
+        self.tables_list.bind("<<ListboxSelect>>", self.on_tables_select)
         scroll_tables = ttk.Scrollbar(tables_frame, orient=VERTICAL, command=self.tables_list.yview)
         self.tables_list.configure(yscrollcommand=scroll_tables.set)
 
@@ -220,10 +342,40 @@ class WalAnalyzerApp:
         self.conn_name_entry.insert(0, self.generate_conn_name())
         self.conn_name_entry.grid(row=7, column=0, sticky="we", pady=5)
 
-        left_frame.rowconfigure(8, weight=1)
+        # постоянный индекс изменений: история любого ключа без повторного чтения событий
+        self.change_index_var = IntVar()
+        ttk.Checkbutton(left_frame, text="Вести индекс изменений по ключам",
+                        variable=self.change_index_var).grid(row=8, column=0, sticky=W, pady=5)
+
+        # границы адаптивного интервала опроса слота
+        poll_frame = ttk.Frame(left_frame)
+        poll_frame.grid(row=9, column=0, sticky="we", pady=5)
+        ttk.Label(poll_frame, text="Опрос слота (сек): от").pack(side=LEFT)
+        self.poll_min_spin = Spinbox(poll_frame, from_=1, to=60, increment=1, width=4)
+        self.poll_min_spin.pack(side=LEFT, padx=5)
+        ttk.Label(poll_frame, text="до").pack(side=LEFT)
+        self.poll_max_spin = Spinbox(poll_frame, from_=1, to=600, increment=1, width=4)
+        self.poll_max_spin.delete(0, END)
+        self.poll_max_spin.insert(0, "60")
+        self.poll_max_spin.pack(side=LEFT, padx=5)
+
+        # защита от разрастания WAL: порог удерживаемого слотом WAL и действие монитора
+        monitor_frame = ttk.Frame(left_frame)
+        monitor_frame.grid(row=10, column=0, sticky="we", pady=5)
+        ttk.Label(monitor_frame, text="Порог WAL (МБ):").pack(side=LEFT)
+        self.monitor_limit_spin = Spinbox(monitor_frame, from_=16, to=1048576, increment=16, width=7)
+        self.monitor_limit_spin.delete(0, END)
+        self.monitor_limit_spin.insert(0, str(DEFAULT_LIMIT_MB))
+        self.monitor_limit_spin.pack(side=LEFT, padx=5)
+        self.monitor_action_choice = ttk.Combobox(monitor_frame, values=list(SLOT_ACTIONS),
+                                                  state="readonly", width=7)
+        self.monitor_action_choice.set("warn")
+        self.monitor_action_choice.pack(side=LEFT, padx=5)
+
+        left_frame.rowconfigure(10, weight=1)
 
         self.run_btn = ttk.Button(left_frame, text="Запустить анализ", command=self.run_analysis)
-        self.run_btn.grid(row=9, column=0, sticky="we", pady=15, ipady=10)
+        self.run_btn.grid(row=11, column=0, sticky="we", pady=15, ipady=10)
 
         left_frame.columnconfigure(0, weight=1)
 
@@ -246,24 +398,23 @@ class WalAnalyzerApp:
         self.html_var = IntVar()
         ttk.Checkbutton(self.frame_summary, text="PDF", variable=self.pdf_var).grid(row=0, column=0, sticky=W)
         ttk.Checkbutton(self.frame_summary, text="HTML", variable=self.html_var).grid(row=0, column=1, sticky=W)
+        # plotly.js встраивается в файл — отчёт открывается без интернета
+        self.html_offline_var = IntVar()
+        ttk.Checkbutton(self.frame_summary, text="HTML без интернета",
+                        variable=self.html_offline_var).grid(row=0, column=2, sticky=W)
 
         self.frame_history = ttk.LabelFrame(right_frame, text="Параметры истории")
         self.frame_history.grid(row=5, column=0, sticky="we", pady=15)
 
-        ttk.Label(self.frame_history, text="Таблица для истории:").grid(row=0, column=0, sticky=W, padx=5, pady=5)
+        ttk.Label(self.frame_history, text="Таблицы для истории через ;").grid(row=0, column=0, sticky=W, padx=5, pady=5)
 
-        # Combobox вместо Listbox
-        self.history_table_choice = ttk.Combobox(self.frame_history, state="readonly")
+        # таблица из списка или несколько таблиц через ; вручную
+        self.history_table_choice = ttk.Combobox(self.frame_history)
         self.history_table_choice.grid(row=0, column=1, sticky="we", padx=5, pady=5)
 
-        ttk.Label(self.frame_history, text="Значения первичных ключей через ;").grid(row=1, column=0, sticky=W, padx=5, pady=5)
+        ttk.Label(self.frame_history, text="Значения первичных ключей через ; (таблица:значение — для одной таблицы, составной ключ — через запятую)").grid(row=1, column=0, sticky=W, padx=5, pady=5)
         self.history_value_entry = ttk.Entry(self.frame_history)
         self.history_value_entry.grid(row=1, column=1, sticky="we", padx=5, pady=5)
-        
-        # Новое поле для маскирования
-        ttk.Label(self.frame_history, text="Поля для маскирования через ;").grid(row=2, column=0, sticky=W, padx=5, pady=5)
-        self.history_mask_entry = ttk.Entry(self.frame_history)
-        self.history_mask_entry.grid(row=2, column=1, sticky="we", padx=5, pady=5)
 
 
         self.frame_history.columnconfigure(1, weight=1)
@@ -289,6 +440,15 @@ class WalAnalyzerApp:
         self.disk_entry = ttk.Entry(self.frame_full, state="disabled")
         self.disk_entry.grid(row=3, column=1, sticky="we", pady=8)
 
+        # маскирование применяется при приёме событий для любого типа анализа
+        frame_mask = ttk.LabelFrame(right_frame, text="Маскирование")
+        frame_mask.grid(row=7, column=0, sticky="we", pady=15)
+        ttk.Label(frame_mask, text="Поля через ; (поле, поле:hash, поле:truncate(N), поле:null)").grid(
+            row=0, column=0, sticky=W, padx=5, pady=5)
+        self.mask_entry = ttk.Entry(frame_mask)
+        self.mask_entry.grid(row=0, column=1, sticky="we", padx=5, pady=5)
+        frame_mask.columnconfigure(1, weight=1)
+
         self.status_label = Label(right_frame, text="", fg="green")
         self.status_label.grid(row=10, column=0, sticky="w", pady=120)
 
@@ -332,16 +492,16 @@ class WalAnalyzerApp:
 
             # --- синхронизация списка истории с левым списком таблиц ---
         def sync_history_tables():
-            # собрать список таблиц из левого списка
-            tables = [self.tables_list.get(i) for i in range(self.tables_list.size())]
+            # собрать список таблиц из каталога
+            tables = [display_name(t) for t in self.catalog_tables]
 
             # заполнить combobox для истории
             self.history_table_choice['values'] = tables
 
-            # если слева что-то выбрано, по умолчанию выбрать первую выбранную для истории
-            left_selected = list(self.tables_list.curselection())
+            # если слева что-то выбрано, по умолчанию история по всем выбранным таблицам
+            left_selected = self.picked_tables()
             if left_selected:
-                self.history_table_choice.set(self.tables_list.get(left_selected[0]))
+                self.history_table_choice.set(";".join(left_selected))
             elif tables:
                 self.history_table_choice.set(tables[0])
             else:
@@ -350,9 +510,13 @@ class WalAnalyzerApp:
         # вызов при старте и при изменении выбора слева
         sync_history_tables()
 
+    def picked_tables(self) -> list:
+        """Выбранные таблицы в порядке каталога, включая скрытые текущим поиском."""
+        return [name for name in map(display_name, self.catalog_tables) if name in self.selected_tables]
+
     def collect_analysis_params(self) -> dict:
         # выбранные таблицы
-        tables = [self.tables_list.get(i) for i in self.tables_list.curselection()] or []
+        tables = self.picked_tables()
         # выбранные операции (безопасный дефолт)
         operations = [self.ops_list.get(i) for i in self.ops_list.curselection()] or ["INSERT", "UPDATE", "DELETE"]
 
@@ -372,9 +536,15 @@ class WalAnalyzerApp:
             "analysis_type": self.analysis_type.get(),
             "summary_pdf": bool(self.pdf_var.get()),
             "summary_html": bool(self.html_var.get()),
+            "html_offline": bool(self.html_offline_var.get()),
+            "change_index": bool(self.change_index_var.get()),
+            "poll_min_seconds": int(self.poll_min_spin.get()),
+            "poll_max_seconds": int(self.poll_max_spin.get()),
+            "monitor_limit_mb": int(self.monitor_limit_spin.get()),
+            "monitor_action": self.monitor_action_choice.get(),
             "history_table": history_table,
             "history_value": history_value,
-            "masks_fields": self.history_mask_entry.get(),
+            "masks_fields": self.mask_entry.get(),
             "save_target": self.save_target.get(),
             "plugin": plugin,                        # "wal2json" | "test_decoding"
             "disk_path": self.disk_entry.get(),      # может быть пустым, если сохранение в Postgres
@@ -384,29 +554,74 @@ class WalAnalyzerApp:
 
 
     def load_connections(self):
-        """Обновляет список подключений и анализов в Treeview."""
-        for item in self.tree_conn.get_children():
-            self.tree_conn.delete(item)
-        for item in self.tree_res.get_children():
-            self.tree_res.delete(item)
-
-
-        rows = load_connections_data(self.db_config)
-
-        for row in rows:
-            if row["result"] == "active":
-                self.tree_conn.insert("", "end",
-                                    values=(row["slot_name"], row["analysis_type"], row["date"],
-                                            row["plugin"], row["db"], "active"))
-            elif row["result"] == "error_deleted":
-                self.tree_conn.insert("", "end",
-                                    values=(row["slot_name"], row["analysis_type"], row["date"],
-                                            row["plugin"], row["db"], row["result"]),
-                                    tags=("error_deleted",))
-            else:  # ready
-                self.tree_res.insert("", "end",
-                                    values=(row["slot_name"], row["analysis_type"], row["date"],
-                                            row["plugin"], row["db"], row["result"]))
+        """
+        Обновляет список подключений и страницу результатов. SQLite читается в
+        фоне, статусы слотов берутся из кэша, который обновляется отдельно.
+        """
+        offset, limit = self.results_page * RESULTS_PAGE_SIZE, RESULTS_PAGE_SIZE
+
+        def load():
+            active = load_active_connections()
+            # последние замеры монитора: удерживаемый WAL / неподтверждённый WAL
+            metrics = get_latest_slot_metrics(slot_names={row["slot_name"] for row in active})
+            return active, metrics, load_results_page(offset, limit)
+
+        if self.tasks.submit("connections", load, on_done=self.show_connections,
+                             on_error=lambda e: self.set_status(f"Ошибка загрузки подключений: {e}")):
+            self.set_status("Загрузка подключений…")
+        else:
+            # загрузка уже идёт, но со старой страницей — повторим по её завершении
+            self.connections_outdated = True
+        self.refresh_slot_status()
+
+    def refresh_slot_status(self):
+        if not self.db_config or not self.slot_cache.stale():
+            return
+        cache = self.slot_cache
+        self.tasks.submit("pg_slots", cache.refresh, dict(self.db_config),
+                          on_done=lambda _: cache is self.slot_cache and self.show_active(),
+                          on_error=lambda e: print("Ошибка подключения к Postgres:", e))
+
+    def show_connections(self, data):
+        self.active_rows, self.slot_metrics, (results, total) = data
+        self.set_status()
+        self.show_active()
+        if self.connections_outdated:
+            self.connections_outdated = False
+            self.load_connections()
+            return
+
+        pages = max(1, -(-total // RESULTS_PAGE_SIZE))
+        if self.results_page >= pages:
+            # история сократилась — последняя страница
+            self.results_page = pages - 1
+            self.load_connections()
+            return
+        self.page_var.set(f"стр. {self.results_page + 1} из {pages} (всего {total})")
+        self.prev_page_btn.configure(state="normal" if self.results_page > 0 else "disabled")
+        self.next_page_btn.configure(state="normal" if self.results_page < pages - 1 else "disabled")
+        sync_tree(self.tree_res, self.res_shown,
+                  [(str(row["id"]), (row["slot_name"], row["analysis_type"], row["date"],
+                                     row["plugin"], row["db"], row["result"]), ())
+                   for row in results])
+
+    def show_active(self):
+        items = []
+        for row in mark_deleted_slots(self.active_rows, self.slot_cache.slots):
+            metric = self.slot_metrics.get(row["slot_name"])
+            wal = (f"{metric['retained_bytes'] // (1024 * 1024)} / {metric['pending_bytes'] // (1024 * 1024)} МБ"
+                   if metric else "")
+            if row["result"] == "error_deleted":
+                tags = ("error_deleted",)
+            else:
+                tags = ("wal_warn",) if metric and metric["action"] else ()
+            items.append((str(row["id"]), (row["slot_name"], row["analysis_type"], row["date"],
+                                           row["plugin"], row["db"], row["result"], wal), tags))
+        sync_tree(self.tree_conn, self.conn_shown, items)
+
+    def show_results_page(self, step: int):
+        self.results_page = max(0, self.results_page + step)
+        self.load_connections()
 
     # def run_analysis(self):
     #     def random_color():
@@ -434,12 +649,11 @@ class WalAnalyzerApp:
     #         self.status_label.config(text=f"Ошибка анализа: {e}")
     #         traceback.print_exc() 
     def check_queue(self):
+        """Забирает результаты фоновых задач в потоке Tk и планирует следующий опрос."""
         try:
-            result = self.result_queue.get_nowait()
-            worker_stop_correct(self.slot_config, self.analysis, result)
-        except queue.Empty:
-            print("Очередь пуста — поток ничего не положил")
-            worker_stop_correct(self.slot_config, self.analysis, None)
+            self.tasks.drain()
+        finally:
+            self.root.after(POLL_MS, self.check_queue)
 
 
     def run_analysis(self):
@@ -450,31 +664,37 @@ class WalAnalyzerApp:
             b = random.randint(0, 255)
             # переводим в hex-строку
             return f"#{r:02x}{g:02x}{b:02x}"
+        # параметры читаются из виджетов здесь, в фоне — только их копии
         self.slot_config = self.collect_analysis_params()
         print(self.slot_config)
+        db_config, slot_config = dict(self.db_config), dict(self.slot_config)
 
-        try:
-            save_connection(self.db_config, self.slot_config)
-            # self.analysis = create_slot(self.slot_config['slot_name'])
-            
+        def start():
+            save_connection(db_config, slot_config)
+            # create_slot подключается к PostgreSQL, цикл выборки уходит в свой поток
+            run_analysis_core(db_config, slot_config, self.result_queue)
 
-            # worker_thread = threading.Thread(
-            #     target=worker_fetch_loop,
-            #     args=(self.result_queue, self.analysis, self.slot_config, self.slot_config["period_hours"], 30), 
-            # )
-            # worker_thread.start()
-            # self.root.after(self.slot_config["period_hours"]*1000+1000, self.check_queue)
+        cache = self.slot_cache
 
+        def on_done(_):
+            self.run_btn.configure(state="normal")
+            self.set_status()
+            self.status_label.config(text="Слот успешно создан!", fg=random_color())
+            # кэш слотов мог быть прочитан до создания — новый анализ не должен выглядеть удалённым
+            cache.add(slot_config["slot_name"])
             self.load_connections()
-            color = random_color()
-            self.status_label.config(text="Слот успешно создан!", fg=color)
-
-            run_analysis_core(self.db_config, self.slot_config, self.result_queue)
-
-
-        except Exception as e:
-            # self.msg_var_slot.set(f"Ошибка анализа: {e}")
-            self.status_label.config(text=f"Ошибка анализа: {e}")
-            traceback.print_exc()
 
+        def on_error(e):
+            self.run_btn.configure(state="normal")
+            self.set_status()
+            self.status_label.config(text=f"Ошибка анализа: {e}", fg="red")
+            traceback.print_exception(type(e), e, e.__traceback__)
+            # запись в SQLite могла успеть — список подключений покажет error_deleted
+            # по свежему списку слотов
+            cache.invalidate()
+            self.load_connections()
 
+        if self.tasks.submit("analysis", start, on_done=on_done, on_error=on_error):
+            self.run_btn.configure(state="disabled")
+            self.status_label.config(text="Создание слота…", fg="gray")
+            self.set_status(f"Создание слота {slot_config['slot_name']}…")
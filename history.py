@@ -0,0 +1,241 @@
+import json
+import os
+import shutil
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from changeindex import make_pk
+from masking import Masker
+from metabd import lsn_to_int
+from reportbuilder import register_fonts
+
+SPOOL_DIR = "history_spool"
+MAX_OPEN_SPOOLS = 64
+
+
+def parse_history_targets(history_table: str, history_value: str) -> dict:
+    """
+    Разбирает параметры истории в {таблица: [id, ...]}.
+    history_table — одна или несколько таблиц через ';'.
+    history_value — значения ключей через ';'; значение без префикса относится
+    ко всем таблицам истории, с префиксом 'таблица:' — только к ней.
+    Составной ключ задаётся значениями через запятую в порядке колонок ключа.
+    """
+    tables = [t.strip() for t in (history_table or "").split(";") if t.strip()]
+    targets = {table: [] for table in tables}
+    for value in (history_value or "").split(";"):
+        value = value.strip()
+        if not value:
+            continue
+        table, sep, id_value = value.partition(":")
+        if sep and table.strip() in targets:
+            targets[table.strip()].append(id_value.strip())
+        else:
+            for ids in targets.values():
+                ids.append(value)
+    return {table: ids for table, ids in targets.items() if ids}
+
+
+def history_spool_dir(output_dir: str, slot_name: str) -> str:
+    """Спулы истории одного анализа — в своём каталоге, чтобы удалять их целиком."""
+    return os.path.join(output_dir, SPOOL_DIR, slot_name)
+
+
+def remove_history_spool(output_dir: str, slot_name: str):
+    """Удаляет спулы истории анализа: после завершения или удаления слота они не нужны."""
+    shutil.rmtree(history_spool_dir(output_dir, slot_name), ignore_errors=True)
+
+
+def write_history_pdf(path: str, title: str, lines):
+    """Пишет PDF истории: заголовок и строки изменений, страницы добавляются по мере заполнения."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+    register_fonts()
+
+    c = canvas.Canvas(path, pagesize=A4)
+    c.setFont("Arial", 12)
+    width, height = A4
+    y = height - 50
+    c.drawString(50, y, title)
+    y -= 30
+    for line in lines:
+        c.drawString(50, y, line)
+        y -= 20
+        if y < 50:
+            c.showPage()
+            c.setFont("Arial", 12)
+            y = height - 50
+    c.save()
+
+
+def history_pdf_from_index(path: str, table: str, pk: str, changes: list):
+    """PDF истории ключа по записям индекса изменений (см. changeindex.get_key_history)."""
+    lines = (
+        f"{datetime.fromtimestamp(ch['ts'], tz=timezone.utc):%Y-%m-%d %H:%M:%S} "
+        f"{ch['operation']} xid={ch['xid']}: {ch['data']}"
+        if ch["ts"] is not None else f"{ch['operation']} xid={ch['xid']}: {ch['data']}"
+        for ch in changes
+    )
+    write_history_pdf(path, f"История изменений {table} Id={pk} (индекс)", lines)
+
+
+class HistoryEngine:
+    """
+    История изменений по нескольким таблицам и любому числу Id за один проход.
+    События раскладываются по Id поиском в словаре и дописываются в спул-файл
+    каждого Id (открытых файлов не больше max_open). PDF перестраиваются из
+    спула только для затронутых Id, по одному canvas за раз, поэтому отчёт
+    содержит всю историю с начала анализа, а не только последний цикл.
+
+    cycle_lsn — LSN конца цикла выборки: им помечается каждая строка спула.
+    watermark — водяной знак слота (lsn_to_int, -1 — нет): строки с меткой выше
+    него дописаны циклом, который не был зафиксирован (сбой до коммита), —
+    при повторе цикла они удаляются перед дозаписью и не попадают в PDF.
+    """
+
+    def __init__(self, slot_name: str, targets: dict, output_dir: str, columns: dict,
+                 masker: Masker = None, max_open: int = MAX_OPEN_SPOOLS, keys: dict = None,
+                 cycle_lsn: str = None, watermark: int = None):
+        self.slot_name = slot_name
+        self.output_dir = output_dir
+        # колонки и ключ таблиц (relcache) — для событий без columnnames/pk
+        self.columns = columns
+        self.keys = keys or {}
+        # обычно события замаскированы ещё при приёме; masker — для сырых файлов
+        self.masker = masker
+        self.max_open = max_open
+        self.spool_dir = history_spool_dir(output_dir, slot_name)
+        # {таблица: {str(id): id}} — сопоставление события с Id за O(1)
+        self.lookup = {table: {str(id_value): id_value for id_value in ids}
+                       for table, ids in targets.items()}
+        self.open_spools = OrderedDict()
+        self.touched = set()
+        self.cycle_lsn = cycle_lsn
+        self.watermark = watermark
+        self.trimmed = set()
+
+    def pdf_path(self, table: str, id_value) -> str:
+        return os.path.join(self.output_dir, f"{self.slot_name}_{table}_{id_value}.pdf")
+
+    def spool_path(self, table: str, id_value) -> str:
+        return os.path.join(self.spool_dir, f"{table}_{id_value}.txt")
+
+    def _committed(self, line: str) -> bool:
+        """Строка спула зафиксирована водяным знаком или дописана текущим циклом."""
+        lsn, sep, _ = line.partition("\t")
+        if not sep or self.watermark is None or lsn == self.cycle_lsn:
+            return True
+        return lsn_to_int(lsn) <= self.watermark
+
+    def _trim_uncommitted(self, path: str):
+        """Убирает из спула строки незафиксированного цикла (они всегда в конце файла)."""
+        if self.watermark is None or not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        keep = len(lines)
+        while keep and not self._committed(lines[keep - 1]):
+            keep -= 1
+        if keep < len(lines):
+            with open(path, "w", encoding="utf-8") as f:
+                f.writelines(lines[:keep])
+
+    def _spool(self, table: str, id_value):
+        key = (table, id_value)
+        f = self.open_spools.get(key)
+        if f is not None:
+            self.open_spools.move_to_end(key)
+            return f
+        if len(self.open_spools) >= self.max_open:
+            _, oldest = self.open_spools.popitem(last=False)
+            oldest.close()
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = self.spool_path(table, id_value)
+        if key not in self.trimmed:
+            self._trim_uncommitted(path)
+            self.trimmed.add(key)
+        f = open(path, "a", encoding="utf-8")
+        self.open_spools[key] = f
+        return f
+
+    def _close_spools(self):
+        for f in self.open_spools.values():
+            f.close()
+        self.open_spools.clear()
+
+    def _match_key(self, ids: dict, table: str, row: dict):
+        names = self.keys.get(table) or ["id"]
+        if not row or not all(name in row for name in names):
+            return None
+        return ids.get(make_pk(row[name] for name in names))
+
+    def process(self, jsonl_path: str):
+        """Один линейный проход по JSONL: подходящие строки уходят в спулы своих Id."""
+        if not os.path.exists(jsonl_path):
+            return
+        try:
+            with open(jsonl_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        ev = json.loads(line)
+                    except Exception:
+                        continue
+
+                    table = ev.get("table")
+                    if table not in self.lookup:
+                        table = f"{ev.get('schema')}.{table}"
+                    ids = self.lookup.get(table)
+                    if not ids:
+                        continue
+
+                    columns = ev.get("columns") or self.columns.get(table, [])
+                    old_data_list = ev.get("old_data") or []
+                    new_data_list = ev.get("new_data") or []
+                    # превращаем списки в словари; oldkeys несут только ключевые колонки
+                    old_data = dict(zip(ev.get("key_columns") or columns, old_data_list)) if old_data_list else {}
+                    new_data = dict(zip(columns, new_data_list)) if new_data_list else {}
+
+                    if ev.get("pk") is not None:
+                        id_value = ids.get(str(ev["pk"]))
+                    else:
+                        id_value = self._match_key(ids, table, old_data)
+                        if id_value is None:
+                            id_value = self._match_key(ids, table, new_data)
+                    if id_value is None:
+                        continue
+
+                    if self.masker:
+                        old_data = self.masker.mask_row(old_data)
+                        new_data = self.masker.mask_row(new_data)
+                    tag = f"{self.cycle_lsn}\t" if self.cycle_lsn else ""
+                    self._spool(table, id_value).write(f"{tag}{old_data} -> {new_data}\n")
+                    self.touched.add((table, id_value))
+        finally:
+            self._close_spools()
+
+    def _render_pdf(self, table: str, id_value):
+        title = f"История изменений {table} Id={id_value}, slot={self.slot_name}"
+        spool_path = self.spool_path(table, id_value)
+        if not os.path.exists(spool_path):
+            write_history_pdf(self.pdf_path(table, id_value), title, [])
+            return
+        with open(spool_path, "r", encoding="utf-8") as f:
+            lines = (line.rstrip("\n").partition("\t")[2] or line.rstrip("\n")
+                     for line in f if self._committed(line))
+            write_history_pdf(self.pdf_path(table, id_value), title, lines)
+
+    def finish(self) -> list:
+        """Перестраивает PDF затронутых Id (и создаёт пустые для новых) и возвращает пути ко всем."""
+        paths = []
+        for table, ids in self.lookup.items():
+            for id_value in ids.values():
+                path = self.pdf_path(table, id_value)
+                if (table, id_value) in self.touched or not os.path.exists(path):
+                    self._render_pdf(table, id_value)
+                paths.append(path)
+        self.touched.clear()
+        return paths
+
+    def run(self, jsonl_path: str) -> list:
+        self.process(jsonl_path)
+        return self.finish()
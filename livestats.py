@@ -0,0 +1,123 @@
+"""
+Агрегаты работающих анализов в памяти — для панели мониторинга в окне.
+Цикл выборки любого анализа (summary, history, full) считает отобранные
+события в CycleCounts и после фиксации цикла прибавляет их сюда вместе с
+отставанием слота; панель раз в несколько секунд забирает только разделы,
+изменившиеся с прошлого опроса, и перерисовывает только их.
+"""
+import threading
+import time
+from collections import deque
+
+from dateutil import parser
+
+from metabd import count_event, floor_to_period_start, merge_partial_aggregates, new_partial_aggregates
+
+# замеров отставания на анализ: при опросе раз в 1–60 с — от 12 минут до 12 часов
+LAG_HISTORY = 720
+# ширина корзины активности на панели, выровненной по эпохе
+LIVE_BUCKET_SECONDS = 60
+SECTIONS = ("operations", "tables", "activity", "sizes", "lag")
+
+
+class CycleCounts:
+    """
+    Частичные агрегаты событий одного цикла выборки для панели.
+    Время транзакции одно на все её изменения — разбирается один раз.
+    """
+
+    def __init__(self, bucket_width: int = LIVE_BUCKET_SECONDS):
+        self.agg = new_partial_aggregates()
+        self.bucket_width = bucket_width
+        self._timestamp = self._bucket = None
+
+    def _bucket_of(self, timestamp):
+        if timestamp != self._timestamp:
+            self._timestamp = timestamp
+            try:
+                start = floor_to_period_start(int(parser.parse(timestamp).timestamp()), self.bucket_width)
+                self._bucket = (start, start + self.bucket_width)
+            except Exception:
+                self._bucket = None
+        return self._bucket
+
+    def add(self, operation: str, schema: str, table: str, timestamp, size: int):
+        count_event(self.agg, operation, schema, table, self._bucket_of(timestamp), size)
+
+
+class LiveStats:
+    """Агрегаты одного анализа; версии разделов растут при каждом изменении."""
+
+    def __init__(self, slot_name: str, analysis_type: str = None):
+        self.slot_name = slot_name
+        self.analysis_type = analysis_type
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.agg = new_partial_aggregates()
+        self.lag = deque(maxlen=LAG_HISTORY)   # (время, retained_bytes, pending_bytes)
+        self.versions = dict.fromkeys(SECTIONS, 0)
+
+    def add(self, agg: dict):
+        with self.lock:
+            for section, counts in agg.items():
+                if counts:
+                    merge_partial_aggregates(self.agg, {section: counts})
+                    self.versions[section] += 1
+
+    def add_lag(self, lag: dict, at: float = None):
+        if not lag:
+            return
+        with self.lock:
+            self.lag.append((at if at is not None else time.time(), lag["retained_bytes"], lag["pending_bytes"]))
+            self.versions["lag"] += 1
+
+    def changes(self, seen: dict) -> dict:
+        """
+        Копии разделов, версия которых отличается от seen ({раздел: версия});
+        seen обновляется на месте. Пустой результат — перерисовывать нечего.
+        """
+        changed = {}
+        with self.lock:
+            for section, version in self.versions.items():
+                if seen.get(section) != version:
+                    seen[section] = version
+                    changed[section] = list(self.lag) if section == "lag" else dict(self.agg[section])
+        return changed
+
+
+class LiveRegistry:
+    """Работающие анализы процесса по имени слота."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def start(self, slot_name: str, analysis_type: str = None) -> LiveStats:
+        with self.lock:
+            stats = self.stats[slot_name] = LiveStats(slot_name, analysis_type)
+            return stats
+
+    def finish(self, slot_name: str):
+        with self.lock:
+            self.stats.pop(slot_name, None)
+
+    def get(self, slot_name: str):
+        return self.stats.get(slot_name)
+
+    def slots(self) -> list:
+        with self.lock:
+            return sorted(self.stats)
+
+    def add(self, slot_name: str, agg: dict):
+        """Прибавляет агрегаты цикла; анализы вне реестра (cli run, бенчмарки) пропускаются."""
+        stats = self.stats.get(slot_name)
+        if stats is not None and agg:
+            stats.add(agg)
+
+    def add_lag(self, slot_name: str, lag: dict):
+        stats = self.stats.get(slot_name)
+        if stats is not None:
+            stats.add_lag(lag)
+
+
+LIVE = LiveRegistry()
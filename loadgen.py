@@ -0,0 +1,307 @@
+"""
+Генератор нагрузки на PostgreSQL для проверки анализатора под потоком изменений:
+несколько соединений, заданный темп, размер транзакций, доли операций, набор
+таблиц и распределение размеров значений.
+
+    python loadgen.py --seconds 60 --rate 5000 --workers 8 --tx-size 10
+    python loadgen.py --seconds 30 --rate 0 --mix UPDATE=1 --tables just_texts --sizes 10:8,15000:1
+
+--rate 0 — без ограничения темпа. Раз в --report-interval секунд печатается
+достигнутый темп, в конце — итог по операциям.
+"""
+import argparse
+import json
+import random
+import string
+import threading
+import time
+from collections import namedtuple
+
+import psycopg2
+
+from walgen import parse_op_mix
+
+db_config = {
+    'dbname': 'mydb',
+    'user': 'postgres',
+    'password': 'postgres',
+    'host': 'localhost',
+    'port': 5433
+}
+
+# таблица нагрузки: одна колонка значения, kind — "int" или "text"
+LoadTable = namedtuple("LoadTable", "name column kind")
+TABLES = {
+    "just_numbers": LoadTable("just_numbers", "number", "int"),
+    "just_texts": LoadTable("just_texts", "text", "text"),
+}
+DEFAULT_OP_MIX = {"INSERT": 1, "UPDATE": 1, "DELETE": 1}
+# размер текстового значения: маленький, средний, большой
+DEFAULT_SIZES = {10: 1, 2000: 1, 15000: 1}
+# сколько существующих Id таблицы берётся в пул ключей при старте
+KEY_POOL_SIZE = 10000
+TEXT_BUFFER_SIZE = 64 * 1024
+
+_ALPHABET = string.ascii_letters + string.digits
+
+
+def parse_sizes(text: str) -> dict:
+    """'10:0.6,2000:0.3,15000:0.1' → {10: 0.6, 2000: 0.3, 15000: 0.1}."""
+    sizes = {}
+    for part in text.split(","):
+        size, _, weight = part.partition(":")
+        sizes[int(size)] = float(weight or 1)
+    return sizes
+
+
+def create_tables(cur, tables):
+    for table in tables:
+        col_type = "INTEGER" if table.kind == "int" else "TEXT"
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {table.name} (id SERIAL PRIMARY KEY, {table.column} {col_type});")
+
+
+class LoadStats:
+    """Счётчики всех потоков: изменения по операциям, транзакции, ошибки."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ops = {"INSERT": 0, "UPDATE": 0, "DELETE": 0}
+        self.transactions = 0
+        self.errors = 0
+
+    def add(self, ops: dict, transactions: int = 1, errors: int = 0):
+        with self.lock:
+            for op, n in ops.items():
+                self.ops[op] += n
+            self.transactions += transactions
+            self.errors += errors
+
+    @property
+    def changes(self) -> int:
+        return sum(self.ops.values())
+
+
+class LoadWorker(threading.Thread):
+    """
+    Одно соединение: транзакции по tx_size изменений в темпе rate изменений/с.
+    Ключи UPDATE/DELETE берутся из собственного пула Id (свои INSERT ... RETURNING
+    и доля существующих строк), поэтому выбор строки — это поиск по первичному
+    ключу, а потоки не конфликтуют за одни и те же строки. Изменения пула
+    внутри транзакции журналируются и при откате отменяются — после каждой
+    транзакции пул совпадает с зафиксированными строками.
+    """
+
+    def __init__(self, index: int, generator: "LoadGenerator", keys: dict):
+        super().__init__(daemon=True, name=f"loadgen-{index}")
+        self.index = index
+        self.gen = generator
+        self.rnd = random.Random(generator.seed + index if generator.seed is not None else None)
+        self.keys = keys
+
+    def _change(self, cur, journal: list) -> str:
+        """Одно изменение; правки пула ключей дописываются в journal для отката."""
+        table = self.rnd.choice(self.gen.tables)
+        keys = self.keys[table.name]
+        op = self.rnd.choices(self.gen.ops, self.gen.weights)[0]
+        if op != "INSERT" and not keys:
+            op = "INSERT"
+
+        if op == "INSERT":
+            cur.execute(f"INSERT INTO {table.name} ({table.column}) VALUES (%s) RETURNING id;",
+                        (self.gen.value(self.rnd, table),))
+            key = cur.fetchone()[0]
+            keys.append(key)
+            journal.append((keys, key, None))
+        elif op == "UPDATE":
+            cur.execute(f"UPDATE {table.name} SET {table.column} = %s WHERE id = %s;",
+                        (self.gen.value(self.rnd, table), self.rnd.choice(keys)))
+        else:
+            # порядок ключей в пуле не важен — удаление за O(1)
+            i = self.rnd.randrange(len(keys))
+            key = keys[i]
+            keys[i] = keys[-1]
+            keys.pop()
+            journal.append((keys, None, key))
+            cur.execute(f"DELETE FROM {table.name} WHERE id = %s;", (key,))
+        return op
+
+    @staticmethod
+    def _undo(journal: list):
+        """Откатывает правки пула неудавшейся транзакции: вставленные Id убираются, удалённые возвращаются."""
+        for keys, added, removed in reversed(journal):
+            if added is not None:
+                # удаление с перестановкой могло сдвинуть Id — ищем по значению
+                keys.remove(added)
+            else:
+                keys.append(removed)
+
+    def run(self):
+        gen = self.gen
+        conn = psycopg2.connect(**gen.db_config)
+        try:
+            cur = conn.cursor()
+            # темп на поток; следующая транзакция не раньше due
+            per_worker = gen.rate / gen.workers if gen.rate else 0
+            due = time.monotonic()
+            while not gen.stop_event.is_set():
+                ops = {}
+                journal = []
+                try:
+                    for _ in range(gen.tx_size):
+                        op = self._change(cur, journal)
+                        ops[op] = ops.get(op, 0) + 1
+                    conn.commit()
+                    gen.stats.add(ops)
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    self._undo(journal)
+                    gen.stats.add({}, transactions=0, errors=1)
+                    print(f"Ошибка нагрузки в потоке {self.index}: {e}")
+                if per_worker:
+                    due += gen.tx_size / per_worker
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        gen.stop_event.wait(delay)
+                    elif delay < -1:
+                        # отстали больше чем на секунду — не пытаемся нагнать рывком
+                        due = time.monotonic()
+        finally:
+            conn.close()
+
+
+class LoadGenerator:
+    def __init__(self, db_config: dict, tables=None, rate: float = 1000, workers: int = 4,
+                 tx_size: int = 1, op_mix: dict = None, sizes: dict = None, seed: int = None):
+        self.db_config = db_config
+        self.tables = [TABLES[name] if isinstance(name, str) else name for name in (tables or list(TABLES))]
+        self.rate = rate
+        self.workers = max(1, workers)
+        self.tx_size = max(1, tx_size)
+        mix = op_mix or DEFAULT_OP_MIX
+        self.ops = [op for op in ("INSERT", "UPDATE", "DELETE") if mix.get(op)]
+        self.weights = [mix[op] for op in self.ops]
+        sizes = sizes or DEFAULT_SIZES
+        self.size_values = list(sizes)
+        self.size_weights = list(sizes.values())
+        self.seed = seed
+        # тексты — срезы заранее сгенерированного буфера: случайная строка на 15 КБ
+        # посимвольно стоила бы больше самого UPDATE
+        self.text_buffer = "".join(random.Random(seed).choices(_ALPHABET, k=TEXT_BUFFER_SIZE))
+        self.stats = LoadStats()
+        self.stop_event = threading.Event()
+
+    def value(self, rnd: random.Random, table: LoadTable):
+        if table.kind == "int":
+            return rnd.randint(1, 1000000)
+        size = rnd.choices(self.size_values, self.size_weights)[0]
+        text = self.text_buffer * (size // TEXT_BUFFER_SIZE + 1) if size > TEXT_BUFFER_SIZE else self.text_buffer
+        offset = rnd.randrange(len(text) - size + 1)
+        return text[offset:offset + size]
+
+    def prepare(self, prefill: int = 0):
+        """Создаёт таблицы и при необходимости добавляет prefill строк в каждую."""
+        conn = psycopg2.connect(**self.db_config)
+        try:
+            with conn, conn.cursor() as cur:
+                create_tables(cur, self.tables)
+                if prefill:
+                    rnd = random.Random(self.seed)
+                    for table in self.tables:
+                        cur.executemany(f"INSERT INTO {table.name} ({table.column}) VALUES (%s);",
+                                        [(self.value(rnd, table),) for _ in range(prefill)])
+        finally:
+            conn.close()
+
+    def load_keys(self) -> list:
+        """
+        Пулы Id потоков: последние KEY_POOL_SIZE строк каждой таблицы, поровну
+        по id % workers. Пулы снимаются до старта потоков — иначе строку,
+        вставленную одним потоком, мог бы забрать в пул и другой.
+        """
+        pools = [{table.name: [] for table in self.tables} for _ in range(self.workers)]
+        conn = psycopg2.connect(**self.db_config)
+        try:
+            with conn, conn.cursor() as cur:
+                for table in self.tables:
+                    cur.execute(f"SELECT id FROM {table.name} ORDER BY id DESC LIMIT %s;", (KEY_POOL_SIZE,))
+                    for (id_value,) in cur.fetchall():
+                        pools[id_value % self.workers][table.name].append(id_value)
+        finally:
+            conn.close()
+        return pools
+
+    def run(self, seconds: float, report_interval: float = 5, verbose: bool = True) -> dict:
+        """Нагрузка в течение seconds; возвращает итог с достигнутым темпом."""
+        workers = [LoadWorker(i, self, keys) for i, keys in enumerate(self.load_keys())]
+        start = time.monotonic()
+        for worker in workers:
+            worker.start()
+
+        last_changes, last_time = 0, start
+        deadline = start + seconds
+        try:
+            while not self.stop_event.is_set() and time.monotonic() < deadline:
+                self.stop_event.wait(min(report_interval, max(0, deadline - time.monotonic())))
+                now = time.monotonic()
+                changes = self.stats.changes
+                if verbose and now > last_time:
+                    print(f"{now - start:6.1f} с: {(changes - last_changes) / (now - last_time):8.0f} изм/с, "
+                          f"всего {changes}, ошибок {self.stats.errors}")
+                last_changes, last_time = changes, now
+        except KeyboardInterrupt:
+            print("Остановка по Ctrl+C")
+        finally:
+            self.stop_event.set()
+            for worker in workers:
+                worker.join()
+
+        elapsed = time.monotonic() - start
+        return {
+            "seconds": round(elapsed, 1),
+            "changes": self.stats.changes,
+            "changes_per_s": round(self.stats.changes / elapsed, 1) if elapsed else 0,
+            "transactions": self.stats.transactions,
+            "ops": dict(self.stats.ops),
+            "errors": self.stats.errors,
+        }
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def run_load(seconds: float, config: dict = None, prefill: int = 0, report_interval: float = 5,
+             verbose: bool = True, **options) -> dict:
+    generator = LoadGenerator(config or db_config, **options)
+    generator.prepare(prefill)
+    return generator.run(seconds, report_interval, verbose)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Генератор нагрузки для анализатора WAL")
+    arg_parser.add_argument("--seconds", type=float, default=60)
+    arg_parser.add_argument("--rate", type=float, default=1000, help="целевой темп, изменений/с (0 — без ограничения)")
+    arg_parser.add_argument("--workers", type=int, default=4, help="число соединений")
+    arg_parser.add_argument("--tx-size", type=int, default=1, help="изменений в транзакции")
+    arg_parser.add_argument("--mix", type=parse_op_mix, default=DEFAULT_OP_MIX,
+                            help="веса операций, например INSERT=0.5,UPDATE=0.4,DELETE=0.1")
+    arg_parser.add_argument("--tables", nargs="+", choices=list(TABLES), default=list(TABLES))
+    arg_parser.add_argument("--sizes", type=parse_sizes, default=DEFAULT_SIZES,
+                            help="размеры текстовых значений с весами, например 10:0.6,2000:0.3,15000:0.1")
+    arg_parser.add_argument("--prefill", type=int, default=0, help="строк в каждой таблице перед стартом")
+    arg_parser.add_argument("--seed", type=int)
+    arg_parser.add_argument("--report-interval", type=float, default=5, help="период вывода темпа, сек")
+    for key in ("dbname", "user", "password", "host"):
+        arg_parser.add_argument(f"--{key}", default=db_config[key])
+    arg_parser.add_argument("--port", type=int, default=db_config["port"])
+    args = arg_parser.parse_args(argv)
+
+    config = {key: getattr(args, key) for key in ("dbname", "user", "password", "host", "port")}
+    result = run_load(args.seconds, config, args.prefill, args.report_interval, rate=args.rate, workers=args.workers,
+                      tx_size=args.tx_size, op_mix=args.mix, tables=args.tables, sizes=args.sizes,
+                      seed=args.seed)
+    print(json.dumps(result, ensure_ascii=False))
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -5,15 +5,28 @@ from psycopg2 import OperationalError
 from metabd import *
 import sqlite3
 from reportbuilder import ReportBuilder
+from history import HistoryEngine, parse_history_targets, remove_history_spool
+from changeindex import ChangeIndexWriter
+from masking import Masker
+from relcache import RelationCache, split_table_name
 import os
 from datetime import datetime
 import traceback
+import time
+import metrics
+from stagetimer import CycleTimer, profile_call, profile_path
+from changesource import make_source
+from livestats import LIVE, CycleCounts
+from decoding import decode_rows, format_change
+
+# спул событий одного цикла для summary/history
+SPOOL_FILE = "events.jsonl"
 
 
 
 
 class LogicalSlot:
-    def __init__(self, db_config, slot_config):
+    def __init__(self, db_config, slot_config, source=None):
         print(db_config, slot_config)
         self.db_config = db_config
         self.slot_config = slot_config
@@ -31,20 +44,35 @@ class LogicalSlot:
 
         self.analysis_type = slot_config.get('analysis_type')
 
+        self.ids = []
         if self.slot_config["history_value"]:
             self.ids = [v.strip() for v in self.slot_config["history_value"].split(";") if v.strip()]
 
-        if self.slot_config.get("masks_fields"):
-            if isinstance(self.slot_config["masks_fields"], str):
-                self.masks_fields = [f.strip() for f in self.slot_config["masks_fields"].split(";") if f.strip()]
-            elif isinstance(self.slot_config["masks_fields"], list):
-                self.masks_fields = [f.strip() for f in self.slot_config["masks_fields"] if f.strip()]
-            else:
-                self.masks_fields = []
+        # маскирование выполняется один раз при приёме — до записи в любой приёмник
+        self.masker = Masker.from_config(self.slot_config.get("masks_fields"))
+        self.masks_fields = list(self.masker.rules)
+
+        # индекс изменений по ключам для мгновенной истории любого ключа
+        self.change_index = ChangeIndexWriter(self.slot_name) if slot_config.get("change_index") else None
+
+        # LSN последнего изменения, учтённого в SQLite (таблица slot_watermarks)
+        self.watermark = None
+
+        # профилирование следующего цикла (request_profile, cli --profile, SIGUSR1)
+        self.profile_next = bool(slot_config.get("profile"))
+
+        # строк, полученных последним циклом, — для адаптивного интервала опроса
+        self.last_fetch_rows = 0
+
+        # откуда берутся изменения: слот PostgreSQL или запись потока (replay_path)
+        self.source = source or make_source(self.slot_config, lambda: self._connect(), db_config)
+
+        # метаданные таблиц из pg_catalog: колонки, типы, ключ — без запроса на каждый цикл
+        self.relations = RelationCache(self.source.connect)
 
         print(self.port, self.slot_name, self.plugin)
         
-        if not all([self.dbname, self.user, self.password]):
+        if self.source.live and not all([self.dbname, self.user, self.password]):
             raise ValueError("Параметры dbname, user и password обязательны.")
 
     def _connect(self):
@@ -59,10 +87,7 @@ class LogicalSlot:
         return conn
 
     def slot_exists(self):
-        with self._connect() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT 1 FROM pg_replication_slots WHERE slot_name = %s;", (self.slot_name,))
-                return cur.fetchone() is not None
+        return self.source.exists()
 
     def create_slot(self):
         print("создание началось")
@@ -70,116 +95,258 @@ class LogicalSlot:
             print(f"Слот '{self.slot_name}' уже существует.")
             return
 
-        with self._connect() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT version();")
-                print("Postgres version:", cur.fetchone())
-                cur.execute(
-                    "SELECT * FROM pg_create_logical_replication_slot(%s, %s);",
-                    (self.slot_name, self.plugin)
-                )
-                print(f"Слот '{self.slot_name}' успешно создан с декодером '{self.plugin}'.")
+        self.source.create()
+        print(f"Слот '{self.slot_name}' успешно создан с декодером '{self.plugin}'.")
 
         
-    def fetch_events(self, output_file="events.jsonl", filters: dict = None):
-        with self._connect() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT data FROM pg_logical_slot_get_changes(
-                        %s, NULL, NULL,
-                        'include-timestamp', '1',
-                        'include-xids', '1',
-                        'include-schemas', '1',
-                        'include-types', '1',
-                        'include-transaction', '1'
-                    );
-                """, (self.slot_name,))
-
-                wrote_any = False
-                with open(output_file, "a", encoding="utf-8") as f:
-                    for row in cur:
-                        wrote_any = True
-                        try:
-                            change = json.loads(row[0])
-                            for tx in change.get('change', []):
-                                # --- фильтрация ---
-                                if filters:
-                                    tables = filters.get("tables") or []   
-                                    ops = filters.get("ops") or []         
-                                    ids = filters.get("ids") or []         
-
-                                    # фильтр по таблице
-                                    if tables and tx.get("table") not in tables:
-                                        continue
-                                    # фильтр по операции
-                                    if ops and tx.get("kind").upper() not in [op.upper() for op in ops]:
-                                        continue
-                                    # фильтр по Id (ищем в old_data/new_data)
-                                    if ids:
-                                        old_data = tx.get('oldkeys', {}).get('keyvalues') or {}
-                                        new_data = tx.get('columnvalues') or {}
-                                        # проверяем, встречается ли хотя бы один Id
-                                        if not any(str(id_) in json.dumps(old_data) or str(id_) in json.dumps(new_data) for id_ in ids):
-                                            continue
-
-                                # --- событие ---
-                                event = {
-                                    'timestamp': change.get('timestamp'),
-                                    'xid': change.get('xid'),
-                                    'schema': tx.get('schema'),
-                                    'table': tx.get('table'),
-                                    'operation': tx.get('kind'),
-                                    'old_data': tx.get('oldkeys', {}).get('keyvalues'),
-                                    'new_data': tx.get('columnvalues')
-                                }
-                                f.write(json.dumps(event, ensure_ascii=False) + "\n")
-                        except Exception as e:
-                            print(f"Ошибка при разборе события: {e}")
-                    # если не было ни одной строки — создаём пустую метку
-                    if not wrote_any:
-                        f.write("")  
-
-        # если режим summary — сразу агрегируем
-        if self.analysis_type == "summary":
-            aggregate_jsonl_to_sqlite(
-                jsonl_path="events.jsonl",
-                sqlite_path="wal_analyzer.db",
-                slot_name=self.slot_name,
-                period_hours=self.slot_config['period_hours']
-            )
-            return 1
-        if self.analysis_type == "history":
+    def request_profile(self):
+        """Следующий цикл выборки или отчёта выполнится под cProfile."""
+        self.profile_next = True
+
+    def report_dir(self) -> str:
+        path = self.slot_config.get("disk_path")
+        return path if path and os.path.isdir(path) else os.getcwd()
+
+    def _profiled(self, kind: str, fn, *args):
+        if not self.profile_next:
+            return fn(*args)
+        self.profile_next = False
+        return profile_call(profile_path(self.report_dir(), self.slot_name, kind), fn, *args)
+
+    def fetch_events(self, output_file=SPOOL_FILE, filters: dict = None):
+        return self._profiled("fetch", self._fetch_cycle, output_file, filters)
+
+    def _fetch_cycle(self, output_file: str, filters: dict):
+        """
+        Один цикл выборки: изменения читаются peek-ом без потребления, пишутся в
+        output_file и результаты цикла фиксируются в SQLite вместе с водяным знаком
+        (LSN последнего учтённого изменения); только после этого слот сдвигается
+        pg_replication_slot_advance. После сбоя цикл повторяется с тех же изменений,
+        а уже учтённые (LSN не выше водяного знака) пропускаются.
+        """
+        if self.watermark is None:
+            self.watermark = get_watermark(self.slot_name)
+        watermark = lsn_to_int(self.watermark) if self.watermark else -1
+        last_lsn = None
+
+        # спул событий summary/history не переживает цикл: после сбоя его
+        # содержимое будет прочитано из слота заново
+        mode = "w" if output_file == SPOOL_FILE else "a"
+        # query — декодирование на сервере и передача строк; время разбора,
+        # фильтрации и записи копится по строкам и фиксируется раз за цикл
+        timer = CycleTimer(self.slot_name, "fetch")
+        decode_seconds = filter_seconds = write_seconds = 0.0
+        events = 0
+        counts = CycleCounts()
+
+        with self.source.peek(timer) as changes:
+            wrote_any = False
+            rows = 0
+            with open(output_file, mode, encoding="utf-8") as f:
+                # транзакции в формате wal2json от любого плагина; уже учтённые
+                # (LSN не выше водяного знака) пропускаются без разбора
+                transactions = decode_rows(changes, self.plugin, watermark, self._decode_error)
+                while True:
+                    started = time.perf_counter()
+                    item = next(transactions, None)
+                    decode_seconds += time.perf_counter() - started
+                    if item is None:
+                        break
+                    change, lsn, count = item
+                    if lsn is not None:
+                        last_lsn = lsn
+                    wrote_any = True
+                    rows += count
+                    try:
+                        for tx in change.get('change', []):
+                            # --- фильтрация ---
+                            if filters:
+                                started = time.perf_counter()
+                                passed = self._passes_filters(tx, filters)
+                                filter_seconds += time.perf_counter() - started
+                                if not passed:
+                                    continue
+
+                            # --- событие ---
+                            started = time.perf_counter()
+                            event = {
+                                'timestamp': change.get('timestamp'),
+                                'xid': change.get('xid'),
+                                'schema': tx.get('schema'),
+                                'table': tx.get('table'),
+                                'operation': tx.get('kind'),
+                                'old_data': tx.get('oldkeys', {}).get('keyvalues'),
+                                'new_data': tx.get('columnvalues'),
+                                'columns': tx.get('columnnames'),
+                                'key_columns': tx.get('oldkeys', {}).get('keynames')
+                            }
+                            self.masker.mask_event(event)
+                            event['pk'] = self.relations.key_of(event, tx.get('columntypes'))
+                            started_write = time.perf_counter()
+                            decode_seconds += started_write - started
+                            line = json.dumps(event, ensure_ascii=False)
+                            f.write(line + "\n")
+                            events += 1
+                            counts.add(event['operation'], event['schema'], event['table'],
+                                       event['timestamp'], len(line.encode("utf-8")))
+                            if self.change_index is not None:
+                                self.change_index.add(event)
+                            write_seconds += time.perf_counter() - started_write
+                    except Exception as e:
+                        self._decode_error(e)
+                # если не было ни одной строки — создаём пустую метку
+                if not wrote_any:
+                    f.write("")  
+            self.last_fetch_rows = rows
+        timer.rows = rows
+
+        timer.add("decode", decode_seconds)
+        timer.add("filter", filter_seconds)
+        timer.add("write", write_seconds)
+        self._record_fetch(output_file, rows, events)
+
+        if self.analysis_type == "history" and output_file == SPOOL_FILE:
             try:
-                builder = ReportBuilder(self.slot_config)
-                columns = get_table_columns(self.db_config, self.slot_config["history_table"])
-                result = builder.aggregate_jsonl_to_pdfs(
-                    "events.jsonl",
-                    self.slot_name,
-                    self.slot_config["history_table"],
-                    self.ids,
-                    os.getcwd(),
-                    columns,
-                    self.masks_fields
-                    
-                )
-                return f"reports pdf in {result}"
+                with timer.stage("history"):
+                    targets = parse_history_targets(self.slot_config["history_table"],
+                                                    self.slot_config["history_value"])
+                    relations = {table: self._relation(table) for table in targets}
+                    columns = {table: rel.columns for table, rel in relations.items()}
+                    keys = {table: rel.key_columns for table, rel in relations.items()}
+                    # события уже замаскированы при приёме; строки спулов помечаются LSN цикла —
+                    # после сбоя до коммита повтор цикла не задвоит их в PDF
+                    engine = HistoryEngine(self.slot_name, targets, os.getcwd(), columns, keys=keys,
+                                           cycle_lsn=last_lsn, watermark=watermark)
+                    result = engine.run(SPOOL_FILE)
             except Exception as e:
                 print(f"Ошибка в блоке history: {e}")
-            return "Такие первичные ключи не существуют или др. ошибка ввода"
+                timer.finish()
+                return "Такие первичные ключи не существуют или др. ошибка ввода"
+            self._commit_cycle(last_lsn, timer, spool=True, counts=counts)
+            timer.finish()
+            return f"reports pdf in {result}"
+
+        # если режим summary — агрегаты пишутся в одной транзакции с водяным знаком
+        self._commit_cycle(last_lsn, timer, spool=output_file == SPOOL_FILE, counts=counts)
+        timer.finish()
         return 1
 
+    def _decode_error(self, e):
+        print(f"Ошибка при разборе события: {e}")
+        metrics.ERRORS.inc(slot=self.slot_name, stage="decode")
+
+    @staticmethod
+    def _passes_filters(tx: dict, filters: dict) -> bool:
+        tables = filters.get("tables") or []   
+        ops = filters.get("ops") or []         
+        ids = filters.get("ids") or []         
+
+        # фильтр по таблице
+        if tables and not table_selected(tables, tx.get("schema"), tx.get("table")):
+            return False
+        # фильтр по операции
+        if ops and tx.get("kind").upper() not in [op.upper() for op in ops]:
+            return False
+        # фильтр по Id (ищем в old_data/new_data)
+        if ids:
+            old_data = tx.get('oldkeys', {}).get('keyvalues') or {}
+            new_data = tx.get('columnvalues') or {}
+            # проверяем, встречается ли хотя бы один Id
+            if not any(str(id_) in json.dumps(old_data) or str(id_) in json.dumps(new_data) for id_ in ids):
+                return False
+        return True
+
+    def _record_fetch(self, output_file, rows, events):
+        slot = self.slot_name
+        metrics.FETCH_ROWS.set(rows, slot=slot)
+        metrics.FETCH_ROWS_TOTAL.inc(rows, slot=slot)
+        metrics.EVENTS.inc(events, slot=slot)
+        if os.path.exists(output_file):
+            metrics.SPOOL_BYTES.set(os.path.getsize(output_file), slot=slot)
+
+    def _commit_cycle(self, lsn: str, timer: CycleTimer, spool: bool = False, counts: CycleCounts = None):
+        """
+        Фиксирует цикл одной транзакцией SQLite: агрегаты спула (summary),
+        индекс изменений и водяной знак lsn; затем удаляет спул и сдвигает слот.
+        counts — события цикла для панели мониторинга, попадают в LIVE после фиксации.
+        """
+        agg = None
+        if spool and self.analysis_type == "summary" and os.path.exists(SPOOL_FILE):
+            with timer.stage("aggregate"):
+                init_agg_schema(DB_FILE)
+                agg = aggregate_jsonl_partial(SPOOL_FILE, self.slot_config['period_hours'])
+
+        with timer.stage("sqlite"):
+            self._commit_sqlite(lsn, agg)
+        # события цикла — в память для панели мониторинга; повтор после сбоя их не удвоит
+        if counts is not None:
+            LIVE.add(self.slot_name, counts.agg)
+
+        # события разложены по агрегатам/спулам Id — следующий цикл читает только новые
+        if spool and os.path.exists(SPOOL_FILE):
+            os.remove(SPOOL_FILE)
+        if lsn is not None:
+            self.watermark = lsn
+            with timer.stage("advance"):
+                self.advance_slot(lsn)
+
+    def _commit_sqlite(self, lsn: str, agg: dict):
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            with conn:
+                cur = conn.cursor()
+                if agg is not None:
+                    write_partial_aggregates(cur, self.slot_name, agg)
+                if self.change_index is not None:
+                    self.change_index.flush(cur)
+                if lsn is not None:
+                    set_watermark(cur, self.slot_name, lsn)
+        finally:
+            conn.close()
+
+    def _relation(self, table: str):
+        schema, name = split_table_name(table)
+        if self.source.live:
+            return self.relations.get(schema, name)
+        # у записанного потока нет каталога: колонки берутся из событий, ключ — id
+        return self.relations.observe(schema, name, None)
+
+    def advance_slot(self, lsn: str):
+        """Подтверждает источнику обработку изменений до lsn — PostgreSQL может освободить WAL."""
+        self.source.advance(lsn)
+
+    def get_slot_lag(self):
+        """Отставание источника в байтах: {"retained_bytes", "pending_bytes"} или None."""
+        return self.source.lag()
 
     def drop_slot(self, result: str):
-        drop_current_slot(self.db_config, self.slot_name)
+        self.source.drop()
         clear_sql(result, self.slot_name, self.analysis_type)
+        # PDF истории уже построены — спулы больше не дополняются
+        remove_history_spool(os.getcwd(), self.slot_name)
 
     def get_summary(self):
+        return self._profiled("report", self._build_summary)
+
+    def _build_summary(self):
+        timer = CycleTimer(self.slot_name, "report")
         try:
-            builder = ReportBuilder(self.slot_config)
-            builder.pie_operations()
-            builder.activity_line()
-            builder.heatmap_tables()
-            builder.size_histogram()
+            # ошибки этапов считает timer.stage — здесь wal_errors_total не увеличивается
+            with timer.stage("charts"):
+                builder = ReportBuilder(self.slot_config)
+                builder.pie_operations()
+                builder.activity_line()
+                builder.heatmap_tables()
+                builder.size_histogram()
+
+            # все графики обоих форматов рисуются параллельно, сохранение их только собирает
+            formats = []
+            if self.slot_config.get('summary_pdf'):
+                formats.append("pdf")
+            if self.slot_config.get('summary_html'):
+                formats.append("json")
+            with timer.stage("render"):
+                builder.render_all(formats)
 
             path = self.slot_config.get("disk_path") or os.getcwd()
             result = ""
@@ -187,13 +354,15 @@ class LogicalSlot:
             if self.slot_config.get('summary_pdf'):
                 pdf_name = f"orders_report_{self.slot_config['slot_name']}.pdf"
                 path_pdf = os.path.join(path, pdf_name)
-                builder.save_pdf(path_pdf)
+                with timer.stage("pdf"):
+                    builder.save_pdf(path_pdf)
                 result += path_pdf + ";"
 
             if self.slot_config.get('summary_html'):
                 html_name = f"orders_report_{self.slot_config['slot_name']}.html"
                 path_html = os.path.join(path, html_name)
-                builder.save_html(path_html)
+                with timer.stage("html"):
+                    builder.save_html(path_html)
                 result += path_html + ";"
             
             result = result if result else "Не выбрано расширение для отчета"
@@ -201,6 +370,8 @@ class LogicalSlot:
         except Exception as e:
             print(f"Ошибка в блоке summary: {e}")
             traceback.print_exc()
+        finally:
+            timer.finish()
 
     def fetch_events_full_save(self):
         # фильтры из конфигурации
@@ -237,31 +408,46 @@ class LogicalSlot:
             if result == 1:
                 result = f"files .{ext} in {self.slot_config['disk_path']}"
         else:
-            result = save_wal_changes_to_log(self.db_config, self.slot_name, filters)
+            timer = CycleTimer(self.slot_name, "fetch")
+            counts = CycleCounts()
+            result = save_wal_changes_to_log(self.db_config, self.slot_name, filters, self.masker,
+                                             timer, self.source, self.plugin, on_event=counts.add)
+            LIVE.add(self.slot_name, counts.agg)
+            timer.finish()
         return result 
 
 
     def fetch_test_decoding(self, output_file: str, filters: dict = None):
-        with self._connect() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT data FROM pg_logical_slot_get_changes(%s, NULL, NULL);
-                """, (self.slot_name,))
-
-                with open(output_file, "a", encoding="utf-8") as f:
-                    for row in cur:
-                        line = row[0]
-
-                        # простая фильтрация по таблицам/операциям
-                        if filters:
-                            tables = filters.get("tables") or []   # если пусто → все таблицы
-                            ops = filters.get("ops") or []         # если пусто → все операции
-
-                            if tables and not any(t in line for t in tables):
-                                continue
-                            if ops and not any(op.lower() in line.lower() for op in ops):
-                                continue
-
+        if self.watermark is None:
+            self.watermark = get_watermark(self.slot_name)
+        watermark = lsn_to_int(self.watermark) if self.watermark else -1
+        last_lsn = None
+        events = 0
+        counts = CycleCounts()
+        timer = CycleTimer(self.slot_name, "fetch")
+
+        with self.source.peek(timer) as changes:
+            rows = 0
+            with open(output_file, "a", encoding="utf-8") as f:
+                for transaction, lsn, count in decode_rows(changes, "test_decoding", watermark, self._decode_error):
+                    if lsn is not None:
+                        last_lsn = lsn
+                    rows += count
+                    # фильтр по разобранным schema/table/kind; на диск — исходные строки плагина,
+                    # а при маскировании — строки, собранные из замаскированного изменения
+                    for tx, line in zip(transaction["change"], transaction["lines"]):
+                        if filters and not self._passes_filters(tx, filters):
+                            continue
+                        if self.masker:
+                            line = format_change(self.masker.mask_change(tx))
                         f.write(line + "\n")
-
+                        events += 1
+                        counts.add(tx.get("kind"), tx.get("schema"), tx.get("table"),
+                                   transaction.get("timestamp"), len(line.encode("utf-8")))
+            self.last_fetch_rows = rows
+        timer.rows = rows
+
+        self._record_fetch(output_file, rows, events)
+        self._commit_cycle(last_lsn, timer, counts=counts)
+        timer.finish()
         return 1
\ No newline at end of file
@@ -1,12 +1,23 @@
+import argparse
 from tkinter import Tk
 from frontend import WalAnalyzerApp
 from metabd import init_sqlite
+from metrics import start_http_server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="WAL Analyzer")
+    parser.add_argument("--metrics-port", type=int, help="порт HTTP-эндпоинта /metrics (формат Prometheus)")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="адрес эндпоинта метрик")
+    args = parser.parse_args(argv)
 
-def main():
     init_sqlite()
+    # анализы окна работают в этом процессе — метрики публикуются отсюда же
+    if args.metrics_port:
+        start_http_server(args.metrics_port, args.metrics_host)
+        print(f"Метрики: http://{args.metrics_host}:{args.metrics_port}/metrics")
     root = Tk()
     app = WalAnalyzerApp(root)
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
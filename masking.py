@@ -0,0 +1,110 @@
+import hashlib
+import re
+
+DEFAULT_TRUNCATE = 4
+_RULE_RE = re.compile(r"^(mask|hash|null|truncate)(?:\((\d+)\))?$")
+
+
+def _mask_char(ch: str) -> str:
+    if ch.isupper() or ch.isdigit():
+        return "#"
+    if ch.islower():
+        return "*"
+    return ch
+
+
+# Таблица для str.translate: заглавные буквы и цифры → '#', строчные → '*',
+# остальные символы без изменений. Обычный dict (str.maketrans) по ASCII,
+# латинице с диакритикой и кириллице: подкласс dict с __missing__ переводит
+# translate на медленный поиск по каждому символу
+MASK_TABLE_END = 0x0500
+MASK_TABLE = str.maketrans({chr(cp): _mask_char(chr(cp)) for cp in range(MASK_TABLE_END)})
+# символы вне таблицы translate оставляет как есть — они маскируются отдельным проходом
+_OUTSIDE_TABLE_RE = re.compile(f"[^\\x00-\\u{MASK_TABLE_END - 1:04x}]")
+
+
+def _mask_outside(match) -> str:
+    return _mask_char(match.group())
+
+
+def mask_text(value: str) -> str:
+    return _OUTSIDE_TABLE_RE.sub(_mask_outside, value.translate(MASK_TABLE))
+
+
+def parse_mask_rules(masks_fields) -> dict:
+    """
+    Разбирает настройку маскирования в {колонка: (правило, аргумент)}.
+    Формат — колонки через ';' (или список), у колонки может быть правило:
+    name — посимвольная маска, email:hash, comment:truncate(8), ssn:null.
+    """
+    if not masks_fields:
+        return {}
+    items = masks_fields.split(";") if isinstance(masks_fields, str) else masks_fields
+    rules = {}
+    for item in items:
+        item = item.strip()
+        if not item:
+            continue
+        column, _, rule = item.partition(":")
+        match = _RULE_RE.match(rule.strip() or "mask")
+        if not match:
+            raise ValueError(f"Неизвестное правило маскирования: {item}")
+        arg = int(match.group(2)) if match.group(2) else None
+        rules[column.strip()] = (match.group(1), arg)
+    return rules
+
+
+class Masker:
+    """Маскирование значений по правилам колонок; применяется один раз при приёме событий."""
+
+    def __init__(self, rules: dict):
+        self.rules = rules
+
+    @classmethod
+    def from_config(cls, masks_fields) -> "Masker":
+        return cls(parse_mask_rules(masks_fields))
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def mask_value(self, column: str, value):
+        rule = self.rules.get(column)
+        if rule is None or value is None:
+            return value
+        kind, arg = rule
+        if kind == "mask":
+            return mask_text(value) if isinstance(value, str) else value
+        if kind == "hash":
+            return hashlib.sha256(str(value).encode("utf-8")).hexdigest()[:16]
+        if kind == "truncate":
+            return value[:arg if arg is not None else DEFAULT_TRUNCATE] if isinstance(value, str) else value
+        return None  # null
+
+    def mask_row(self, data: dict) -> dict:
+        if not self.rules or not data:
+            return data
+        return {k: self.mask_value(k, v) if k in self.rules else v for k, v in data.items()}
+
+    def mask_values(self, columns: list, values: list) -> list:
+        """Маскирует позиционные значения (columnvalues/keyvalues wal2json) по именам колонок."""
+        if not self.rules or not values or not columns:
+            return values
+        return [self.mask_value(name, v) if name in self.rules else v
+                for name, v in zip(columns, values)]
+
+    def mask_event(self, event: dict) -> dict:
+        """Маскирует new_data/old_data записи события на месте."""
+        if self.rules:
+            event["new_data"] = self.mask_values(event.get("columns"), event.get("new_data"))
+            event["old_data"] = self.mask_values(event.get("key_columns"), event.get("old_data"))
+        return event
+
+    def mask_change(self, change: dict) -> dict:
+        """Маскирует columnvalues/oldkeys изменения в формате wal2json на месте."""
+        if self.rules:
+            if "columnvalues" in change:
+                change["columnvalues"] = self.mask_values(change.get("columnnames"), change["columnvalues"])
+            old = change.get("oldkeys")
+            if old:
+                old["keyvalues"] = self.mask_values(old.get("keynames"), old.get("keyvalues"))
+        return change
@@ -2,11 +2,23 @@ import sqlite3
 import json
 import psycopg2
 import os
+import time
+from contextlib import nullcontext
 from datetime import datetime, timezone
 from dateutil import parser
 
 DB_FILE = "wal_analyzer.db"
 
+# колонки connections, добавленные после первой версии схемы: (имя, объявление)
+CONNECTIONS_EXTRA_COLUMNS = [
+    ("html_offline", "INTEGER DEFAULT 0"),
+    ("change_index", "INTEGER DEFAULT 0"),
+    ("poll_min_seconds", "INTEGER DEFAULT 1"),
+    ("poll_max_seconds", "INTEGER DEFAULT 60"),
+    ("monitor_limit_mb", "INTEGER DEFAULT 1024"),
+    ("monitor_action", "TEXT DEFAULT 'warn'"),
+]
+
 def check_connection(db_config: dict) -> str:
     try:
         conn = psycopg2.connect(**db_config)
@@ -27,22 +39,6 @@ def check_connection(db_config: dict) -> str:
     except Exception as e:
         return f"Ошибка: {e}"
 
-def get_tables(db_config: dict) -> list[str]:
-    try:
-        conn = psycopg2.connect(**db_config)
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT table_name
-                FROM information_schema.tables
-                WHERE table_schema = 'public'
-                ORDER BY table_name;
-            """)
-            tables = [row[0] for row in cur.fetchall()]
-        conn.close()
-        return tables
-    except Exception as e:
-        return [f"Ошибка: {e}"]
-
 def init_sqlite():
     conn = sqlite3.connect(DB_FILE)
     cur = conn.cursor()
@@ -68,9 +64,22 @@ def init_sqlite():
             save_target TEXT,
             plugin TEXT,
             disk_path TEXT,
-            result TEXT
+            result TEXT,
+            html_offline INTEGER DEFAULT 0,
+            change_index INTEGER DEFAULT 0,
+            poll_min_seconds INTEGER DEFAULT 1,
+            poll_max_seconds INTEGER DEFAULT 60,
+            monitor_limit_mb INTEGER DEFAULT 1024,
+            monitor_action TEXT DEFAULT 'warn'
         )
     """)
+    # миграция баз, созданных до появления новых колонок
+    existing = {row[1] for row in cur.execute("PRAGMA table_info(connections)")}
+    for column, decl in CONNECTIONS_EXTRA_COLUMNS:
+        if column not in existing:
+            cur.execute(f"ALTER TABLE connections ADD COLUMN {column} {decl}")
+    # работающие анализы выбираются по статусу, не просмотром всей истории
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_connections_result ON connections (result);")
     conn.commit()
     conn.close()
 
@@ -86,8 +95,10 @@ def save_connection(db_config: dict, slot_config: dict):
             slot_name, analysis_type,
             summary_pdf, summary_html,
             history_table, history_value, masks_fields,
-            save_target, plugin, disk_path, result
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            save_target, plugin, disk_path, result, html_offline,
+            change_index, poll_min_seconds, poll_max_seconds,
+            monitor_limit_mb, monitor_action
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (
         db_config["dbname"],
         db_config["user"],
@@ -107,7 +118,13 @@ def save_connection(db_config: dict, slot_config: dict):
         slot_config["save_target"],
         slot_config["plugin"],
         slot_config["disk_path"],
-        'active'
+        'active',
+        int(slot_config.get("html_offline", False)),
+        int(slot_config.get("change_index", False)),
+        slot_config.get("poll_min_seconds", 1),
+        slot_config.get("poll_max_seconds", 60),
+        slot_config.get("monitor_limit_mb", 1024),
+        slot_config.get("monitor_action", "warn")
     ))
 
     conn.commit()
@@ -130,26 +147,6 @@ def get_pg_slots(db_config):
     return slots
 
 
-def get_table_columns(db_config, table_name, schema="public"):
-    conn = psycopg2.connect(
-        dbname=db_config["dbname"],
-        user=db_config["user"],
-        password=db_config["password"],
-        host=db_config.get("host", "localhost"),
-        port=db_config.get("port", 5432)
-    )
-    cur = conn.cursor()
-    cur.execute("""
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_schema = %s AND table_name = %s
-            ORDER BY ordinal_position;
-        """, (schema, table_name))
-    columns = [row[0] for row in cur.fetchall()]
-    conn.close()
-    return columns
-
-
 def drop_current_slot(db_config, slot_name):
     # --- Удаляем слот из PostgreSQL ---
     conn_pg = psycopg2.connect(**db_config)
@@ -170,10 +167,10 @@ def clear_sql(result, slot_name, analysis_type: str):
     conn_sqlite = sqlite3.connect("wal_analyzer.db")
     cur_sqlite = conn_sqlite.cursor()
     if analysis_type == "summary":
-        cur_sqlite.execute("DELETE FROM agg_operations WHERE slot_name = ?;", (slot_name,))
-        cur_sqlite.execute("DELETE FROM agg_tables WHERE slot_name = ?;", (slot_name,))
-        cur_sqlite.execute("DELETE FROM agg_activity WHERE slot_name = ?;", (slot_name,))
-        cur_sqlite.execute("DELETE FROM agg_sizes WHERE slot_name = ?;", (slot_name,))
+        delete_slot_aggregates(cur_sqlite, slot_name)
+    # слот удалён — позиция в нём больше не нужна
+    init_watermark_schema(cur_sqlite)
+    cur_sqlite.execute("DELETE FROM slot_watermarks WHERE slot_name = ?;", (slot_name,))
 
     cur_sqlite.execute("""
         UPDATE connections
@@ -185,35 +182,73 @@ def clear_sql(result, slot_name, analysis_type: str):
     conn_sqlite.close()
 
 
-def load_connections_data(db_config):
-    """Возвращает список подключений и анализов из SQLite + статус в Postgres."""
-    try:
-        pg_slots = get_pg_slots(db_config)
-    except Exception as e:
-        pg_slots = set()
-        print("Ошибка подключения к Postgres:", e)
+CONNECTION_COLUMNS = "id, slot_name, analysis_type, created_at, plugin, dbname, result"
+# список результатов в окне показывается страницами
+RESULTS_PAGE_SIZE = 200
+# как долго список слотов PostgreSQL считается свежим
+SLOT_STATUS_TTL = 30
 
-    print(pg_slots)
-    conn = sqlite3.connect("wal_analyzer.db")
-    cur = conn.cursor()
-    cur.execute("SELECT slot_name, analysis_type, created_at, plugin, dbname, result FROM connections")
-    rows = cur.fetchall()
+
+def _connection_rows(where: str = "", params: tuple = (), sqlite_path: str = DB_FILE) -> list:
+    conn = sqlite3.connect(sqlite_path)
+    rows = conn.execute(f"SELECT {CONNECTION_COLUMNS} FROM connections {where}", params).fetchall()
+    conn.close()
+    return [{"id": id_, "slot_name": slot_name, "analysis_type": analysis_type, "date": date,
+             "plugin": plugin, "db": db, "result": result}
+            for id_, slot_name, analysis_type, date, plugin, db, result in rows]
+
+
+def load_active_connections(sqlite_path: str = DB_FILE) -> list:
+    """Анализы со статусом active — свежие сверху; статус в PostgreSQL не проверяется."""
+    return _connection_rows("WHERE result = 'active' ORDER BY id DESC", sqlite_path=sqlite_path)
+
+
+def load_results_page(offset: int = 0, limit: int = RESULTS_PAGE_SIZE, sqlite_path: str = DB_FILE):
+    """Страница завершённых анализов (свежие сверху) и их общее число."""
+    rows = _connection_rows("WHERE result IS NOT 'active' ORDER BY id DESC LIMIT ? OFFSET ?",
+                            (limit, offset), sqlite_path)
+    conn = sqlite3.connect(sqlite_path)
+    total = conn.execute("SELECT COUNT(*) FROM connections WHERE result IS NOT 'active'").fetchone()[0]
     conn.close()
+    return rows, total
+
+
+def mark_deleted_slots(rows: list, pg_slots) -> list:
+    """active → error_deleted для слотов, которых нет в PostgreSQL (pg_slots=None — статус неизвестен)."""
+    if pg_slots is None:
+        return rows
+    return [dict(row, result="error_deleted") if row["result"] == "active" and row["slot_name"] not in pg_slots
+            else row for row in rows]
+
+
+class PgSlotCache:
+    """
+    Имена слотов PostgreSQL на момент последнего refresh. Окно обновляет кэш
+    в фоне не чаще раза в ttl_seconds и показывает статусы по нему — без
+    подключения к PostgreSQL при каждом обновлении списка.
+    """
+
+    def __init__(self, ttl_seconds: float = SLOT_STATUS_TTL):
+        self.ttl_seconds = ttl_seconds
+        self.slots = None
+        self.loaded_at = None
+
+    def stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at >= self.ttl_seconds
 
-    result_rows = []
-    for slot_name, analysis_type, date, plugin, db, result in rows:
-        if slot_name not in pg_slots and result == "active":
-            result = "error_deleted"
-        result_rows.append({
-            "slot_name": slot_name,
-            "analysis_type": analysis_type,
-            "date": date,
-            "plugin": plugin,
-            "db": db,
-            "result": result,
-        })
+    def refresh(self, db_config: dict) -> set:
+        slots = get_pg_slots(db_config)
+        self.slots, self.loaded_at = slots, time.monotonic()
+        return slots
 
-    return result_rows
+    def add(self, slot_name: str):
+        """Слот создан этим окном — до следующего refresh он считается существующим."""
+        if self.slots is not None:
+            self.slots = self.slots | {slot_name}
+
+    def invalidate(self):
+        """Следующее обновление списка перечитает слоты из PostgreSQL."""
+        self.loaded_at = None
 
 
 def init_agg_schema(sqlite_path: str):
@@ -238,6 +273,96 @@ def init_agg_schema(sqlite_path: str):
     conn.commit()
     conn.close()
 
+def init_watermark_schema(cur):
+    # последний LSN слота, изменения до которого уже учтены в SQLite
+    cur.execute("""CREATE TABLE IF NOT EXISTS slot_watermarks (
+        slot_name TEXT PRIMARY KEY, lsn TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );""")
+
+
+# аренда слота: один поток анализа на слот во всех процессах (окно, cli daemon)
+SLOT_LEASE_SECONDS = 300
+
+
+def init_lease_schema(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS slot_leases (
+        slot_name TEXT PRIMARY KEY, owner TEXT, expires_at REAL
+    );""")
+
+
+def acquire_slot_lease(slot_name: str, owner: str, ttl_seconds: float = SLOT_LEASE_SECONDS,
+                       sqlite_path: str = DB_FILE) -> bool:
+    """
+    Берёт или продлевает аренду слота для owner. False — слот читает другой
+    поток анализа (окно или cli), и его аренда ещё не истекла.
+    """
+    now = time.time()
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        with conn:
+            cur = conn.cursor()
+            init_lease_schema(cur)
+            cur.execute("""INSERT INTO slot_leases(slot_name, owner, expires_at) VALUES (?, ?, ?)
+                           ON CONFLICT(slot_name) DO UPDATE SET owner = excluded.owner,
+                                                                expires_at = excluded.expires_at
+                           WHERE slot_leases.owner = excluded.owner OR slot_leases.expires_at < ?;""",
+                        (slot_name, owner, now + ttl_seconds, now))
+            return cur.rowcount == 1
+    finally:
+        conn.close()
+
+
+def release_slot_lease(slot_name: str, owner: str, sqlite_path: str = DB_FILE):
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        with conn:
+            cur = conn.cursor()
+            init_lease_schema(cur)
+            cur.execute("DELETE FROM slot_leases WHERE slot_name = ? AND owner = ?;", (slot_name, owner))
+    finally:
+        conn.close()
+
+
+def slot_leased(slot_name: str, sqlite_path: str = DB_FILE) -> bool:
+    """Читает ли слот сейчас какой-либо поток анализа."""
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        cur = conn.cursor()
+        init_lease_schema(cur)
+        row = cur.execute("SELECT 1 FROM slot_leases WHERE slot_name = ? AND expires_at >= ?;",
+                          (slot_name, time.time())).fetchone()
+        return row is not None
+    finally:
+        conn.close()
+
+
+def lsn_to_int(lsn: str) -> int:
+    """'16/B374D848' → 64-битная позиция WAL для сравнения LSN."""
+    high, _, low = lsn.partition("/")
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+def get_watermark(slot_name: str, sqlite_path: str = DB_FILE):
+    conn = sqlite3.connect(sqlite_path)
+    cur = conn.cursor()
+    init_watermark_schema(cur)
+    row = cur.execute("SELECT lsn FROM slot_watermarks WHERE slot_name = ?;", (slot_name,)).fetchone()
+    conn.commit()
+    conn.close()
+    return row[0] if row else None
+
+
+def set_watermark(cur, slot_name: str, lsn: str):
+    """Коммит за вызывающим: водяной знак пишется в одной транзакции с результатами цикла."""
+    init_watermark_schema(cur)
+    cur.execute("""INSERT INTO slot_watermarks(slot_name, lsn, updated_at)
+                   VALUES (?, ?, CURRENT_TIMESTAMP)
+                   ON CONFLICT(slot_name) DO UPDATE SET lsn = excluded.lsn,
+                                                        updated_at = excluded.updated_at;""",
+                (slot_name, lsn))
+
+
 def floor_to_period_start(ts_epoch: int, period_seconds: int) -> int:
     # Стабильное окно: «срез» вниз до кратного period_seconds относительно эпохи
     return ts_epoch - (ts_epoch % period_seconds)
@@ -250,44 +375,58 @@ def pick_size_bucket(event_json_len: int) -> str:
     else:
         return "large"
 
-def aggregate_jsonl_to_sqlite(
-    jsonl_path: str,
-    sqlite_path: str,
-    slot_name: str,
-    period_hours: int
-):
-    period_seconds = period_hours
+def count_event(agg: dict, operation: str, schema: str, table: str, bucket_key, size: int):
+    """Прибавляет одно событие к частичным агрегатам agg (на месте); bucket_key=None — без активности."""
+    if operation:
+        operation = operation.upper()
+        agg["operations"][operation] = agg["operations"].get(operation, 0) + 1
+    if schema and table:
+        agg["tables"][(schema, table)] = agg["tables"].get((schema, table), 0) + 1
+    if bucket_key is not None:
+        agg["activity"][bucket_key] = agg["activity"].get(bucket_key, 0) + 1
+    size_bucket = pick_size_bucket(size)
+    agg["sizes"][size_bucket] = agg["sizes"].get(size_bucket, 0) + 1
+
+def table_selected(tables, schema: str, table: str) -> bool:
+    """
+    Входит ли таблица в фильтр tables: имя без схемы совпадает с таблицей
+    любой схемы (как раньше), 'схема.таблица' — только с таблицей этой схемы.
+    """
+    return table in tables or f"{schema}.{table}" in tables
 
-    if not os.path.exists(jsonl_path):
-        print(f"Файл {jsonl_path} не найден, пропускаем.")
-        return
 
-    init_agg_schema(sqlite_path)
+def new_partial_aggregates() -> dict:
+    """Пустой набор частичных агрегатов — те же четыре разреза, что и таблицы agg_*."""
+    return {"operations": {}, "tables": {}, "activity": {}, "sizes": {}}
 
-    conn = sqlite3.connect(sqlite_path)
-    cur = conn.cursor()
 
-    # Подготовленные выражения для UPSERT (SQLite ≥ 3.24.0)
-    upsert_ops = """INSERT INTO agg_operations(slot_name, operation, count)
-                    VALUES (?, ?, 1)
-                    ON CONFLICT(slot_name, operation)
-                    DO UPDATE SET count = count + 1;"""
-    upsert_tables = """INSERT INTO agg_tables(slot_name, schema, table_name, count)
-                       VALUES (?, ?, ?, 1)
-                       ON CONFLICT(slot_name, schema, table_name)
-                       DO UPDATE SET count = count + 1;"""
-    upsert_activity = """INSERT INTO agg_activity(slot_name, bucket_start, bucket_end, count)
-                         VALUES (?, ?, ?, 1)
-                         ON CONFLICT(slot_name, bucket_start, bucket_end)
-                         DO UPDATE SET count = count + 1;"""
-    upsert_sizes = """INSERT INTO agg_sizes(slot_name, size_bucket, count)
-                      VALUES (?, ?, 1)
-                      ON CONFLICT(slot_name, size_bucket)
-                      DO UPDATE SET count = count + 1;"""
+def merge_partial_aggregates(target: dict, part: dict) -> dict:
+    """Складывает частичные агрегаты part в target (на месте) и возвращает target."""
+    for section, counts in part.items():
+        dst = target.setdefault(section, {})
+        for key, count in counts.items():
+            dst[key] = dst.get(key, 0) + count
+    return target
+
+
+def aggregate_jsonl_partial(
+    jsonl_path: str,
+    period_seconds: int,
+    bucket_width: int = None,
+    align_to_epoch: bool = False
+) -> dict:
+    """
+    Строит частичные агрегаты по одному JSONL-файлу в памяти, ничего не пишет в SQLite.
+    bucket_width=None — ширина корзины как в живом анализе (period_seconds // 1000).
+    align_to_epoch=True — корзины выравниваются по эпохе, а не по первой строке файла,
+    чтобы агрегаты разных файлов можно было складывать между собой.
+    """
+    agg = new_partial_aggregates()
 
     # Для стабильности окон: вычислим period_start на основе первой строки
     period_start_epoch = None
-    bucket_width = max(1, period_seconds // 1000)
+    if bucket_width is None:
+        bucket_width = max(1, period_seconds // 1000)
 
     with open(jsonl_path, "r", encoding="utf-8") as f:
         for line in f:
@@ -305,11 +444,8 @@ def aggregate_jsonl_to_sqlite(
             operation = event.get("operation")
             schema = event.get("schema")
             table = event.get("table")
-            timestamp = event.get("timestamp")  # ожидаем ISO8601 от wal2json
-            old_data = event.get("old_data")
-            new_data = event.get("new_data")
 
-            # Парсим время → epoch seconds
+            # Парсим время → epoch seconds (ожидаем ISO8601 от wal2json)
             timestamp = event.get("timestamp")
             try:
                 dt = parser.parse(timestamp)
@@ -318,28 +454,74 @@ def aggregate_jsonl_to_sqlite(
                 print("Ошибка парсинга времени:", timestamp, e)
                 continue
 
-            # Инициализация начала периода
-            if period_start_epoch is None:
-                period_start_epoch = floor_to_period_start(ts_epoch, period_seconds)
-
             # Корзина активности
-            i = (ts_epoch - period_start_epoch) // bucket_width
-            bucket_start = period_start_epoch + i * bucket_width
-            bucket_end = bucket_start + bucket_width
-
-            # Размер события
-            event_json_len = len(line.encode("utf-8"))
-            size_bucket = pick_size_bucket(event_json_len)
-
-            # Инкрементальные апдейты
-            if operation:
-                operation = operation.upper()
-                cur.execute(upsert_ops, (slot_name, operation))
-            if schema and table:
-                cur.execute(upsert_tables, (slot_name, schema, table))
-            cur.execute(upsert_activity, (slot_name, bucket_start, bucket_end))
-            cur.execute(upsert_sizes, (slot_name, size_bucket))
+            if align_to_epoch:
+                bucket_start = floor_to_period_start(ts_epoch, bucket_width)
+            else:
+                # Инициализация начала периода
+                if period_start_epoch is None:
+                    period_start_epoch = floor_to_period_start(ts_epoch, period_seconds)
+                i = (ts_epoch - period_start_epoch) // bucket_width
+                bucket_start = period_start_epoch + i * bucket_width
+            bucket_key = (bucket_start, bucket_start + bucket_width)
+
+            # Размер события — по длине строки JSONL
+            count_event(agg, operation, schema, table, bucket_key, len(line.encode("utf-8")))
+
+    return agg
+
+
+def write_partial_aggregates(cur, slot_name: str, agg: dict):
+    """
+    Пакетно прибавляет частичные агрегаты к таблицам agg_* (SQLite ≥ 3.24.0).
+    Коммит остаётся за вызывающим — так несколько файлов ложатся в одну транзакцию.
+    """
+    cur.executemany("""INSERT INTO agg_operations(slot_name, operation, count)
+                       VALUES (?, ?, ?)
+                       ON CONFLICT(slot_name, operation)
+                       DO UPDATE SET count = count + excluded.count;""",
+                    [(slot_name, op, n) for op, n in agg["operations"].items()])
+    cur.executemany("""INSERT INTO agg_tables(slot_name, schema, table_name, count)
+                       VALUES (?, ?, ?, ?)
+                       ON CONFLICT(slot_name, schema, table_name)
+                       DO UPDATE SET count = count + excluded.count;""",
+                    [(slot_name, schema, table, n) for (schema, table), n in agg["tables"].items()])
+    cur.executemany("""INSERT INTO agg_activity(slot_name, bucket_start, bucket_end, count)
+                       VALUES (?, ?, ?, ?)
+                       ON CONFLICT(slot_name, bucket_start, bucket_end)
+                       DO UPDATE SET count = count + excluded.count;""",
+                    [(slot_name, start, end, n) for (start, end), n in agg["activity"].items()])
+    cur.executemany("""INSERT INTO agg_sizes(slot_name, size_bucket, count)
+                       VALUES (?, ?, ?)
+                       ON CONFLICT(slot_name, size_bucket)
+                       DO UPDATE SET count = count + excluded.count;""",
+                    [(slot_name, bucket, n) for bucket, n in agg["sizes"].items()])
 
+
+def delete_slot_aggregates(cur, slot_name: str):
+    for table in ("agg_operations", "agg_tables", "agg_activity", "agg_sizes"):
+        cur.execute(f"DELETE FROM {table} WHERE slot_name = ?;", (slot_name,))
+
+
+def aggregate_jsonl_to_sqlite(
+    jsonl_path: str,
+    sqlite_path: str,
+    slot_name: str,
+    period_hours: int
+):
+    period_seconds = period_hours
+
+    if not os.path.exists(jsonl_path):
+        print(f"Файл {jsonl_path} не найден, пропускаем.")
+        return
+
+    init_agg_schema(sqlite_path)
+
+    agg = aggregate_jsonl_partial(jsonl_path, period_seconds)
+
+    conn = sqlite3.connect(sqlite_path)
+    cur = conn.cursor()
+    write_partial_aggregates(cur, slot_name, agg)
     conn.commit()
     conn.close()
 
@@ -350,11 +532,20 @@ def aggregate_jsonl_to_sqlite(
         print(f"Не удалось удалить {jsonl_path}: {e}")
 
 
-def save_wal_changes_to_log(db_config, slot_name, filters=None):
+def save_wal_changes_to_log(db_config, slot_name, filters=None, masker=None, timer=None, source=None,
+                            plugin="wal2json", on_event=None):
     """
     Получает изменения из логического слота (wal2json) и пишет их в таблицу data_change_log.
     filters = {"tables": [...], "ops": ["INSERT","UPDATE","DELETE"]}
+    masker — masking.Masker, применяется к old_data/new_data до записи.
+    timer — stagetimer.CycleTimer, этапы query/write/commit/advance.
+    source — источник изменений (changesource) вместо слота slot_name, например запись потока.
+    on_event(operation, schema, table, timestamp, size) вызывается для каждой записанной строки.
+    Строки и LSN последнего записанного изменения фиксируются одной транзакцией
+    PostgreSQL (data_change_log_watermarks); после сбоя до сдвига слота уже
+    записанные изменения пропускаются — каждое попадает в лог ровно один раз.
     """
+    stage = timer.stage if timer is not None else (lambda name: nullcontext())
 
     conn = psycopg2.connect(
         dbname=db_config["dbname"],
@@ -378,31 +569,70 @@ def save_wal_changes_to_log(db_config, slot_name, filters=None):
             schema_name TEXT
         );
     """)
-    conn.commit()
-
-    # получаем изменения из слота
     cur.execute("""
-        SELECT data
-        FROM pg_logical_slot_get_changes(
-            %s, NULL, NULL,
-            'format-version', '1',
-            'include-timestamp', '1',
-            'include-xids', '1',
-            'include-schemas', '1',
-            'include-types', '1',
-            'include-transaction', '1'
+        CREATE TABLE IF NOT EXISTS data_change_log_watermarks (
+            slot_name TEXT PRIMARY KEY,
+            lsn PG_LSN NOT NULL,
+            updated_at TIMESTAMPTZ DEFAULT now()
         );
-    """, (slot_name,))
+    """)
+    conn.commit()
+    cur.execute("SELECT lsn::text FROM data_change_log_watermarks WHERE slot_name = %s;", (slot_name,))
+    row = cur.fetchone()
+    watermark = lsn_to_int(row[0]) if row else -1
+
+    # читаем изменения без потребления: слот сдвигается только после коммита записи
+    if source is not None:
+        with source.peek(timer) as changes:
+            rows = list(changes)
+    else:
+        with stage("query"):
+            cur.execute("""
+                SELECT data, lsn
+                FROM pg_logical_slot_peek_changes(
+                    %s, NULL, NULL,
+                    'format-version', '1',
+                    'include-timestamp', '1',
+                    'include-xids', '1',
+                    'include-schemas', '1',
+                    'include-types', '1',
+                    'include-transaction', '1'
+                );
+            """, (slot_name,))
+            rows = cur.fetchall()
+
+    last_lsn = max((row[1] for row in rows), key=lsn_to_int, default=None)
+    if timer is not None:
+        timer.rows = len(rows)
+    with stage("write"):
+        _write_change_log(cur, rows, filters, masker, plugin, watermark, on_event)
+        if last_lsn is not None and lsn_to_int(last_lsn) > watermark:
+            cur.execute("""
+                INSERT INTO data_change_log_watermarks (slot_name, lsn, updated_at)
+                VALUES (%s, %s::pg_lsn, now())
+                ON CONFLICT (slot_name) DO UPDATE SET lsn = excluded.lsn, updated_at = excluded.updated_at;
+            """, (slot_name, last_lsn))
+
+    with stage("commit"):
+        conn.commit()
+    if last_lsn is not None:
+        with stage("advance"):
+            if source is not None:
+                source.advance(last_lsn)
+            else:
+                cur.execute("SELECT pg_replication_slot_advance(%s, %s::pg_lsn);", (slot_name, last_lsn))
+                conn.commit()
+    cur.close()
+    conn.close()
+    return "Изменения записаны в data_change_log"
 
-    rows = cur.fetchall()
-    print(rows)
-    for row in rows:
-        print(row)
-        try:
-            ev = json.loads(row[0])
-        except Exception:
-            continue
 
+def _write_change_log(cur, rows, filters, masker, plugin="wal2json", watermark: int = -1, on_event=None):
+    # decoding импортирует metabd — импорт здесь, а не в начале модуля
+    from decoding import decode_rows
+
+    # транзакции не новее watermark уже в логе (сбой между коммитом и сдвигом слота)
+    for ev, _, _ in decode_rows(rows, plugin, watermark, on_error=lambda e: print("Ошибка разбора:", e)):
         xid = ev.get("xid")
         ts = ev.get("timestamp")
 
@@ -413,7 +643,7 @@ def save_wal_changes_to_log(db_config, slot_name, filters=None):
 
             # фильтрация
             if filters:
-                if filters.get("tables") and table not in filters["tables"]:
+                if filters.get("tables") and not table_selected(filters["tables"], schema, table):
                     continue
                 if filters.get("ops") and op.upper() not in filters["ops"]:
                     continue
@@ -433,20 +663,23 @@ def save_wal_changes_to_log(db_config, slot_name, filters=None):
             else:
                 continue
 
+            if masker:
+                old_data = masker.mask_row(old_data)
+                new_data = masker.mask_row(new_data)
+
+            old_json = json.dumps(old_data) if old_data else None
+            new_json = json.dumps(new_data) if new_data else None
             cur.execute("""
                 INSERT INTO data_change_log (table_name, operation, old_data, new_data, xid, ts, schema_name)
                 VALUES (%s, %s, %s::jsonb, %s::jsonb, %s, %s::timestamptz, %s);
             """, (
                 table,
                 op.upper(),
-                json.dumps(old_data) if old_data else None,
-                json.dumps(new_data) if new_data else None,
+                old_json,
+                new_json,
                 xid,
                 ts,
                 schema
             ))
-
-    conn.commit()
-    cur.close()
-    conn.close()
-    return "Изменения записаны в data_change_log"
\ No newline at end of file
+            if on_event is not None:
+                on_event(op, schema, table, ts, len(old_json or "") + len(new_json or ""))
\ No newline at end of file
@@ -0,0 +1,99 @@
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from metabd import (
+    DB_FILE,
+    init_agg_schema,
+    new_partial_aggregates,
+    merge_partial_aggregates,
+    aggregate_jsonl_partial,
+    write_partial_aggregates,
+    delete_slot_aggregates,
+)
+
+
+def expand_archive_paths(patterns: list) -> list:
+    """Раскрывает каталоги и glob-шаблоны в отсортированный список JSONL-файлов."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(glob.glob(os.path.join(pattern, "*.jsonl")))
+        else:
+            paths.extend(glob.glob(pattern))
+    return sorted(set(paths))
+
+
+def reaggregate_archives(
+    paths: list,
+    slot_name: str,
+    period_hours: int,
+    sqlite_path: str = DB_FILE,
+    bucket_seconds: int = None,
+    workers: int = None
+) -> dict:
+    """
+    Пересобирает агрегаты agg_* слота по архивным JSONL-файлам.
+    Каждый файл агрегируется отдельным процессом, частичные результаты
+    складываются в памяти и заменяют агрегаты слота одной транзакцией.
+    Архивные файлы не удаляются.
+    """
+    bucket_width = bucket_seconds or max(1, period_hours // 1000)
+    # корзины выравниваются по эпохе — иначе агрегаты разных файлов не сложить
+    worker_fn = partial(aggregate_jsonl_partial, period_seconds=period_hours,
+                        bucket_width=bucket_width, align_to_epoch=True)
+
+    total = new_partial_aggregates()
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) <= 1:
+        for path in paths:
+            merge_partial_aggregates(total, worker_fn(path))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            for part in pool.map(worker_fn, paths):
+                merge_partial_aggregates(total, part)
+
+    init_agg_schema(sqlite_path)
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        with conn:
+            cur = conn.cursor()
+            delete_slot_aggregates(cur, slot_name)
+            write_partial_aggregates(cur, slot_name, total)
+    finally:
+        conn.close()
+    return total
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description="Пересборка агрегатов сводки по архивным JSONL-файлам"
+    )
+    arg_parser.add_argument("paths", nargs="+", help="файлы, каталоги или glob-шаблоны *.jsonl")
+    arg_parser.add_argument("--slot", required=True, help="имя слота, под которым сохранить агрегаты")
+    arg_parser.add_argument("--period", type=int, required=True, help="период анализа, секунд")
+    arg_parser.add_argument("--bucket", type=int, default=None, help="ширина корзины активности, секунд")
+    arg_parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию — число ядер)")
+    arg_parser.add_argument("--db", default=DB_FILE, help="путь к SQLite")
+    args = arg_parser.parse_args(argv)
+
+    paths = expand_archive_paths(args.paths)
+    if not paths:
+        print("Файлы для пересборки не найдены")
+        return 1
+
+    start = time.time()
+    total = reaggregate_archives(paths, args.slot, args.period, args.db,
+                                 bucket_seconds=args.bucket, workers=args.workers)
+    events = sum(total["sizes"].values())
+    print(f"Пересобрано {events} событий из {len(paths)} файлов за {time.time() - start:.1f} с")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
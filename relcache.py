@@ -0,0 +1,137 @@
+from collections import namedtuple
+from itertools import zip_longest
+
+from changeindex import make_pk
+
+# columns/types — в порядке attnum; key_columns — ключ в порядке колонок индекса
+Relation = namedtuple("Relation", ["columns", "types", "key_columns"])
+
+# ключ таблицы: индекс REPLICA IDENTITY, если задан, иначе первичный ключ
+RELATION_QUERY = """
+    SELECT a.attname,
+           format_type(a.atttypid, a.atttypmod),
+           array_position(k.indkey::int2[], a.attnum)
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    LEFT JOIN LATERAL (
+        SELECT i.indkey FROM pg_index i
+        WHERE i.indrelid = c.oid AND (i.indisreplident OR i.indisprimary)
+        ORDER BY i.indisreplident DESC
+        LIMIT 1
+    ) k ON true
+    WHERE n.nspname = %s AND c.relname = %s
+    ORDER BY a.attnum;
+"""
+
+
+def split_table_name(name: str, default_schema: str = "public"):
+    """'schema.table' → (schema, table); имя без схемы относится к default_schema."""
+    schema, sep, table = name.rpartition(".")
+    return (schema, table) if sep else (default_schema, name)
+
+
+class RelationCache:
+    """
+    Метаданные таблиц из pg_catalog (колонки, типы, ключ) с кэшем на время жизни слота.
+    Каталог читается один раз на таблицу; запись сбрасывается, когда событие
+    приносит неизвестную колонку или другой тип известной (ALTER TABLE).
+    connect — функция, возвращающая соединение psycopg2 (LogicalSlot._connect).
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.relations = {}
+        self.queries = 0
+
+    def _load(self, schema: str, table: str) -> Relation:
+        self.queries += 1
+        with self.connect() as conn:
+            with conn.cursor() as cur:
+                cur.execute(RELATION_QUERY, (schema, table))
+                rows = cur.fetchall()
+        if not rows:
+            raise LookupError(f"Таблица {schema}.{table} не найдена")
+        key = sorted((pos, name) for name, _, pos in rows if pos is not None)
+        return Relation([r[0] for r in rows], [r[1] for r in rows], [name for _, name in key])
+
+    def get(self, schema: str, table: str) -> Relation:
+        """Метаданные таблицы; ошибки каталога (нет таблицы, нет соединения) пробрасываются."""
+        relation = self.relations.get((schema, table))
+        if relation is None:
+            relation = self.relations[(schema, table)] = self._load(schema, table)
+        return relation
+
+    def invalidate(self, schema: str = None, table: str = None):
+        if table is None:
+            self.relations.clear()
+        else:
+            self.relations.pop((schema, table), None)
+
+    @staticmethod
+    def _matches(relation: Relation, columns: list, types: list = None) -> bool:
+        """
+        Событие согласуется с записью, если все его колонки известны и их типы
+        не изменились. Подмножество колонок — норма: wal2json и test_decoding
+        не присылают неизменённые TOAST-колонки в UPDATE.
+        """
+        known = dict(zip_longest(relation.columns, relation.types))
+        for name, type_name in zip_longest(columns or [], types or []):
+            if name not in known:
+                return False
+            if type_name and known[name] and known[name] != type_name:
+                return False
+        return True
+
+    def observe(self, schema: str, table: str, columns: list, types: list = None) -> Relation:
+        """
+        Метаданные для события декодера. Если в событии есть неизвестная колонка
+        или у известной изменился тип, запись перечитывается из каталога.
+        При недоступном каталоге таблица запоминается по данным события, без ключа.
+        """
+        relation = self.relations.get((schema, table))
+        if relation is not None and self._matches(relation, columns, types):
+            return relation
+        self.invalidate(schema, table)
+
+        try:
+            relation = self._load(schema, table)
+        except Exception as e:
+            print(f"Нет метаданных {schema}.{table} в каталоге: {e}")
+            relation = Relation(list(columns or []), list(types or []), [])
+        if not self._matches(relation, columns, types):
+            # описание из события точнее: каталог мог уже измениться ещё раз,
+            # а запись типов у декодера может отличаться от format_type.
+            # Колонки каталога остаются — событие может нести лишь их часть
+            event_types = dict(zip(columns or [], types or []))
+            known = dict(zip_longest(relation.columns, relation.types))
+            names = list(relation.columns) + [c for c in columns or [] if c not in known]
+            relation = Relation(names, [event_types.get(n) or known.get(n) for n in names],
+                                relation.key_columns)
+        self.relations[(schema, table)] = relation
+        return relation
+
+    def key_of(self, event: dict, types: list = None):
+        """
+        Строковый ключ события (см. changeindex.make_pk) или None.
+        UPDATE/DELETE берут ключ из oldkeys, INSERT — из columnvalues по ключу каталога.
+        types — columntypes wal2json, в само событие они не попадают.
+        """
+        relation = self.observe(event.get("schema") or "public", event.get("table"),
+                                event.get("columns"), types)
+        names = relation.key_columns
+        key_columns = event.get("key_columns") or []
+        old_values = event.get("old_data") or []
+        if key_columns and old_values:
+            old_row = dict(zip(key_columns, old_values))
+            # REPLICA IDENTITY FULL присылает в oldkeys всю строку — берём только ключ
+            if names and all(name in old_row for name in names):
+                return make_pk(old_row[name] for name in names)
+            return make_pk(old_values)
+
+        if not names:
+            return None
+        row = dict(zip(event.get("columns") or [], event.get("new_data") or []))
+        if not all(name in row for name in names):
+            return None
+        return make_pk(row[name] for name in names)
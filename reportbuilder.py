@@ -1,17 +1,12 @@
 import sqlite3
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import plotly.express as px
-import plotly.io as pio
-from matplotlib.backends.backend_pdf import PdfPages
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+import io
 import json
 import os
-import matplotlib.dates as mdates
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from reportcache import RenderCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
+from downsample import downsample_series
 
 def get_arial_font_path():
     system = os.name
@@ -39,241 +34,399 @@ def get_arial_font_path():
     
     return font_path
 
-# Регистрация шрифта
-try:
-    font_path = get_arial_font_path()
-    pdfmetrics.registerFont(TTFont("Arial", font_path))
-except Exception as e:
-    print(f"Не удалось зарегистрировать Arial: {e}")
+# matplotlib, plotly и reportlab загружаются только при
+# первом построении отчёта: импорт модуля не должен тянуть стек графиков
+_fonts_registered = False
+
+
+def register_fonts():
+    """Регистрирует Arial в reportlab (один раз, при первом PDF с историей)."""
+    global _fonts_registered
+    if _fonts_registered:
+        return
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    _fonts_registered = True
+    try:
+        font_path = get_arial_font_path()
+        pdfmetrics.registerFont(TTFont("Arial", font_path))
+    except Exception as e:
+        print(f"Не удалось зарегистрировать Arial: {e}")
+
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use("Agg")  # отчёты рисуются без окна, в т.ч. из рабочих потоков
+    import matplotlib.pyplot as plt
+    return plt
+
+# Версия отрисовки входит в ключ кэша: при изменении оформления графиков
+# её нужно увеличить, чтобы не отдавать старые картинки
+RENDER_VERSION = "5"
+EMPTY_REPORT_TEXT = "Изменений, соответствующих фильтрам, не было"
+EMPTY_CHART_HASH = RenderCache.make_key("empty")
+ACTIVITY_MAX_POINTS = 1000  # по умолчанию ряд активности прореживается до стольких точек
+MARKERS_MAX_POINTS = 200    # на длинных рядах маркеры только мешают
+
+
+PDF_DOCUMENT = "document"  # PDF кэшируется целиком: страницы matplotlib остаются векторными
+
+
+def _figures_to_pdf(pages) -> bytes:
+    from matplotlib.backends.backend_pdf import PdfPages
+    plt = _pyplot()
+    buf = io.BytesIO()
+    with PdfPages(buf) as pdf:
+        for kind, data in pages:
+            fig = _MPL_RENDERERS[kind](data)
+            pdf.savefig(fig)
+            plt.close(fig)
+    return buf.getvalue()
+
+
+def _mpl_pie(data):
+    plt = _pyplot()
+    fig, ax = plt.subplots()
+    ax.pie(data["counts"], labels=data["operations"], autopct='%1.1f%%', startangle=90)
+    ax.set_title("Операции")
+    return fig
+
+
+def _plotly_pie(data):
+    import numpy as np
+    import plotly.graph_objects as go
+    fig = go.Figure(go.Pie(labels=data["operations"], values=np.asarray(data["counts"])))
+    fig.update_layout(title_text='Операции')
+    return fig
+
+
+def _activity_series(data):
+    """Переводит начала корзин (epoch) в московское время."""
+    from dateutil import tz
+    moscow = tz.gettz('Europe/Moscow')
+    times = [datetime.fromtimestamp(ts, tz=moscow) for ts in data["bucket_starts"]]
+    counts = list(data["counts"])
+
+    if len(times) == 1:
+        # добавим вторую точку с нулевым значением чуть раньше
+        times.insert(0, times[0] - timedelta(minutes=1))
+        counts.insert(0, 0)
+    return times, counts
+
+
+def _mpl_activity(data):
+    plt = _pyplot()
+    import matplotlib.dates as mdates
+    times, counts = _activity_series(data)
+    fig, ax = plt.subplots(figsize=(10, 5))
+    ax.plot(times, counts, marker='o' if len(times) <= MARKERS_MAX_POINTS else None)
+    ax.set_title("Активность по времени")
+    ax.set_xlabel("Время")
+    ax.set_ylabel("События")
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.xaxis.set_major_locator(mdates.AutoDateLocator(minticks=3, maxticks=6, tz=times[0].tzinfo))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m %H:%M', tz=times[0].tzinfo))
+    return fig
+
+
+def _plotly_activity(data):
+    import numpy as np
+    import plotly.graph_objects as go
+    times, counts = _activity_series(data)
+    # московское время как мс эпохи: ось дат plotly показывает его без сдвига,
+    # а числовой массив сериализуется компактно (base64), в отличие от строк дат
+    xs = [(t.timestamp() + t.utcoffset().total_seconds()) * 1000 for t in times]
+    mode = 'lines+markers' if len(xs) <= MARKERS_MAX_POINTS else 'lines'
+    fig_plotly = go.Figure(go.Scatter(x=np.asarray(xs, dtype="f8"), y=np.asarray(counts), mode=mode))
+    fig_plotly.update_layout(
+        title_text='Активность по времени',
+        xaxis=dict(
+            type="date",
+            tickformat="%d.%m %H:%M",
+            tickangle=45,
+            nticks=6
+        )
+    )
+    return fig_plotly
+
+
+def _mpl_heatmap(data):
+    plt = _pyplot()
+    matrix = data["matrix"]
+    fig, ax = plt.subplots(figsize=(8, 6))
+    image = ax.imshow(matrix, cmap="YlGnBu", aspect="auto")
+    fig.colorbar(image, ax=ax)
+    ax.set_xticks(range(len(data["tables"])), labels=data["tables"], rotation=90)
+    ax.set_yticks(range(len(data["schemas"])), labels=data["schemas"])
+    ax.set_xlabel("table_name")
+    ax.set_ylabel("schema")
+    for i, row in enumerate(matrix):
+        for j, value in enumerate(row):
+            ax.text(j, i, f"{value:.0f}", ha="center", va="center",
+                    color="white" if image.norm(value) > 0.5 else "black")
+    ax.set_title("Тепловая карта по таблицам")
+    return fig
+
+
+def _plotly_heatmap(data):
+    import numpy as np
+    import plotly.graph_objects as go
+    fig = go.Figure(go.Heatmap(z=np.asarray(data["matrix"]), x=data["tables"], y=data["schemas"],
+                               colorscale="YlGnBu", texttemplate="%{z}"))
+    fig.update_layout(title_text="Тепловая карта по таблицам")
+    return fig
+
+
+def _mpl_sizes(data):
+    plt = _pyplot()
+    fig, ax = plt.subplots()
+    ax.bar(data["size_buckets"], data["counts"], color='skyblue')
+    ax.set_title("Размеры событий")
+    ax.set_xlabel("Размер")
+    ax.set_ylabel("Количество")
+    return fig
+
+
+def _plotly_sizes(data):
+    import numpy as np
+    import plotly.graph_objects as go
+    fig = go.Figure(go.Bar(x=data["size_buckets"], y=np.asarray(data["counts"])))
+    fig.update_layout(title_text='Размеры событий')
+    return fig
+
+
+def _mpl_empty(_):
+    plt = _pyplot()
+    fig, ax = plt.subplots()
+    ax.text(0.5, 0.5, EMPTY_REPORT_TEXT, ha='center', va='center', fontsize=12)
+    ax.axis("off")
+    ax.set_title("Отчёт")
+    return fig
+
+
+_MPL_RENDERERS = {
+    "pie": _mpl_pie,
+    "activity": _mpl_activity,
+    "heatmap": _mpl_heatmap,
+    "sizes": _mpl_sizes,
+    "empty": _mpl_empty,
+}
+
+_PLOTLY_RENDERERS = {
+    "pie": _plotly_pie,
+    "activity": _plotly_activity,
+    "heatmap": _plotly_heatmap,
+    "sizes": _plotly_sizes,
+}
+
+
+def render_chart(kind: str, fmt: str, data) -> bytes:
+    """
+    Отрисовывает один график: fmt="json" — компактная фигура plotly
+    (без шаблона оформления) для HTML. fmt="pdf" — весь PDF-отчёт сразу:
+    kind=PDF_DOCUMENT, data — список страниц (kind, data) для matplotlib.
+    """
+    if fmt == "pdf":
+        return _figures_to_pdf(data)
+    if fmt == "json":
+        import plotly.io as pio
+        fig = json.loads(pio.to_json(_PLOTLY_RENDERERS[kind](data), validate=False, remove_uids=True))
+        # шаблон одинаков у всех фигур — в отчёт он попадает один раз
+        fig["layout"].pop("template", None)
+        return json.dumps(fig, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    raise ValueError(f"Неизвестный формат графика: {fmt}")
+
+
+def _render_job(job) -> bytes:
+    # точка входа задачи в пуле процессов
+    return render_chart(*job)
+
 
 class ReportBuilder:
     def __init__(self, slot_config: dict, db_path="wal_analyzer.db"):
         self.conn = sqlite3.connect(db_path)
         self.slot_name = slot_config['slot_name']
-        self.plots = []         # matplotlib figures
-        self.plotly_figs = []   # plotly figures
+        self.charts = []        # (kind, data, data_hash) — рисуются при сохранении
+        self.artifacts = {}     # (data_hash, fmt) -> PDF-документ / HTML-фрагмент
+        self.render_workers = slot_config.get("render_workers") or os.cpu_count() or 1
+        self.html_offline = bool(slot_config.get("html_offline"))
+        # прореживание ряда активности перед отрисовкой (0 — не прореживать)
+        self.activity_max_points = slot_config.get("activity_max_points", ACTIVITY_MAX_POINTS)
+        self.activity_downsample = slot_config.get("activity_downsample") or "lttb"
+
+        self.cache = None
+        if slot_config.get("report_cache", True):
+            cache_dir = slot_config.get("report_cache_dir") or os.path.join(
+                os.path.dirname(os.path.abspath(db_path)), DEFAULT_CACHE_DIR)
+            self.cache = RenderCache(cache_dir, slot_config.get("report_cache_max_bytes") or DEFAULT_MAX_BYTES)
+
+    def _add_chart(self, kind: str, data: dict):
+        data_hash = RenderCache.make_key(kind, json.dumps(data, sort_keys=True))
+        self.charts.append((kind, data, data_hash))
+
+    def _charts_for(self, fmt: str) -> list:
+        if fmt != "pdf":
+            return self.charts
+        # PDF — один документ из всех страниц; пустой отчёт — страница с сообщением
+        pages = self.charts or [("empty", None, EMPTY_CHART_HASH)]
+        doc_hash = RenderCache.make_key(*(data_hash for _, _, data_hash in pages))
+        return [(PDF_DOCUMENT, [(kind, data) for kind, data, _ in pages], doc_hash)]
+
+    def render_all(self, formats=("pdf", "json")):
+        """
+        Готовит графики в нужных форматах. Найденное в кэше берётся оттуда,
+        остальное рисуется независимыми задачами в пуле процессов.
+        """
+        jobs = []
+        for fmt in formats:
+            for kind, data, data_hash in self._charts_for(fmt):
+                if (data_hash, fmt) in self.artifacts:
+                    continue
+                cache_key = RenderCache.make_key(RENDER_VERSION, fmt, data_hash)
+                artifact = self.cache.get(cache_key, fmt) if self.cache else None
+                if artifact is not None:
+                    self.artifacts[(data_hash, fmt)] = artifact
+                else:
+                    jobs.append((kind, fmt, data, data_hash, cache_key))
+
+        if len(jobs) > 1 and self.render_workers > 1:
+            # spawn, а не fork: в процессе работают потоки Tk и анализа
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=min(len(jobs), self.render_workers), mp_context=ctx) as pool:
+                results = list(pool.map(_render_job, [(kind, fmt, data) for kind, fmt, data, _, _ in jobs]))
+        else:
+            results = [render_chart(kind, fmt, data) for kind, fmt, data, _, _ in jobs]
+
+        for (kind, fmt, data, data_hash, cache_key), artifact in zip(jobs, results):
+            self.artifacts[(data_hash, fmt)] = artifact
+            if self.cache:
+                self.cache.put(cache_key, fmt, artifact)
+
+    def _columns(self, query: str, params: tuple):
+        """Выполняет запрос и возвращает столбцы результата кортежами (пусто — None)."""
+        rows = self.conn.execute(query, params).fetchall()
+        if not rows:
+            return None
+        return tuple(zip(*rows))
 
     def pie_operations(self):
-        df = pd.read_sql_query("""
+        columns = self._columns("""
             SELECT operation, count FROM agg_operations
             WHERE slot_name = ?
-        """, self.conn, params=(self.slot_name,))
-        if df.empty:
+            ORDER BY operation
+        """, (self.slot_name,))
+        if columns is None:
             return
-        fig, ax = plt.subplots()
-        ax.pie(df['count'], labels=df['operation'], autopct='%1.1f%%', startangle=90)
-        ax.set_title("Операции")
-        self.plots.append(fig)
-
-        fig_plotly = px.pie(df, names='operation', values='count', title='Операции')
-        self.plotly_figs.append(fig_plotly)
+        operations, counts = columns
+        self._add_chart("pie", {"operations": operations, "counts": counts})
 
     def activity_line(self):
-        df = pd.read_sql_query("""
+        columns = self._columns("""
             SELECT bucket_start, count FROM agg_activity
             WHERE slot_name = ?
             ORDER BY bucket_start
-        """, self.conn, params=(self.slot_name,))
-        print(df.shape)
-        if df.empty:
+        """, (self.slot_name,))
+        if columns is None:
             # ничего не добавляем, просто выходим
             return
-
-        df['time'] = pd.to_datetime(df['bucket_start'], unit='s', utc=True)
-        df['time'] = df['time'].dt.tz_convert('Europe/Moscow')
-
-        if len(df) == 1:
-            # добавим вторую точку с нулевым значением чуть раньше
-            earlier = df['time'].iloc[0] - pd.Timedelta(minutes=1)
-            df = pd.concat([pd.DataFrame({'time': [earlier], 'count': [0]}), df])
-
-        # Matplotlib версия (для PDF)
-        fig, ax = plt.subplots(figsize=(10, 5))
-        ax.plot(df['time'], df['count'], marker='o')
-        ax.set_title("Активность по времени")
-        ax.set_xlabel("Время")
-        ax.set_ylabel("События")
-        ax.tick_params(axis='x', labelrotation=45)
-        ax.xaxis.set_major_locator(mdates.AutoDateLocator(minticks=3, maxticks=6))
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m %H:%M'))
-        self.plots.append(fig)
-
-        # Plotly версия (для HTML)
-        fig_plotly = px.line(
-            df, x='time', y='count',
-            title='Активность по времени',
-            markers=True
-        )
-        fig_plotly.update_layout(
-            xaxis=dict(
-                tickformat="%d.%m %H:%M",
-                tickangle=45,
-                nticks=6
-            )
-        )
-        self.plotly_figs.append(fig_plotly)
+        bucket_starts, counts = downsample_series(columns[0], columns[1],
+                                                  self.activity_max_points, self.activity_downsample)
+        self._add_chart("activity", {"bucket_starts": bucket_starts, "counts": counts})
 
     def heatmap_tables(self):
-        df = pd.read_sql_query("""
-            SELECT schema, table_name, count FROM agg_tables
-            WHERE slot_name = ?
-        """, self.conn, params=(self.slot_name,))
-        if df.empty:
+        # сводная таблица schema × table_name строится в SQL: полная сетка с нулями
+        columns = self._columns("""
+            SELECT s.schema, t.table_name, COALESCE(a.count, 0)
+            FROM (SELECT DISTINCT schema FROM agg_tables WHERE slot_name = ?) AS s
+            CROSS JOIN (SELECT DISTINCT table_name FROM agg_tables WHERE slot_name = ?) AS t
+            LEFT JOIN agg_tables AS a
+                ON a.slot_name = ? AND a.schema = s.schema AND a.table_name = t.table_name
+            ORDER BY s.schema, t.table_name
+        """, (self.slot_name, self.slot_name, self.slot_name))
+        if columns is None:
             # ничего не добавляем, просто выходим
             return
-        pivot = df.pivot(index='schema', columns='table_name', values='count').fillna(0)
-        fig, ax = plt.subplots(figsize=(8, 6))
-        sns.heatmap(pivot, annot=True, fmt=".0f", cmap="YlGnBu", ax=ax)
-        ax.set_title("Тепловая карта по таблицам")
-        self.plots.append(fig)
-
-        fig_plotly = px.imshow(pivot, text_auto=True, aspect="auto", title="Тепловая карта по таблицам")
-        self.plotly_figs.append(fig_plotly)
+        schema_col, table_col, counts = columns
+        schemas = sorted(set(schema_col))
+        tables = sorted(set(table_col))
+        width = len(tables)
+        matrix = [list(counts[i * width:(i + 1) * width]) for i in range(len(schemas))]
+        self._add_chart("heatmap", {"schemas": schemas, "tables": tables, "matrix": matrix})
 
     def size_histogram(self):
-        df = pd.read_sql_query("""
+        columns = self._columns("""
             SELECT size_bucket, count FROM agg_sizes
             WHERE slot_name = ?
-        """, self.conn, params=(self.slot_name,))
-        if df.empty:
+            ORDER BY size_bucket
+        """, (self.slot_name,))
+        if columns is None:
             # ничего не добавляем, просто выходим
             return
-        fig, ax = plt.subplots()
-        ax.bar(df['size_bucket'], df['count'], color='skyblue')
-        ax.set_title("Размеры событий")
-        ax.set_xlabel("Размер")
-        ax.set_ylabel("Количество")
-        self.plots.append(fig)
-
-        fig_plotly = px.bar(df, x='size_bucket', y='count', title='Размеры событий')
-        self.plotly_figs.append(fig_plotly)
+        size_buckets, counts = columns
+        self._add_chart("sizes", {"size_buckets": size_buckets, "counts": counts})
 
     def save_pdf(self, filename="report.pdf"):
-        with PdfPages(filename) as pdf:
-            if not self.plots:  # если нет ни одной фигуры
-                fig, ax = plt.subplots()
-                ax.text(0.5, 0.5, "Изменений, соответствующих фильтрам, не было",
-                        ha='center', va='center', fontsize=12)
-                ax.axis("off")
-                ax.set_title("Отчёт")
-                pdf.savefig(fig)
-                plt.close(fig)
-            else:
-                for fig in self.plots:
-                    pdf.savefig(fig)
-                    plt.close(fig)
+        self.render_all(("pdf",))
+        (_, _, doc_hash), = self._charts_for("pdf")
+        with open(filename, "wb") as f:
+            f.write(self.artifacts[(doc_hash, "pdf")])
 
 
     def save_html(self, filename="report.html"):
+        """
+        Собирает HTML-отчёт: plotly.js и шаблон оформления встраиваются один раз,
+        фигуры — компактным JSON. При html_offline plotly.js кладётся в сам файл,
+        и отчёт открывается без доступа в интернет.
+        """
+        import plotly.io as pio
+        from plotly.offline import get_plotlyjs, get_plotlyjs_version
+        self.render_all(("json",))
+
+        if self.html_offline:
+            plotly_js = f"<script>{get_plotlyjs()}</script>"
+        else:
+            plotly_js = (f"<script charset='utf-8' "
+                         f"src='https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js'></script>")
+
         html_parts = []
-        if not self.plotly_figs:  # если нет ни одной фигуры
+        if not self.charts:  # если нет ни одной фигуры
             html_parts.append("<div style='text-align:center; font-size:16px;'>"
-                            "Изменений, соответствующих фильтрам, не было</div>")
+                            f"{EMPTY_REPORT_TEXT}</div>")
         else:
-            for fig in self.plotly_figs:
-                html_parts.append(pio.to_html(fig, full_html=False, include_plotlyjs='cdn'))
-
-        html_str = ("<html><head><meta charset='utf-8'></head><body>"
+            template = json.loads(pio.to_json(pio.templates[pio.templates.default], validate=False, remove_uids=False))
+            figures = [self.artifacts[(data_hash, "json")].decode("utf-8") for _, _, data_hash in self.charts]
+            html_parts.extend(f"<div id='chart-{i}'></div>" for i in range(len(figures)))
+            # "</" внутри JSON закрыл бы тег script раньше времени
+            script = ("const TEMPLATE = " + json.dumps(template, separators=(",", ":")) + ";\n"
+                      "const FIGURES = [" + ",\n".join(figures) + "];\n"
+                      "FIGURES.forEach(function (fig, i) {\n"
+                      "  fig.layout.template = TEMPLATE;\n"
+                      "  Plotly.newPlot('chart-' + i, fig.data, fig.layout, {responsive: true});\n"
+                      "});").replace("</", "<\\/")
+            html_parts.append(f"<script>{script}</script>")
+
+        html_str = ("<html><head><meta charset='utf-8'>" + plotly_js + "</head><body>"
                     + "\n".join(html_parts) +
                     "</body></html>")
         with open(filename, "w", encoding="utf-8") as f:
             f.write(html_str)
 
 
-    def mask_fields(self, data: dict, masks_fields: list) -> dict:
+    @staticmethod
+    def mask_fields(data: dict, masks_fields: list) -> dict:
         """
-        Маскирует значения словаря по правилам:
+        Маскирует значения словаря по правилам (см. masking.Masker):
         - Заглавные буквы и цифры → '#'
         - Строчные буквы → '*'
         - Знаки и служебные символы остаются как есть
         """
-        def mask_value(val: str) -> str:
-            if not isinstance(val, str):
-                return val
-            masked = []
-            for ch in val:
-                if ch.isupper() or ch.isdigit():
-                    masked.append('#')
-                elif ch.islower():
-                    masked.append('*')
-                else:
-                    masked.append(ch)
-            return "".join(masked)
-
-        return {
-            k: mask_value(v) if k in masks_fields else v
-            for k, v in data.items()
-        }
+        from masking import Masker
+        return Masker.from_config(masks_fields).mask_row(data)
 
     def aggregate_jsonl_to_pdfs(self, jsonl_path: str, slot_name: str, table: str,
                             ids: list, output_dir: str, columns: list, masks_fields: list):
-        # создаём canvas для каждого Id
-        canvases = {}
-        positions = {}
-
-        for id_value in ids:
-            filename = f"{slot_name}_{table}_{id_value}.pdf"
-            filepath = os.path.join(output_dir, filename)
-
-            c = canvas.Canvas(filepath, pagesize=A4)
-            c.setFont("Arial", 12)  # стандартный шрифт, точно работает
-            width, height = A4
-            y = height - 50
-
-            if os.path.exists(filepath):
-                c.drawString(50, y, f"Дополнение к истории Id={id_value}, slot={slot_name}")
-                y -= 30
-            else:
-                c.drawString(50, y, f"История изменений Id={id_value}, slot={slot_name}")
-                y -= 30
-
-            canvases[id_value] = (c, width, height)
-            positions[id_value] = y
-
-        # читаем JSONL построчно один раз
-        with open(jsonl_path, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    ev = json.loads(line)
-                except Exception:
-                    continue
-
-                if ev.get("table") != table:
-                    continue
-
-                old_data_list = ev.get("old_data") or []
-                new_data_list = ev.get("new_data") or []
-                # превращаем списки в словари
-                old_data = dict(zip(columns, old_data_list)) if old_data_list else {}
-                new_data = dict(zip(columns, new_data_list)) if new_data_list else {}
-
-                # маскируем
-                old_data = self.mask_fields(old_data, masks_fields)
-                new_data = self.mask_fields(new_data, masks_fields)
-                print(new_data)               
-                # проверяем, есть ли id в данных
-                for id_value in ids:
-                    old_id = old_data.get("id")
-                    new_id = new_data.get("id")
-                    
-
-                    match = (str(id_value) == str(old_id)) or (str(id_value) == str(new_id))
-                    print(match)
-                    if match:
-                        c, width, height = canvases[id_value]
-                        y = positions[id_value]
-
-                        line_text = f"{old_data} -> {new_data}"
-                        c.drawString(50, y, line_text)
-                        y -= 20
-                        if y < 50:
-                            c.showPage()
-                            y = height - 50
-
-                        positions[id_value] = y
-
-                        # сохраняем все PDF
-        for id_value, (c, _, _) in canvases.items():
-            c.save()
-
-        return [os.path.join(output_dir, f"{slot_name}_{table}_{id_value}.pdf") for id_value in ids]
+        from history import HistoryEngine
+        from masking import Masker
+        engine = HistoryEngine(slot_name, {table: ids}, output_dir, {table: columns},
+                               Masker.from_config(masks_fields))
+        return engine.run(jsonl_path)
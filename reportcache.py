@@ -0,0 +1,79 @@
+import hashlib
+import os
+
+DEFAULT_CACHE_DIR = "report_cache"
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024  # 100 МБ
+
+
+class RenderCache:
+    """
+    Дисковый кэш отрисованных графиков (векторный PDF целиком, HTML-фрагменты для HTML).
+    Ключ — хэш данных агрегата, поэтому неизменившийся график (или PDF) не перерисовывается.
+    При превышении max_bytes удаляются давно не использованные файлы.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        h = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode("utf-8")
+            h.update(part)
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{fmt}")
+
+    def get(self, key: str, fmt: str):
+        path = self._path(key, fmt)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        # отмечаем использование — по mtime работает вытеснение
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, fmt: str, data: bytes):
+        path = self._path(key, fmt)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        if total <= self.max_bytes:
+            return
+        # сначала удаляем самые давно использованные
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes:
+                break
@@ -0,0 +1,59 @@
+import threading
+
+DEFAULT_POLL_MIN_SECONDS = 1
+DEFAULT_POLL_MAX_SECONDS = 60
+# несчитанный WAL слота, при котором опрос идёт с минимальным интервалом
+LAG_HIGH_BYTES = 16 * 1024 * 1024
+BACKOFF = 2.0
+
+
+class AdaptiveInterval:
+    """
+    Интервал опроса слота в пределах [min_seconds, max_seconds].
+    Большое отставание слота — сразу минимальный интервал; были изменения —
+    интервал уменьшается в backoff раз; пустой цикл — увеличивается в backoff раз.
+    Малое ненулевое отставание без строк бывает и в простое (WAL других баз,
+    служебные записи), поэтому само по себе интервал не сокращает.
+    """
+
+    def __init__(self, min_seconds: float = DEFAULT_POLL_MIN_SECONDS,
+                 max_seconds: float = DEFAULT_POLL_MAX_SECONDS,
+                 lag_high_bytes: int = LAG_HIGH_BYTES, backoff: float = BACKOFF):
+        self.min_seconds = min_seconds
+        self.max_seconds = max(max_seconds, min_seconds)
+        self.lag_high_bytes = lag_high_bytes
+        self.backoff = backoff
+        self.interval = self.min_seconds
+        # запросы монитора слотов (slotmonitor): ускорить выборку или остановить поток
+        self.draining = False
+        self.stopped = False
+        self.wake = threading.Event()
+
+    @classmethod
+    def from_config(cls, slot_config: dict) -> "AdaptiveInterval":
+        return cls(slot_config.get("poll_min_seconds") or DEFAULT_POLL_MIN_SECONDS,
+                   slot_config.get("poll_max_seconds") or DEFAULT_POLL_MAX_SECONDS)
+
+    def update(self, rows: int, lag_bytes: int = None) -> float:
+        """Следующий интервал по числу строк последнего цикла и отставанию слота в байтах."""
+        if self.draining or (lag_bytes is not None and lag_bytes >= self.lag_high_bytes):
+            self.draining = False
+            self.interval = self.min_seconds
+        elif rows:
+            self.interval = max(self.min_seconds, self.interval / self.backoff)
+        else:
+            self.interval = min(self.max_seconds, self.interval * self.backoff)
+        return self.interval
+
+    def request_drain(self):
+        self.draining = True
+        self.wake.set()
+
+    def request_stop(self):
+        self.stopped = True
+        self.wake.set()
+
+    def wait(self, timeout: float):
+        """Пауза до следующего опроса; запрос монитора прерывает её досрочно."""
+        self.wake.wait(max(0, timeout))
+        self.wake.clear()
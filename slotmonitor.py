@@ -0,0 +1,246 @@
+import sqlite3
+import threading
+import time
+
+import psycopg2
+
+from metabd import DB_FILE, drop_current_slot
+from metrics import record_slot_lag
+
+MONITOR_INTERVAL_SECONDS = 30
+DEFAULT_LIMIT_MB = 1024
+# предупреждение выдаётся заранее — при этой доле порога
+WARN_FRACTION = 0.5
+# действия при превышении порога удерживаемого WAL
+SLOT_ACTIONS = ("warn", "drain", "drop")
+
+# замеры хранятся неделю; старые удаляются не чаще раза в час
+SLOT_METRICS_RETENTION_SECONDS = 7 * 24 * 3600
+PRUNE_INTERVAL_SECONDS = 3600
+
+# все логические слоты базы — в том числе оставшиеся без потока анализа после
+# сбоя или перезапуска: именно они незаметно удерживают WAL
+SLOT_METRICS_QUERY = """
+    SELECT slot_name, active,
+           pg_wal_lsn_diff(pg_current_wal_lsn(), restart_lsn),
+           pg_wal_lsn_diff(pg_current_wal_lsn(), confirmed_flush_lsn)
+    FROM pg_replication_slots
+    WHERE slot_type = 'logical' AND database = current_database();
+"""
+
+
+def db_key(db_config: dict) -> tuple:
+    return tuple(str(db_config.get(k)) for k in ("host", "port", "dbname"))
+
+
+def _settings(limit_mb, action, poller=None) -> dict:
+    return {"limit_bytes": (limit_mb or DEFAULT_LIMIT_MB) * 1024 * 1024,
+            "action": action if action in SLOT_ACTIONS else "warn", "poller": poller}
+
+
+def _active_connections(sqlite_path: str) -> list:
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        return conn.execute("""SELECT slot_name, dbname, user, password, host, port,
+                                      monitor_limit_mb, monitor_action
+                               FROM connections WHERE result = 'active'""").fetchall()
+    except sqlite3.OperationalError:
+        # connections ещё не создана — анализов нет
+        return []
+    finally:
+        conn.close()
+
+
+def analysis_slot_settings(db_config: dict, sqlite_path: str = DB_FILE) -> dict:
+    """Пороги активных анализов базы из connections: {slot_name: настройки} — и для слотов без потока."""
+    key = db_key(db_config)
+    return {slot_name: _settings(limit_mb, action)
+            for slot_name, dbname, _, _, host, port, limit_mb, action in _active_connections(sqlite_path)
+            if db_key({"host": host, "port": port, "dbname": dbname}) == key}
+
+
+def init_slot_metrics(sqlite_path: str = DB_FILE):
+    conn = sqlite3.connect(sqlite_path)
+    cur = conn.cursor()
+    cur.execute("""CREATE TABLE IF NOT EXISTS slot_metrics (
+        slot_name TEXT, ts INTEGER, retained_bytes INTEGER, pending_bytes INTEGER,
+        active INTEGER, action TEXT
+    );""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_slot_metrics_slot
+                   ON slot_metrics (slot_name, ts);""")
+    conn.commit()
+    conn.close()
+
+
+def get_slot_metrics(slot_name: str, since: int = None, sqlite_path: str = DB_FILE) -> list:
+    """Замеры слота в хронологическом порядке (since — epoch-секунды)."""
+    init_slot_metrics(sqlite_path)
+    query = """SELECT ts, retained_bytes, pending_bytes, active, action
+               FROM slot_metrics WHERE slot_name = ?"""
+    params = [slot_name]
+    if since is not None:
+        query += " AND ts >= ?"
+        params.append(since)
+    conn = sqlite3.connect(sqlite_path)
+    rows = conn.execute(query + " ORDER BY ts", params).fetchall()
+    conn.close()
+    return [{"ts": ts, "retained_bytes": retained, "pending_bytes": pending,
+             "active": bool(active), "action": action}
+            for ts, retained, pending, active, action in rows]
+
+
+def get_latest_slot_metrics(sqlite_path: str = DB_FILE, slot_names=None) -> dict:
+    """Последний замер каждого слота (или только slot_names): {slot_name: {...}}."""
+    init_slot_metrics(sqlite_path)
+    where, params = "", ()
+    if slot_names is not None:
+        slot_names = list(slot_names)
+        if not slot_names:
+            return {}
+        where = f"WHERE slot_name IN ({', '.join('?' for _ in slot_names)})"
+        params = tuple(slot_names)
+    conn = sqlite3.connect(sqlite_path)
+    rows = conn.execute(f"""
+        SELECT m.slot_name, m.ts, m.retained_bytes, m.pending_bytes, m.active, m.action
+        FROM slot_metrics m
+        JOIN (SELECT slot_name, MAX(ts) AS ts FROM slot_metrics {where} GROUP BY slot_name) last
+          ON last.slot_name = m.slot_name AND last.ts = m.ts
+    """, params).fetchall()
+    conn.close()
+    return {slot_name: {"ts": ts, "retained_bytes": retained, "pending_bytes": pending,
+                        "active": bool(active), "action": action}
+            for slot_name, ts, retained, pending, active, action in rows}
+
+
+class SlotMonitor(threading.Thread):
+    """
+    Фоновый контроль слотов анализа одной базы: раз в interval_seconds одним
+    запросом снимает удерживаемый WAL и отставание всех зарегистрированных слотов,
+    пишет замеры в slot_metrics и при превышении порога выполняет действие слота:
+    warn — предупреждение, drain — опрос без пауз до снижения отставания,
+    drop — удаление слота и остановка его потока анализа.
+    """
+
+    def __init__(self, db_config: dict, interval_seconds: float = MONITOR_INTERVAL_SECONDS,
+                 sqlite_path: str = DB_FILE):
+        super().__init__(daemon=True, name="slot-monitor")
+        self.db_config = db_config
+        self.interval_seconds = interval_seconds
+        self.sqlite_path = sqlite_path
+        self.slots = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.pruned_at = 0
+        init_slot_metrics(sqlite_path)
+
+    def register(self, slot_name: str, limit_mb: int = DEFAULT_LIMIT_MB,
+                 action: str = "warn", poller=None):
+        """poller — AdaptiveInterval потока анализа слота, через него действуют drain и drop."""
+        if action not in SLOT_ACTIONS:
+            raise ValueError(f"Неизвестное действие монитора: {action}")
+        with self.lock:
+            self.slots[slot_name] = _settings(limit_mb, action, poller)
+
+    def unregister(self, slot_name: str):
+        with self.lock:
+            self.slots.pop(slot_name, None)
+
+    def _query(self) -> list:
+        conn = psycopg2.connect(**self.db_config)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(SLOT_METRICS_QUERY)
+                return cur.fetchall()
+        finally:
+            conn.close()
+
+    def _act(self, slot_name: str, settings: dict, retained: int) -> str:
+        limit = settings["limit_bytes"]
+        if retained < limit * WARN_FRACTION:
+            return None
+        if retained < limit or settings["action"] == "warn":
+            print(f"Слот {slot_name} удерживает {retained // (1024 * 1024)} МБ WAL "
+                  f"(порог {limit // (1024 * 1024)} МБ)")
+            return "warn"
+
+        poller = settings["poller"]
+        if settings["action"] == "drain":
+            if poller is not None:
+                poller.request_drain()
+            return "drain"
+
+        print(f"Слот {slot_name} превысил порог удерживаемого WAL и будет удалён")
+        if poller is not None:
+            poller.request_stop()
+        drop_current_slot(self.db_config, slot_name)
+        self.unregister(slot_name)
+        return "drop"
+
+    def sample(self) -> list:
+        """
+        Один замер всех логических слотов базы; возвращает записанные строки.
+        Настройки — у потока анализа (register), иначе у активного анализа из
+        connections; чужие слоты только отслеживаются с предупреждением.
+        """
+        with self.lock:
+            slots = dict(self.slots)
+        known = analysis_slot_settings(self.db_config, self.sqlite_path)
+
+        now = int(time.time())
+        records = []
+        for slot_name, active, retained, pending in self._query():
+            retained, pending = int(retained or 0), int(pending or 0)
+            record_slot_lag(slot_name, {"retained_bytes": retained, "pending_bytes": pending})
+            settings = slots.get(slot_name) or known.get(slot_name) or _settings(DEFAULT_LIMIT_MB, "warn")
+            action = self._act(slot_name, settings, retained)
+            records.append((slot_name, now, retained, pending, int(bool(active)), action))
+
+        conn = sqlite3.connect(self.sqlite_path)
+        try:
+            with conn:
+                conn.executemany("""INSERT INTO slot_metrics
+                    (slot_name, ts, retained_bytes, pending_bytes, active, action)
+                    VALUES (?, ?, ?, ?, ?, ?);""", records)
+                if now - self.pruned_at >= PRUNE_INTERVAL_SECONDS:
+                    conn.execute("DELETE FROM slot_metrics WHERE ts < ?;", (now - SLOT_METRICS_RETENTION_SECONDS,))
+                    self.pruned_at = now
+        finally:
+            conn.close()
+        return records
+
+    def run(self):
+        while not self.stop_event.wait(self.interval_seconds):
+            try:
+                self.sample()
+            except Exception as e:
+                print("Ошибка монитора слотов:", e)
+
+    def stop(self):
+        self.stop_event.set()
+
+
+_monitors = {}
+_monitors_lock = threading.Lock()
+
+
+def get_monitor(db_config: dict) -> SlotMonitor:
+    """Общий запущенный монитор для базы (один поток на host/port/dbname)."""
+    key = db_key(db_config)
+    with _monitors_lock:
+        monitor = _monitors.get(key)
+        if monitor is None or not monitor.is_alive():
+            monitor = _monitors[key] = SlotMonitor(db_config)
+            monitor.start()
+        return monitor
+
+
+def start_monitors(sqlite_path: str = DB_FILE) -> list:
+    """
+    Мониторы всех баз, где есть активные анализы, — независимо от того, работает
+    ли их поток в этом процессе: слот, оставшийся после сбоя, тоже под контролем.
+    """
+    configs = {}
+    for _, dbname, user, password, host, port, _, _ in _active_connections(sqlite_path):
+        db_config = {"dbname": dbname, "user": user, "password": password, "host": host, "port": port}
+        configs.setdefault(db_key(db_config), db_config)
+    return [get_monitor(db_config) for db_config in configs.values()]
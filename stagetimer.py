@@ -0,0 +1,122 @@
+import cProfile
+import os
+import pstats
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import metrics
+from metabd import DB_FILE
+
+PROFILE_TOP = 40
+# длительности этапов хранятся неделю
+CYCLE_TIMINGS_RETENTION_SECONDS = 7 * 24 * 3600
+
+
+def init_cycle_timings(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS cycle_timings (
+        slot_name TEXT, started_at REAL, kind TEXT, stage TEXT, seconds REAL
+    );""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_cycle_timings_slot
+                   ON cycle_timings (slot_name, started_at);""")
+
+
+class CycleTimer:
+    """
+    Именованные этапы одного цикла (kind — "fetch" или "report"). Длительности
+    этапов суммируются, при finish() весь цикл записывается этапом с именем kind,
+    этапы уходят в гистограмму wal_stage_seconds и в таблицу cycle_timings.
+    Цикл выборки без строк (rows = 0) в таблицу не пишется: при опросе раз в
+    секунду пустые циклы простоя заполнили бы её.
+    """
+
+    def __init__(self, slot_name: str, kind: str):
+        self.slot_name = slot_name
+        self.kind = kind
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.stages = {}
+        # строк слота, полученных циклом; None — не выборка (отчёт)
+        self.rows = None
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            metrics.ERRORS.inc(slot=self.slot_name, stage=name)
+            raise
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def finish(self, sqlite_path: str = DB_FILE) -> dict:
+        self.stages[self.kind] = time.perf_counter() - self._start
+        for stage, seconds in self.stages.items():
+            metrics.STAGE_SECONDS.observe(seconds, slot=self.slot_name, stage=stage)
+        if self.rows == 0:
+            return self.stages
+        try:
+            conn = sqlite3.connect(sqlite_path)
+            try:
+                with conn:
+                    cur = conn.cursor()
+                    init_cycle_timings(cur)
+                    cur.executemany("""INSERT INTO cycle_timings (slot_name, started_at, kind, stage, seconds)
+                                       VALUES (?, ?, ?, ?, ?);""",
+                                    [(self.slot_name, self.started_at, self.kind, stage, seconds)
+                                     for stage, seconds in self.stages.items()])
+                    # старые циклы слота удаляются по индексу (slot_name, started_at)
+                    cur.execute("DELETE FROM cycle_timings WHERE slot_name = ? AND started_at < ?;",
+                                (self.slot_name, self.started_at - CYCLE_TIMINGS_RETENTION_SECONDS))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Не удалось сохранить длительности этапов: {e}")
+        return self.stages
+
+
+def get_cycle_timings(slot_name: str, limit: int = 20, sqlite_path: str = DB_FILE) -> list:
+    """Последние limit циклов слота, новые первыми: [{"started_at", "kind", "stages": {...}}]."""
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        cur = conn.cursor()
+        init_cycle_timings(cur)
+        rows = cur.execute("""
+            SELECT started_at, kind, stage, seconds FROM cycle_timings
+            WHERE slot_name = ? AND started_at IN (
+                SELECT DISTINCT started_at FROM cycle_timings WHERE slot_name = ?
+                ORDER BY started_at DESC LIMIT ?)
+            ORDER BY started_at DESC
+        """, (slot_name, slot_name, limit)).fetchall()
+    finally:
+        conn.close()
+
+    cycles = {}
+    for started_at, kind, stage, seconds in rows:
+        cycle = cycles.setdefault((started_at, kind), {"started_at": started_at, "kind": kind, "stages": {}})
+        cycle["stages"][stage] = seconds
+    return list(cycles.values())
+
+
+def profile_call(path_base: str, fn, *args, **kwargs):
+    """
+    Выполняет fn под cProfile и сохраняет path_base.prof (для snakeviz/pstats)
+    и path_base.txt — топ функций по суммарному времени.
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(fn, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path_base + ".prof")
+        with open(path_base + ".txt", "w", encoding="utf-8") as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        print(f"Профиль цикла сохранён: {path_base}.prof")
+
+
+def profile_path(directory: str, slot_name: str, kind: str) -> str:
+    return os.path.join(directory, f"profile_{slot_name}_{kind}_{datetime.now():%Y%m%d_%H%M%S}")
@@ -0,0 +1,34 @@
+def sync_tree(tree, shown: dict, rows: list) -> int:
+    """
+    Приводит ttk.Treeview к rows ([(iid, values, tags)] в нужном порядке)
+    минимумом операций: исчезнувшие строки удаляются, новые вставляются на своё
+    место, изменившиеся обновляются, остальные не трогаются — без мерцания и
+    перестройки всего списка. shown — {iid: (values, tags)}, то, что сейчас
+    в дереве; обновляется на месте. Возвращает число изменённых строк.
+    """
+    wanted = {iid for iid, _, _ in rows}
+    stale = [iid for iid in shown if iid not in wanted]
+    if stale:
+        tree.delete(*stale)
+        for iid in stale:
+            del shown[iid]
+
+    changed = len(stale)
+    for index, (iid, values, tags) in enumerate(rows):
+        item = (tuple(values), tuple(tags))
+        current = shown.get(iid)
+        if current is None:
+            tree.insert("", index, iid=iid, values=item[0], tags=item[1])
+        elif current != item:
+            tree.item(iid, values=item[0], tags=item[1])
+        else:
+            continue
+        shown[iid] = item
+        changed += 1
+
+    # порядок оставшихся строк обычно не меняется; если поменялся — выравниваем
+    order = tuple(iid for iid, _, _ in rows)
+    if tuple(tree.get_children()) != order:
+        for index, iid in enumerate(order):
+            tree.move(iid, "", index)
+    return changed
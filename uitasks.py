@@ -0,0 +1,57 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+UI_WORKERS = 4
+# период опроса очереди результатов из потока Tk, мс
+POLL_MS = 100
+
+
+class UiTasks:
+    """
+    Фоновые задачи интерфейса: обращения к PostgreSQL, SQLite и диску выполняются
+    в пуле потоков, результат через result_queue возвращается в поток Tk, где
+    drain() (по root.after) вызывает обработчик. Задача с тем же ключом, пока
+    выполняется, повторно не запускается — двойной клик не шлёт второй запрос.
+    Виджеты Tk трогают только обработчики, фоновые функции — никогда.
+    """
+
+    def __init__(self, result_queue: queue.Queue, max_workers: int = UI_WORKERS):
+        self.queue = result_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ui-task")
+        # {ключ: Future}; меняется только из потока Tk
+        self.pending = {}
+
+    def submit(self, key: str, fn, *args, on_done=None, on_error=None) -> bool:
+        """Запускает fn(*args) в фоне; False — задача с этим ключом ещё выполняется."""
+        if key in self.pending:
+            return False
+        future = self.executor.submit(fn, *args)
+        self.pending[key] = future
+        future.add_done_callback(lambda f: self.queue.put((key, f, on_done, on_error)))
+        return True
+
+    def busy(self, key: str = None) -> bool:
+        return key in self.pending if key is not None else bool(self.pending)
+
+    def drain(self, limit: int = 100) -> int:
+        """Вызывает обработчики готовых задач (из потока Tk); возвращает их число."""
+        handled = 0
+        while handled < limit:
+            try:
+                key, future, on_done, on_error = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.pending.pop(key, None)
+            handled += 1
+            error = future.exception()
+            if error is None:
+                if on_done is not None:
+                    on_done(future.result())
+            elif on_error is not None:
+                on_error(error)
+            else:
+                print(f"Ошибка фоновой задачи {key}: {error}")
+        return handled
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
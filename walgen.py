@@ -0,0 +1,213 @@
+"""
+Детерминированный генератор вывода wal2json (format-version 1) и test_decoding
+для бенчмарков и проверок без PostgreSQL: строки (data, lsn) как у
+pg_logical_slot_peek_changes.
+
+    python walgen.py --transactions 1000 --output rows.jsonl
+    python walgen.py --transactions 1000 --tx-size 1 50 --mix INSERT=0.2,UPDATE=0.7,DELETE=0.1
+    python walgen.py --transactions 1000 --plugin test_decoding
+
+Один и тот же seed и параметры дают один и тот же поток.
+"""
+import argparse
+import json
+import random
+import string
+from collections import namedtuple
+from datetime import datetime, timezone
+
+# columns — [(имя, тип, ширина)]; ширина задаёт длину текстовых значений
+TableSpec = namedtuple("TableSpec", "schema name columns")
+
+DEFAULT_TABLES = [
+    TableSpec("public", "orders", [("id", "integer", 0), ("customer", "text", 24),
+                                   ("amount", "numeric", 0), ("status", "text", 12),
+                                   ("created_at", "timestamp with time zone", 0)]),
+    TableSpec("public", "customers", [("id", "integer", 0), ("name", "text", 32),
+                                      ("email", "text", 40), ("active", "boolean", 0)]),
+    TableSpec("public", "order_items", [("id", "integer", 0), ("order_id", "integer", 0),
+                                        ("sku", "text", 16), ("qty", "integer", 0),
+                                        ("comment", "text", 400)]),
+]
+DEFAULT_OP_MIX = {"INSERT": 0.5, "UPDATE": 0.4, "DELETE": 0.1}
+# 2025-12-15 10:00:00 UTC
+DEFAULT_START_TS = 1765792800
+DEFAULT_START_LSN = 0x1000000
+
+_ALPHABET = string.ascii_letters + string.digits + " .,-абвгдежзиклмнопрстуфхцч"
+
+
+def format_lsn(value: int) -> str:
+    return f"{value >> 32:X}/{value & 0xFFFFFFFF:X}"
+
+
+def parse_op_mix(text: str) -> dict:
+    """'INSERT=0.2,UPDATE=0.7,DELETE=0.1' → {"INSERT": 0.2, ...}."""
+    mix = {}
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        mix[op.strip().upper()] = float(weight)
+    return mix
+
+
+class WalGenerator:
+    """
+    Поток транзакций по таблицам tables: в транзакции от tx_size[0] до tx_size[1]
+    изменений, операции по весам op_mix. UPDATE и DELETE выбирают живую строку
+    (вставленную раньше), поэтому история ключей в потоке согласована; пока
+    живых строк нет, вместо них генерируется INSERT. Между транзакциями проходит
+    tx_interval секунд (значение timestamp), LSN растёт на размер записи.
+    """
+
+    def __init__(self, tables=None, op_mix: dict = None, tx_size=(1, 10), seed: int = 42,
+                 start_ts: float = DEFAULT_START_TS, tx_interval: float = 1.0,
+                 start_lsn: int = DEFAULT_START_LSN):
+        self.tables = list(tables or DEFAULT_TABLES)
+        mix = op_mix or DEFAULT_OP_MIX
+        self.ops = [op for op in ("INSERT", "UPDATE", "DELETE") if mix.get(op)]
+        self.weights = [mix[op] for op in self.ops]
+        self.tx_size = tx_size
+        self.rnd = random.Random(seed)
+        self.ts = start_ts
+        self.tx_interval = tx_interval
+        self.lsn = start_lsn
+        self.xid = 1000
+        self.next_id = {(t.schema, t.name): 1 for t in self.tables}
+        self.live = {(t.schema, t.name): [] for t in self.tables}
+
+    def _value(self, col_type: str, width: int):
+        rnd = self.rnd
+        if col_type == "integer":
+            return rnd.randint(1, 100000)
+        if col_type == "numeric":
+            return round(rnd.uniform(1, 10000), 2)
+        if col_type == "boolean":
+            return rnd.random() < 0.5
+        if col_type.startswith("timestamp"):
+            return datetime.fromtimestamp(self.ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S+00")
+        return "".join(rnd.choices(_ALPHABET, k=width or 16))
+
+    def _row(self, table: TableSpec, id_value: int) -> list:
+        return [id_value if name == "id" else self._value(col_type, width)
+                for name, col_type, width in table.columns]
+
+    def _change(self) -> dict:
+        table = self.rnd.choice(self.tables)
+        key = (table.schema, table.name)
+        live = self.live[key]
+        op = self.rnd.choices(self.ops, self.weights)[0]
+        if op != "INSERT" and not live:
+            op = "INSERT"
+
+        change = {"kind": op.lower(), "schema": table.schema, "table": table.name}
+        if op == "INSERT":
+            id_value = self.next_id[key]
+            self.next_id[key] += 1
+            live.append(id_value)
+        else:
+            index = self.rnd.randrange(len(live))
+            id_value = live[index]
+            if op == "DELETE":
+                # порядок живых строк не важен — удаление за O(1)
+                live[index] = live[-1]
+                live.pop()
+            change["oldkeys"] = {"keynames": ["id"], "keytypes": ["integer"], "keyvalues": [id_value]}
+        if op != "DELETE":
+            change["columnnames"] = [name for name, _, _ in table.columns]
+            change["columntypes"] = [col_type for _, col_type, _ in table.columns]
+            change["columnvalues"] = self._row(table, id_value)
+        return change
+
+    def transaction(self) -> dict:
+        """Следующая транзакция в виде записи wal2json."""
+        self.xid += 1
+        self.ts += self.tx_interval
+        timestamp = datetime.fromtimestamp(self.ts, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f+00")
+        size = self.rnd.randint(*self.tx_size)
+        return {"xid": self.xid, "timestamp": timestamp, "change": [self._change() for _ in range(size)]}
+
+    def rows(self, transactions: int, plugin: str = "wal2json"):
+        """
+        Генератор строк (data, lsn): для wal2json — по одной на транзакцию,
+        для test_decoding — BEGIN, строки изменений и COMMIT.
+        """
+        for _ in range(transactions):
+            transaction = self.transaction()
+            if plugin == "test_decoding":
+                lines = test_decoding_lines(transaction)
+            else:
+                lines = [json.dumps(transaction, ensure_ascii=False)]
+            for data in lines:
+                self.lsn += len(data) + 24
+                yield data, format_lsn(self.lsn)
+
+
+def _test_decoding_value(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _test_decoding_columns(names, types, values) -> str:
+    return " ".join(f"{name}[{col_type}]:{_test_decoding_value(value)}"
+                    for name, col_type, value in zip(names, types, values))
+
+
+def test_decoding_lines(transaction: dict) -> list:
+    """
+    Та же транзакция в выводе test_decoding (include-xids, include-timestamp).
+    UPDATE без old-key — ключ не менялся, REPLICA IDENTITY по умолчанию.
+    """
+    lines = [f"BEGIN {transaction['xid']}"]
+    for change in transaction["change"]:
+        header = f"table {change['schema']}.{change['table']}: {change['kind'].upper()}: "
+        if change["kind"] == "delete":
+            old = change["oldkeys"]
+            lines.append(header + _test_decoding_columns(old["keynames"], old["keytypes"], old["keyvalues"]))
+        else:
+            lines.append(header + _test_decoding_columns(change["columnnames"], change["columntypes"],
+                                                         change["columnvalues"]))
+    lines.append(f"COMMIT {transaction['xid']} (at {transaction['timestamp']})")
+    return lines
+
+
+def write_rows(path: str, rows) -> int:
+    """Пишет строки (data, lsn) в JSONL {"lsn": ..., "data": ...}; возвращает их число."""
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for data, lsn in rows:
+            f.write(json.dumps({"lsn": lsn, "data": data}, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def read_rows(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                yield row["data"], row["lsn"]
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Синтетический поток wal2json")
+    arg_parser.add_argument("--transactions", type=int, default=1000)
+    arg_parser.add_argument("--tx-size", type=int, nargs=2, default=(1, 10), metavar=("MIN", "MAX"))
+    arg_parser.add_argument("--mix", type=parse_op_mix, default=DEFAULT_OP_MIX,
+                            help="веса операций, например INSERT=0.5,UPDATE=0.4,DELETE=0.1")
+    arg_parser.add_argument("--seed", type=int, default=42)
+    arg_parser.add_argument("--plugin", choices=("wal2json", "test_decoding"), default="wal2json")
+    arg_parser.add_argument("--output", default="wal_rows.jsonl")
+    args = arg_parser.parse_args(argv)
+
+    generator = WalGenerator(op_mix=args.mix, tx_size=tuple(args.tx_size), seed=args.seed)
+    count = write_rows(args.output, generator.rows(args.transactions, args.plugin))
+    print(f"Записано {count} строк ({args.transactions} транзакций) в {args.output}")
+
+
+if __name__ == "__main__":
+    main()